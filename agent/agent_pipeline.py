@@ -1,8 +1,16 @@
 import os
+import json
+import hashlib
 import datetime
+import sqlite3
+import threading
+from contextlib import contextmanager
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import StateGraph, START, END
 from agent.state.state_types import State
 from agent.utils.logger import log_node_result
+from agent.utils.accounting import accounting
+from agent.utils.profiler import profiler
 from agent.utils.hpo_importance_filter import filter_hpo_by_importance
 from agent.llm.azure_llm_instance import get_llm_instance
 
@@ -12,10 +20,20 @@ from agent.nodes import (
     BeginningOfFlowNode, finalDiagnosisNode, GestaltMatcherNode,
     diseaseNormalizeForFinalNode, HPOwebSearchNode,
     NormalizePCFNode, NormalizeGestaltMatcherNode, NormalizeZeroShotNode, DiseaseSearchWithHPONode,
-    mergeCandidateResultsNode
+    mergeCandidateResultsNode, MAX_FLOW_DEPTH,
+    HPOwebSearchNodeAsync, DiseaseSearchWithHPONodeAsync, PCFnodeAsync, GestaltMatcherNodeAsync,
+    createZeroShotNodeAsync, NormalizeZeroShotNodeAsync, createDiagnosisNodeAsync, diseaseNormalizeNodeAsync,
+    diseaseSearchNodeAsync, reflectionNodeAsync, finalDiagnosisNodeAsync, diseaseNormalizeForFinalNodeAsync,
+    diseaseSearchAndReflectionNode, diseaseSearchAndReflectionNodeAsync,
+    streamingDiagnosisNode, streamingDiagnosisNodeAsync,
+    streamingDiagnosisAndReflectionNode, streamingDiagnosisAndReflectionNodeAsync,
 )
 
 
+# チェックポイントから再開・完了済み state を返した場合に progress_callback へ渡すノード名
+CHECKPOINT_PROGRESS_NODE = "__checkpoint__"
+
+
 NODE_DEFINITIONS = [
     ("BeginningOfFlowNode", BeginningOfFlowNode),
     ("createZeroShotNode", createZeroShotNode),
@@ -37,6 +55,25 @@ NODE_DEFINITIONS = [
     ("diseaseNormalizeForFinalNode", diseaseNormalizeForFinalNode),
 ]
 
+# arun() (graph.ainvoke) で使う非同期実装。ここに無いノードは同期版がスレッドで実行される。
+ASYNC_NODE_DEFINITIONS = {
+    "createZeroShotNode": createZeroShotNodeAsync,
+    "PCFnode": PCFnodeAsync,
+    "GestaltMatcherNode": GestaltMatcherNodeAsync,
+    "NormalizeZeroShotNode": NormalizeZeroShotNodeAsync,
+    "HPOwebSearchNode": HPOwebSearchNodeAsync,
+    "DiseaseSearchWithHPONode": DiseaseSearchWithHPONodeAsync,
+    "createDiagnosisNode": createDiagnosisNodeAsync,
+    "diseaseNormalizeNode": diseaseNormalizeNodeAsync,
+    "diseaseSearchNode": diseaseSearchNodeAsync,
+    "reflectionNode": reflectionNodeAsync,
+    "finalDiagnosisNode": finalDiagnosisNodeAsync,
+    "diseaseNormalizeForFinalNode": diseaseNormalizeForFinalNodeAsync,
+    "diseaseSearchAndReflectionNode": diseaseSearchAndReflectionNodeAsync,
+    "streamingDiagnosisNode": streamingDiagnosisNodeAsync,
+    "streamingDiagnosisAndReflectionNode": streamingDiagnosisAndReflectionNodeAsync,
+}
+
 EDGES = [
     (START, "BeginningOfFlowNode"),
     ("BeginningOfFlowNode", "PCFnode"),
@@ -58,15 +95,88 @@ EDGES = [
     ("diseaseNormalizeForFinalNode", END),
 ]
 
+# pipelined_reflection=True の場合、diseaseSearchNode と reflectionNode を
+# 疾患ごとに「検索→reflection」を流す diseaseSearchAndReflectionNode に置き換える
+PIPELINED_REPLACED_NODES = {"diseaseSearchNode", "reflectionNode"}
+PIPELINED_NODE_DEFINITIONS = [
+    ("diseaseSearchAndReflectionNode", diseaseSearchAndReflectionNode),
+]
+PIPELINED_EDGES = [
+    ("diseaseNormalizeNode", "diseaseSearchAndReflectionNode"),
+]
+
+# streaming_diagnosis=True の場合、暫定診断・正規化・知識検索を streamingDiagnosisNode にまとめ、
+# LLM の生成中に完成したケースから正規化と検索を始める
+STREAMING_REPLACED_NODES = {"createDiagnosisNode", "diseaseNormalizeNode", "diseaseSearchNode"}
+STREAMING_NODE_DEFINITIONS = [
+    ("streamingDiagnosisNode", streamingDiagnosisNode),
+]
+STREAMING_EDGES = [
+    (["mergeCandidateResultsNode", "HPOwebSearchNode"], "streamingDiagnosisNode"),
+    ("streamingDiagnosisNode", "reflectionNode"),
+]
+
+# 両方を有効にした場合は reflection までケースごとに流す
+STREAMING_PIPELINED_REPLACED_NODES = STREAMING_REPLACED_NODES | PIPELINED_REPLACED_NODES
+STREAMING_PIPELINED_NODE_DEFINITIONS = [
+    ("streamingDiagnosisAndReflectionNode", streamingDiagnosisAndReflectionNode),
+]
+STREAMING_PIPELINED_EDGES = [
+    (["mergeCandidateResultsNode", "HPOwebSearchNode"], "streamingDiagnosisAndReflectionNode"),
+]
+
+# (streaming_diagnosis, pipelined_reflection) -> (置き換えるノード, 追加ノード, 追加エッジ, 条件分岐元のノード)
+GRAPH_VARIANTS = {
+    (False, False): (set(), [], [], "reflectionNode"),
+    (False, True): (PIPELINED_REPLACED_NODES, PIPELINED_NODE_DEFINITIONS, PIPELINED_EDGES, "diseaseSearchAndReflectionNode"),
+    (True, False): (STREAMING_REPLACED_NODES, STREAMING_NODE_DEFINITIONS, STREAMING_EDGES, "reflectionNode"),
+    (True, True): (
+        STREAMING_PIPELINED_REPLACED_NODES, STREAMING_PIPELINED_NODE_DEFINITIONS,
+        STREAMING_PIPELINED_EDGES, "streamingDiagnosisAndReflectionNode",
+    ),
+}
+
+
+def _edge_uses_any(edge, node_names) -> bool:
+    src, dst = edge
+    sources = src if isinstance(src, list) else [src]
+    return dst in node_names or any(name in node_names for name in sources)
+
+
+def _env_flag(name: str) -> bool:
+    return os.getenv(name, "").strip().lower() in ("1", "true", "yes", "on")
+
 
 def _has_any_correct_reflection(reflection) -> bool:
     if not reflection or not hasattr(reflection, "ans") or not reflection.ans:
         return False
     return any(getattr(ans_item, "Correctness", False) for ans_item in reflection.ans)
 
+def _checkpoint_serializer():
+    # State には LLM ラッパーなど msgpack 化できないオブジェクトが含まれるため pickle にフォールバックさせる
+    from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+    return JsonPlusSerializer(pickle_fallback=True)
+
+
 class RareDiseaseDiagnosisPipeline:
-    def __init__(self, model_name: str = 'gpt-4o', enable_log=False, log_filename=None):
-        self.graph = self._build_graph()
+    def __init__(self, model_name: str = 'gpt-4o', enable_log=False, log_filename=None, checkpoint_path=None, pipelined_reflection=None, streaming_diagnosis=None):
+        # pipelined_reflection=True（または環境変数 PIPELINED_REFLECTION=1）で、
+        # 各暫定疾患の文献が揃った時点でその疾患の reflection を開始する
+        if pipelined_reflection is None:
+            pipelined_reflection = _env_flag("PIPELINED_REFLECTION")
+        self.pipelined_reflection = pipelined_reflection
+        # streaming_diagnosis=True（または環境変数 STREAMING_DIAGNOSIS=1）で、
+        # 暫定診断をストリーミング生成し、完成したケースから正規化・知識検索を始める
+        if streaming_diagnosis is None:
+            streaming_diagnosis = _env_flag("STREAMING_DIAGNOSIS")
+        self.streaming_diagnosis = streaming_diagnosis
+        # checkpoint_path を指定すると、ノード完了ごとに state を SQLite へ保存し、
+        # 同じ patient_id・モデル・入力の再実行時は最後に完了したノードから再開する
+        self.checkpoint_path = checkpoint_path or os.getenv("PIPELINE_CHECKPOINT_PATH") or None
+        self._async_graph = None
+        self._active_threads = set()
+        self._active_threads_lock = threading.Lock()
+        self.graph = self._build_graph(checkpointer=self._create_checkpointer())
         self.enable_log = enable_log
         self.logfile_path = None
         self.log_filename = log_filename
@@ -74,6 +184,7 @@ class RareDiseaseDiagnosisPipeline:
             self.logfile_path = self._get_logfile_path()
             self._write_graph_ascii_to_log()
         
+        self.model_name = model_name
         self.llm = get_llm_instance(model_name)
             
     def _get_logfile_path(self):
@@ -84,36 +195,175 @@ class RareDiseaseDiagnosisPipeline:
         timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
         return os.path.join(log_dir, f"agent_log_{timestamp}.log")
     
-    def _write_graph_ascii_to_log(self):
+    def _write_graph_ascii_to_log(self, logfile_path=None):
         # エージェントフロー図をASCIIでlogファイルの先頭に出力
         try:
             ascii_graph = self.graph.get_graph().draw_ascii()
         except Exception as e:
             ascii_graph = f"[Failed to draw graph: {e}]"
-        with open(self.logfile_path, "w", encoding="utf-8") as f:
+        with open(logfile_path or self.logfile_path, "w", encoding="utf-8") as f:
             f.write("=== Agent Flow Graph ===\n")
             f.write(ascii_graph)
             f.write("\n\n")
 
-    def _log(self, node_name, result):
+    def _log(self, node_name, result, state=None):
         if not self.enable_log:
             return
-        log_node_result(self.logfile_path, node_name, result)
+        # run() で患者ごとのログファイルが指定されていればそちらへ書き込む
+        logfile_path = (state or {}).get("logfile_path") or self.logfile_path
+        log_node_result(logfile_path, node_name, result)
+
+    def _create_checkpointer(self):
+        if not self.checkpoint_path:
+            return None
+        try:
+            from langgraph.checkpoint.sqlite import SqliteSaver
+        except ImportError as e:
+            raise ImportError(
+                "checkpoint_path requires the 'langgraph-checkpoint-sqlite' package."
+            ) from e
+        os.makedirs(os.path.dirname(os.path.abspath(self.checkpoint_path)), exist_ok=True)
+        # ノードは複数スレッドから実行されるため check_same_thread=False で共有する
+        conn = sqlite3.connect(self.checkpoint_path, check_same_thread=False)
+        return SqliteSaver(conn, serde=_checkpoint_serializer())
+
+    async def _get_async_graph(self):
+        """
+        arun() 用のグラフを返す。SqliteSaver は非同期APIを持たないため、
+        チェックポイント有効時のみ AsyncSqliteSaver でコンパイルしたグラフを別途用意する。
+        """
+        if not self.checkpoint_path:
+            return self.graph
+        if self._async_graph is None:
+            try:
+                import aiosqlite
+                from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+            except ImportError as e:
+                raise ImportError(
+                    "checkpoint_path requires the 'langgraph-checkpoint-sqlite' package."
+                ) from e
+            conn = await aiosqlite.connect(self.checkpoint_path)
+            self._async_graph = self._build_graph(
+                checkpointer=AsyncSqliteSaver(conn, serde=_checkpoint_serializer())
+            )
+        return self._async_graph
+
+    def _checkpoint_thread_id(self, initial_state):
+        """
+        チェックポイントのキー。patient_id・モデル名・入力（HPO・onset・sex・画像・オプション）のハッシュから作り、
+        モデルや入力を変えた再実行が別の実行の保存済み診断を返さないようにする。
+        """
+        image_path = initial_state.get("imagePath")
+        image_stat = None
+        if image_path and os.path.exists(image_path):
+            stat = os.stat(image_path)
+            image_stat = [stat.st_size, stat.st_mtime_ns]
+        inputs = {
+            "hpoList": initial_state.get("hpoList") or [],
+            "absentHpoList": initial_state.get("absentHpoList") or [],
+            "onset": initial_state.get("onset"),
+            "sex": initial_state.get("sex"),
+            "imagePath": image_path,
+            "image": image_stat,
+            "use_absentHPO": initial_state.get("use_absentHPO"),
+            "filter_impotance": initial_state.get("filter_impotance"),
+            "pipelined_reflection": self.pipelined_reflection,
+            "streaming_diagnosis": self.streaming_diagnosis,
+        }
+        digest = hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+        return f"{initial_state['patient_id']}:{self.model_name}:{digest}"
+
+    @contextmanager
+    def _checkpoint_config(self, initial_state, patient_id):
+        """
+        チェックポイントを使う場合は graph の config、使わない場合は None を渡す。
+        patient_id がない患者はキーを共有してしまうため保存しない。
+        同じキーの実行がこのプロセスで進行中なら、同じ thread に書き込まないよう保存せずに実行する。
+        """
+        if not self.checkpoint_path:
+            yield None
+            return
+        if not patient_id:
+            print("[Checkpoint] No patient_id given; running without a checkpoint.")
+            yield None
+            return
+        thread_id = self._checkpoint_thread_id(initial_state)
+        with self._active_threads_lock:
+            busy = thread_id in self._active_threads
+            if not busy:
+                self._active_threads.add(thread_id)
+        if busy:
+            print(f"[Checkpoint] {patient_id} is already running with the same inputs; running without a checkpoint.")
+            yield None
+            return
+        try:
+            yield {"configurable": {"thread_id": thread_id}}
+        finally:
+            with self._active_threads_lock:
+                self._active_threads.discard(thread_id)
+
+    def _resolve_checkpoint_input(self, snapshot, initial_state, resume):
+        """
+        チェックポイントの状態から graph.invoke に渡す入力を決める。
+        戻り値: (input, finished_state)。finished_state が None でなければ実行済みなのでそれを返す。
+        """
+        if not resume or not snapshot or not snapshot.values:
+            return initial_state, None
+        patient_id = initial_state.get("patient_id")
+        if snapshot.next:
+            print(f"[Checkpoint] Resuming {patient_id} before {list(snapshot.next)}.")
+            return None, None
+        if snapshot.values.get("finalDiagnosis") is not None:
+            print(f"[Checkpoint] {patient_id} has already completed. Returning the saved final state.")
+            return None, snapshot.values
+        return initial_state, None
+
+    @staticmethod
+    def _report_checkpoint(snapshot, graph_input, result, progress_callback):
+        """
+        チェックポイントを使った場合に progress_callback(CHECKPOINT_PROGRESS_NODE, update) を呼ぶ。
+        完了済みならノードは1つも実行されないため、呼び出し側はこれで再開されたことを知る。
+        """
+        if progress_callback is None:
+            return
+        if result is not None:
+            progress_callback(CHECKPOINT_PROGRESS_NODE, {"checkpoint": "completed", "next": []})
+        elif graph_input is None:
+            progress_callback(CHECKPOINT_PROGRESS_NODE, {"checkpoint": "resumed", "next": list(snapshot.next)})
 
-    def _build_graph(self):
+    def _build_graph(self, checkpointer=None):
         graph_builder = StateGraph(State)
         # ラップして各ノードの結果をログに記録
+        def handle_result(node_name, state, result):
+            self._log(node_name, result, state)
+            # プロンプト付きdictの場合はresult["result"]を返す
+            if isinstance(result, dict) and "result" in result:
+                return result["result"]
+            return result
+
         def wrap_node(node_func, node_name):
             def wrapped(state):
-                result = node_func(state)
-                self._log(node_name, result)
-                # プロンプト付きdictの場合はresult["result"]を返す
-                if isinstance(result, dict) and "result" in result:
-                    return result["result"]
-                return result
-            return wrapped
-
-        for node_name, node_func in NODE_DEFINITIONS:
+                return handle_result(node_name, state, node_func(state))
+
+            async_node_func = ASYNC_NODE_DEFINITIONS.get(node_name)
+            if async_node_func is None:
+                return wrapped
+
+            async def awrapped(state):
+                return handle_result(node_name, state, await async_node_func(state))
+
+            # invoke() では同期版、ainvoke() では非同期版が呼ばれる
+            return RunnableLambda(wrapped, afunc=awrapped, name=node_name)
+
+        replaced_nodes, extra_nodes, extra_edges, reflection_node_name = GRAPH_VARIANTS[
+            (bool(self.streaming_diagnosis), bool(self.pipelined_reflection))
+        ]
+        node_definitions = [
+            (name, func) for name, func in NODE_DEFINITIONS if name not in replaced_nodes
+        ] + extra_nodes
+        edges = [edge for edge in EDGES if not _edge_uses_any(edge, replaced_nodes)] + extra_edges
+
+        for node_name, node_func in node_definitions:
             graph_builder.add_node(node_name, wrap_node(node_func, node_name))
         
         def after_reflection_edge(state: State):
@@ -122,7 +372,7 @@ class RareDiseaseDiagnosisPipeline:
             # 1. depthのチェック
             depth = state.get("depth", 0)
             print(f"Current depth: {depth}")
-            if depth > 0:
+            if depth >= MAX_FLOW_DEPTH:
                 print("Depth limit reached, forcing to finalDiagnosisNode.")
                 return "ProceedToFinalDiagnosisNode"
 
@@ -160,19 +410,35 @@ class RareDiseaseDiagnosisPipeline:
                 print("--- End of after_reflection_edge ---\n")
                 return "ReturnToBeginningNode"
 
-        for src, dst in EDGES:
+        for src, dst in edges:
             graph_builder.add_edge(src, dst)
 
         graph_builder.add_conditional_edges(
-            "reflectionNode", after_reflection_edge, path_map={
+            reflection_node_name, after_reflection_edge, path_map={
                 "ReturnToBeginningNode": "BeginningOfFlowNode",
                 "ProceedToFinalDiagnosisNode": "finalDiagnosisNode"
             }
         )
         
-        return graph_builder.compile()
+        return graph_builder.compile(checkpointer=checkpointer)
+
+    def _get_run_logfile_path(self, log_filename=None):
+        """
+        run() 単位のログファイルパスを返す。
+        1つのパイプラインを複数患者で使い回す場合に、患者ごとにログを分けるために使う。
+        """
+        if not self.enable_log:
+            return None
+        if not log_filename:
+            return self.logfile_path
+        log_dir = os.path.join(os.getcwd(), "log")
+        os.makedirs(log_dir, exist_ok=True)
+        logfile_path = os.path.join(log_dir, log_filename)
+        if logfile_path != self.logfile_path:
+            self._write_graph_ascii_to_log(logfile_path)
+        return logfile_path
 
-    def _build_initial_state(self, hpo_list, image_path=None, absent_hpo_list=None, onset=None, sex=None, patient_id=None, use_absentHPO=False, filter_impotance=False):
+    def _build_initial_state(self, hpo_list, image_path=None, absent_hpo_list=None, onset=None, sex=None, patient_id=None, use_absentHPO=False, filter_impotance=False, logfile_path=None):
         if filter_impotance:
             hpo_list = filter_hpo_by_importance(hpo_list)
             absent_hpo_list = filter_hpo_by_importance(absent_hpo_list or [])
@@ -187,10 +453,13 @@ class RareDiseaseDiagnosisPipeline:
             "imagePath": image_path,
             "pubCaseFinder": [],
             "GestaltMatcher": [],
+            "gestaltMatcherFullResult": None,
             "hpoDict": {},
             "absentHpoDict": {},
             "zeroShotResult": None,
+            "zeroShotNormalized": False,
             "phenotypeSearchResult": None,
+            "phenotypeSearchFullResult": None,
             "mergedDiseaseCandidates": [],
             "webresources": [],
             "memory": [],
@@ -201,9 +470,45 @@ class RareDiseaseDiagnosisPipeline:
             "sex": sex if sex else "Unknown",
             "patient_id": patient_id if patient_id else "unknown",
             "llm": self.llm,
+            "logfile_path": logfile_path,
         }
 
-    def run(self, hpo_list, image_path=None, verbose=False, absent_hpo_list=None, onset=None, sex=None, patient_id=None, use_absentHPO=False, filter_impotance=False):
+    @staticmethod
+    def _invoke_graph(graph, graph_input, config, progress_callback):
+        """
+        graph.invoke と同じ最終 state を返す。progress_callback(node_name, update) があれば、
+        graph.stream でノードが完了するたびに呼び出す。
+        """
+        if progress_callback is None:
+            return graph.invoke(graph_input, config)
+        result = None
+        for mode, data in graph.stream(graph_input, config, stream_mode=["updates", "values"]):
+            if mode == "values":
+                result = data
+            else:
+                for node_name, update in data.items():
+                    progress_callback(node_name, update)
+        return result
+
+    @staticmethod
+    async def _ainvoke_graph(graph, graph_input, config, progress_callback):
+        """_invoke_graph の非同期版（graph.ainvoke / graph.astream）"""
+        if progress_callback is None:
+            return await graph.ainvoke(graph_input, config)
+        result = None
+        async for mode, data in graph.astream(graph_input, config, stream_mode=["updates", "values"]):
+            if mode == "values":
+                result = data
+            else:
+                for node_name, update in data.items():
+                    progress_callback(node_name, update)
+        return result
+
+    def run(self, hpo_list, image_path=None, verbose=False, absent_hpo_list=None, onset=None, sex=None, patient_id=None, use_absentHPO=False, filter_impotance=False, log_filename=None, resume=True, progress_callback=None):
+        """
+        progress_callback(node_name, update) を渡すと、ノードが完了するたびにその名前と state の更新分で呼び出す。
+        チェックポイントから再開した場合・完了済みの state を返す場合は、最初に CHECKPOINT_PROGRESS_NODE で呼び出す。
+        """
         initial_state = self._build_initial_state(
             hpo_list=hpo_list,
             image_path=image_path,
@@ -213,8 +518,54 @@ class RareDiseaseDiagnosisPipeline:
             patient_id=patient_id,
             use_absentHPO=use_absentHPO,
             filter_impotance=filter_impotance,
+            logfile_path=self._get_run_logfile_path(log_filename),
         )
-        result = self.graph.invoke(initial_state)
+        with self._checkpoint_config(initial_state, patient_id) as config, \
+                accounting.patient_scope(initial_state["patient_id"]), profiler.run_scope(initial_state["patient_id"]):
+            if config is None:
+                result = self._invoke_graph(self.graph, initial_state, None, progress_callback)
+            else:
+                snapshot = self.graph.get_state(config)
+                graph_input, result = self._resolve_checkpoint_input(snapshot, initial_state, resume)
+                self._report_checkpoint(snapshot, graph_input, result, progress_callback)
+                if result is None:
+                    if not resume:
+                        self.graph.checkpointer.delete_thread(config["configurable"]["thread_id"])
+                    result = self._invoke_graph(self.graph, graph_input, config, progress_callback)
+        if verbose:
+            self.pretty_print(result)
+        return result
+
+    async def arun(self, hpo_list, image_path=None, verbose=False, absent_hpo_list=None, onset=None, sex=None, patient_id=None, use_absentHPO=False, filter_impotance=False, log_filename=None, resume=True, progress_callback=None):
+        """
+        run() の非同期版。graph.ainvoke を使い、I/O バウンドなノードは非同期実装で実行する。
+        複数患者の arun() を1つのイベントループ上で並行して実行できる。
+        progress_callback はイベントループのスレッドから呼ばれる（run() と同じ引数）。
+        """
+        initial_state = self._build_initial_state(
+            hpo_list=hpo_list,
+            image_path=image_path,
+            absent_hpo_list=absent_hpo_list,
+            onset=onset,
+            sex=sex,
+            patient_id=patient_id,
+            use_absentHPO=use_absentHPO,
+            filter_impotance=filter_impotance,
+            logfile_path=self._get_run_logfile_path(log_filename),
+        )
+        graph = await self._get_async_graph()
+        with self._checkpoint_config(initial_state, patient_id) as config, \
+                accounting.patient_scope(initial_state["patient_id"]), profiler.run_scope(initial_state["patient_id"]):
+            if config is None:
+                result = await self._ainvoke_graph(graph, initial_state, None, progress_callback)
+            else:
+                snapshot = await graph.aget_state(config)
+                graph_input, result = self._resolve_checkpoint_input(snapshot, initial_state, resume)
+                self._report_checkpoint(snapshot, graph_input, result, progress_callback)
+                if result is None:
+                    if not resume:
+                        await graph.checkpointer.adelete_thread(config["configurable"]["thread_id"])
+                    result = await self._ainvoke_graph(graph, graph_input, config, progress_callback)
         if verbose:
             self.pretty_print(result)
         return result
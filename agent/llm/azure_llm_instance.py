@@ -5,8 +5,6 @@ from dotenv import load_dotenv
 # カレントディレクトリの.envファイルを読み込む
 load_dotenv()
 
-from .llm_wrapper import AzureOpenAIWrapper
-
 
 MODEL_ENV_PREFIX = {
     "gpt-4o": "AZURE_OPENAI_4o",
@@ -35,6 +33,8 @@ def get_llm_instance(model_name: str = 'gpt-4o'):
     if not all([endpoint, api_key, deployment_name, api_version]):
         raise ValueError(f"Environment variables for model '{model_name}' are not fully set.")
 
+    # langchain_openai を含むラッパーは、モデル設定（MODEL_ENV_PREFIX）だけを参照する場合に読み込まない
+    from .llm_wrapper import AzureOpenAIWrapper
     return AzureOpenAIWrapper(
         model_name=model_name,
         azure_endpoint=endpoint,
@@ -45,4 +45,10 @@ def get_llm_instance(model_name: str = 'gpt-4o'):
 
 # デフォルトのインスタンス（後方互換性のため、あるいは単体テスト用）
 # ただし、新しい設計では直接この変数をインポートしないことが推奨される
-azure_llm = get_llm_instance('gpt-4o')
\ No newline at end of file
+# import 時には作らず、最初に azure_llm が参照されたときに作る（環境変数が未設定でも import できる）
+def __getattr__(name: str):
+    if name == "azure_llm":
+        llm = get_llm_instance('gpt-4o')
+        globals()["azure_llm"] = llm
+        return llm
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,8 +1,20 @@
+import asyncio
 import os
+import threading
+import time
+import weakref
 
+import httpx
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import AIMessage
 from langchain_core.rate_limiters import InMemoryRateLimiter
 from langchain_openai import AzureChatOpenAI
-from typing import Any, Dict, Optional
+from typing import Any, AsyncIterator, Dict, Iterator, Optional
+
+from .rate_limiter import estimate_tokens, get_shared_rate_limiter
+from .response_cache import RESPONSE_CACHE_METADATA_KEY, serialize_llm_input, get_response_cache, schema_signature
+from .scheduler import DEFAULT_LANE, PriorityDispatcher
+from ..utils.accounting import CallRecord, accounting
 
 
 CONTENT_FILTER_MARKERS = [
@@ -18,6 +30,48 @@ def is_content_filter_error(error: Exception) -> bool:
     return any(marker in message for marker in CONTENT_FILTER_MARKERS)
 
 
+def _chunk_text(chunk: Any) -> str:
+    content = chunk.content if hasattr(chunk, "content") else chunk
+    return content if isinstance(content, str) else str(content or "")
+
+
+class _UsageCallback(BaseCallbackHandler):
+    """応答の usage_metadata（入力・出力・キャッシュ済み入力トークン数）を CallRecord に加算する"""
+
+    run_inline = True
+
+    def __init__(self, record: CallRecord):
+        self.record = record
+
+    def on_llm_end(self, response, **kwargs):
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    self.record.add_usage(
+                        usage.get("input_tokens", 0),
+                        usage.get("output_tokens", 0),
+                        (usage.get("input_token_details") or {}).get("cache_read", 0),
+                    )
+
+
+# 生成済みのラッパーをモデル名で引けるようにしておく（チェックポイント復元時に再利用する）
+_live_wrappers: "weakref.WeakValueDictionary[str, AzureOpenAIWrapper]" = weakref.WeakValueDictionary()
+
+
+def _restore_llm_wrapper(model_name: str):
+    """
+    pickle されたラッパーを復元する。
+    APIキー等をチェックポイントに書き出さないよう、モデル名だけを保存し、
+    同一プロセスに生きているラッパーがあればそれを、なければ環境変数から作り直す。
+    """
+    wrapper = _live_wrappers.get(model_name)
+    if wrapper is not None:
+        return wrapper
+    from .azure_llm_instance import get_llm_instance
+    return get_llm_instance(model_name)
+
+
 class AzureOpenAIWrapper:
     def __init__(self, model_name, azure_endpoint, api_key, deployment_name, api_version):
         # 設定を保持（再構築時に使用）
@@ -30,14 +84,42 @@ class AzureOpenAIWrapper:
         # デフォルトのトークン数
         self.default_max_tokens = 8192 if model_name == 'gpt-4o' else 15000
 
-        self.rate_limiter = InMemoryRateLimiter(
-            requests_per_second=float(os.getenv("AZURE_LLM_REQUESTS_PER_SECOND", "0.25")),
-            check_every_n_seconds=float(os.getenv("AZURE_LLM_RATE_CHECK_SECONDS", "0.5")),
-            max_bucket_size=float(os.getenv("AZURE_LLM_MAX_BUCKET_SIZE", "1")),
-        )
+        # AZURE_LLM_SHARED_LIMITER_PATH が設定されていれば、同一ホストの全プロセスで共有する RPM/TPM リミッタを使う。
+        # どちらのリミッタもチャットモデルには持たせず、ラッパーがレーンの優先順位に従って枠を取る
+        self.shared_rate_limiter = get_shared_rate_limiter(deployment_name)
+        if self.shared_rate_limiter is not None:
+            self.rate_limiter = None
+        else:
+            self.rate_limiter = InMemoryRateLimiter(
+                requests_per_second=float(os.getenv("AZURE_LLM_REQUESTS_PER_SECOND", "0.25")),
+                check_every_n_seconds=float(os.getenv("AZURE_LLM_RATE_CHECK_SECONDS", "0.5")),
+                max_bucket_size=float(os.getenv("AZURE_LLM_MAX_BUCKET_SIZE", "1")),
+            )
         
+        # final > reflection > diagnosis > zeroshot > summary の順にレート制限の枠を割り当てる
+        self.dispatcher = PriorityDispatcher.from_env()
+
+        # LLM_RESPONSE_CACHE_PATH が設定されていれば、同じプロンプト・パラメータの応答をディスクから返す
+        self.response_cache = get_response_cache()
+
+        # 全チャットモデルで1つのコネクションプールを共有し、呼び出しごとの TLS ハンドシェイクを避ける
+        max_connections = int(os.getenv("AZURE_LLM_MAX_CONNECTIONS", "20"))
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.http_client = httpx.Client(limits=limits)
+        self.http_async_client = httpx.AsyncClient(limits=limits)
+
+        # (max_tokens, timeout) -> AzureChatOpenAI, (max_tokens, timeout, schema) -> 構造化出力 runnable
+        self._llm_pool: Dict[tuple, AzureChatOpenAI] = {}
+        self._structured_pool: Dict[tuple, Any] = {}
+        self._pool_lock = threading.Lock()
+
         # 初期LLMインスタンスを作成
-        self.llm = self._create_llm(self.default_max_tokens)
+        self.llm = self._get_pooled_llm(self.default_max_tokens)
+        _live_wrappers[model_name] = self
+
+    def __reduce__(self):
+        # チェックポイント（pickle）にはモデル名だけを残す
+        return (_restore_llm_wrapper, (self.model_name,))
     
     def _create_llm(
         self,
@@ -58,7 +140,8 @@ class AzureOpenAIWrapper:
             "api_key": self.api_key,
             "deployment_name": self.deployment_name,
             "api_version": self.api_version,
-            "rate_limiter": self.rate_limiter,
+            "http_client": self.http_client,
+            "http_async_client": self.http_async_client,
         }
         if timeout_seconds is not None:
             llm_params["timeout"] = timeout_seconds
@@ -74,6 +157,16 @@ class AzureOpenAIWrapper:
             }
         
         return AzureChatOpenAI(**llm_params)
+
+    def _get_pooled_llm(self, max_completion_tokens: int, timeout_seconds: Optional[float] = None) -> AzureChatOpenAI:
+        """同じトークン上限・タイムアウトの LLM インスタンスは作り直さずに再利用する"""
+        key = (max_completion_tokens, timeout_seconds)
+        with self._pool_lock:
+            chat_llm = self._llm_pool.get(key)
+            if chat_llm is None:
+                chat_llm = self._create_llm(max_completion_tokens, timeout_seconds=timeout_seconds)
+                self._llm_pool[key] = chat_llm
+            return chat_llm
     
     def get_temp_llm_with_max_tokens(
         self,
@@ -81,7 +174,8 @@ class AzureOpenAIWrapper:
         timeout_seconds: Optional[float] = None,
     ) -> AzureChatOpenAI:
         """
-        一時的なLLMインスタンスを作成（元のインスタンスは変更しない）
+        一時的なLLMインスタンスを取得（元のインスタンスは変更しない）
+        同じ引数のインスタンスはプールから再利用する。
         
         Args:
             max_completion_tokens: トークン数の上限
@@ -89,11 +183,90 @@ class AzureOpenAIWrapper:
         Returns:
             AzureChatOpenAI: 新しいLLMインスタンス
         """
-        return self._create_llm(max_completion_tokens, timeout_seconds=timeout_seconds)
+        return self._get_pooled_llm(max_completion_tokens, timeout_seconds=timeout_seconds)
+
+    def get_structured_llm(
+        self,
+        output_schema,
+        max_completion_tokens: Optional[int] = None,
+        timeout_seconds: Optional[float] = None,
+    ):
+        """
+        構造化出力用のLLMを取得
+        トークン上限やタイムアウトを指定した場合は一時的なLLMインスタンスから作成する。
+        応答キャッシュのキーに使うため、デプロイメント・生成パラメータ・スキーマを metadata に付与する。
+        (トークン上限, タイムアウト, スキーマ) ごとに作成済みの runnable を再利用する。
+        """
+        max_completion_tokens = max_completion_tokens or self.default_max_tokens
+        key = (max_completion_tokens, timeout_seconds, output_schema)
+        with self._pool_lock:
+            structured_llm = self._structured_pool.get(key)
+        if structured_llm is not None:
+            return structured_llm
+
+        base_llm = self._get_pooled_llm(max_completion_tokens, timeout_seconds=timeout_seconds)
+        signature = {**self._llm_signature(base_llm), "schema": schema_signature(output_schema)}
+        structured_llm = base_llm.with_structured_output(output_schema).with_config(
+            metadata={RESPONSE_CACHE_METADATA_KEY: signature}
+        )
+        with self._pool_lock:
+            return self._structured_pool.setdefault(key, structured_llm)
+
+    def _llm_signature(self, chat_llm: AzureChatOpenAI) -> Dict[str, Any]:
+        """応答に影響するパラメータだけを集める（タイムアウトやレート制限は含めない）"""
+        return {
+            "model": self.model_name,
+            "deployment": getattr(chat_llm, "deployment_name", None) or self.deployment_name,
+            "max_tokens": getattr(chat_llm, "max_tokens", None),
+            "temperature": getattr(chat_llm, "temperature", None),
+            "extra_body": getattr(chat_llm, "extra_body", None),
+        }
 
-    def get_structured_llm(self, output_schema):
-        """構造化出力用のLLMを取得"""
-        return self.llm.with_structured_output(output_schema)
+    def _runnable_signature(self, runnable: Any) -> Optional[Dict[str, Any]]:
+        if isinstance(runnable, AzureChatOpenAI):
+            return self._llm_signature(runnable)
+        config = getattr(runnable, "config", None) or {}
+        return (config.get("metadata") or {}).get(RESPONSE_CACHE_METADATA_KEY)
+
+    def _response_cache_key(self, runnable: Any, input_data: Any) -> Optional[str]:
+        if self.response_cache is None:
+            return None
+        signature = self._runnable_signature(runnable)
+        # シグネチャの分からない runnable はキャッシュしない
+        if signature is None:
+            return None
+        return self.response_cache.make_key(signature, input_data)
+
+    def _estimate_request_tokens(self, runnable: Any, input_data: Any) -> int:
+        signature = self._runnable_signature(runnable) or {}
+        max_tokens = signature.get("max_tokens") or (signature.get("extra_body") or {}).get("max_completion_tokens")
+        return estimate_tokens(str(serialize_llm_input(input_data)), max_tokens or self.default_max_tokens)
+
+    def _acquire_rate_limit(self, runnable: Any, input_data: Any):
+        if self.shared_rate_limiter is None:
+            self.rate_limiter.acquire(blocking=True)
+            return
+        waited = self.shared_rate_limiter.acquire(self._estimate_request_tokens(runnable, input_data))
+        if waited >= 1.0:
+            print(f"[RateLimiter] {self.deployment_name}: {waited:.1f}秒待機しました")
+
+    async def _aacquire_rate_limit(self, runnable: Any, input_data: Any):
+        if self.shared_rate_limiter is None:
+            await self.rate_limiter.aacquire(blocking=True)
+            return
+        waited = await self.shared_rate_limiter.aacquire(self._estimate_request_tokens(runnable, input_data))
+        if waited >= 1.0:
+            print(f"[RateLimiter] {self.deployment_name}: {waited:.1f}秒待機しました")
+
+    @staticmethod
+    def _fill_stream_usage(record: CallRecord, runnable: Any, input_data: Any, chunks: list):
+        """ストリーミング応答に usage が付かない API バージョンでは文字数から見積もる"""
+        if record.prompt_tokens or record.completion_tokens:
+            return
+        record.add_usage(
+            estimate_tokens(str(serialize_llm_input(input_data)), 0),
+            estimate_tokens("".join(chunks), 0),
+        )
 
     def invoke_with_content_filter_retry(
         self,
@@ -101,11 +274,71 @@ class AzureOpenAIWrapper:
         input_data: Any,
         context: str = "LLM",
         retry_count: int = 1,
+        lane: str = DEFAULT_LANE,
+    ):
+        """
+        content filter に引っ掛かった場合だけ、同じ呼び出しを指定回数再試行する。
+        lane は scheduler.LANE_PRIORITIES のいずれか。レート制限の枠は優先度の高いレーンから割り当てる。
+        """
+        with accounting.track("llm", context, model=self.model_name, lane=lane) as record:
+            cache_key = self._response_cache_key(runnable, input_data)
+            if cache_key is not None:
+                hit, cached = self.response_cache.get(cache_key)
+                if hit:
+                    record.cache_hit = True
+                    return cached
+
+            result = self._invoke_with_content_filter_retry(runnable, input_data, context, retry_count, lane, record)
+            if cache_key is not None:
+                self.response_cache.put(cache_key, result)
+            return result
+
+    def _invoke_with_content_filter_retry(self, runnable, input_data, context, retry_count, lane, record):
+        for attempt in range(retry_count + 1):
+            record.retries = attempt
+            try:
+                waiting_since = time.time()
+                with self.dispatcher.slot(lane, lambda: self._acquire_rate_limit(runnable, input_data)):
+                    record.rate_wait_seconds += time.time() - waiting_since
+                    return runnable.invoke(input_data, config={"callbacks": [_UsageCallback(record)]})
+            except Exception as e:
+                if not is_content_filter_error(e) or attempt >= retry_count:
+                    raise
+                print(
+                    f"[{context}] Content filter triggered. "
+                    f"Retrying once ({attempt + 1}/{retry_count})."
+                )
+    
+    async def ainvoke_with_content_filter_retry(
+        self,
+        runnable: Any,
+        input_data: Any,
+        context: str = "LLM",
+        retry_count: int = 1,
+        lane: str = DEFAULT_LANE,
     ):
-        """content filter に引っ掛かった場合だけ、同じ呼び出しを指定回数再試行する。"""
+        """invoke_with_content_filter_retry の非同期版。runnable.ainvoke を使う。"""
+        with accounting.track("llm", context, model=self.model_name, lane=lane) as record:
+            cache_key = self._response_cache_key(runnable, input_data)
+            if cache_key is not None:
+                hit, cached = await asyncio.to_thread(self.response_cache.get, cache_key)
+                if hit:
+                    record.cache_hit = True
+                    return cached
+
+            result = await self._ainvoke_with_content_filter_retry(runnable, input_data, context, retry_count, lane, record)
+            if cache_key is not None:
+                await asyncio.to_thread(self.response_cache.put, cache_key, result)
+            return result
+
+    async def _ainvoke_with_content_filter_retry(self, runnable, input_data, context, retry_count, lane, record):
         for attempt in range(retry_count + 1):
+            record.retries = attempt
             try:
-                return runnable.invoke(input_data)
+                waiting_since = time.time()
+                async with self.dispatcher.aslot(lane, lambda: self._aacquire_rate_limit(runnable, input_data)):
+                    record.rate_wait_seconds += time.time() - waiting_since
+                    return await runnable.ainvoke(input_data, config={"callbacks": [_UsageCallback(record)]})
             except Exception as e:
                 if not is_content_filter_error(e) or attempt >= retry_count:
                     raise
@@ -114,6 +347,106 @@ class AzureOpenAIWrapper:
                     f"Retrying once ({attempt + 1}/{retry_count})."
                 )
     
-    def generate(self, prompt: str) -> str:
+    def stream_with_content_filter_retry(
+        self,
+        runnable: Any,
+        input_data: Any,
+        context: str = "LLM",
+        retry_count: int = 1,
+        lane: str = DEFAULT_LANE,
+    ) -> Iterator[str]:
+        """
+        runnable.stream の出力テキストを順に返す。
+        content filter の再試行は、まだ1チャンクも返していない場合に限る。
+        応答キャッシュは invoke と共有し、ヒットした場合は全文を1チャンクで返す。
+        """
+        with accounting.track("llm", context, model=self.model_name, lane=lane) as record:
+            cache_key = self._response_cache_key(runnable, input_data)
+            if cache_key is not None:
+                hit, cached = self.response_cache.get(cache_key)
+                if hit:
+                    record.cache_hit = True
+                    yield _chunk_text(cached)
+                    return
+
+            chunks = []
+            for chunk in self._stream_with_content_filter_retry(runnable, input_data, context, retry_count, lane, record):
+                chunks.append(chunk)
+                yield chunk
+            self._fill_stream_usage(record, runnable, input_data, chunks)
+            if cache_key is not None:
+                self.response_cache.put(cache_key, AIMessage(content="".join(chunks)))
+
+    def _stream_with_content_filter_retry(self, runnable, input_data, context, retry_count, lane, record):
+        for attempt in range(retry_count + 1):
+            record.retries = attempt
+            started = False
+            try:
+                waiting_since = time.time()
+                with self.dispatcher.slot(lane, lambda: self._acquire_rate_limit(runnable, input_data)):
+                    record.rate_wait_seconds += time.time() - waiting_since
+                    for chunk in runnable.stream(input_data, config={"callbacks": [_UsageCallback(record)]}):
+                        started = True
+                        yield _chunk_text(chunk)
+                return
+            except Exception as e:
+                if started or not is_content_filter_error(e) or attempt >= retry_count:
+                    raise
+                print(
+                    f"[{context}] Content filter triggered. "
+                    f"Retrying once ({attempt + 1}/{retry_count})."
+                )
+
+    async def astream_with_content_filter_retry(
+        self,
+        runnable: Any,
+        input_data: Any,
+        context: str = "LLM",
+        retry_count: int = 1,
+        lane: str = DEFAULT_LANE,
+    ) -> AsyncIterator[str]:
+        """stream_with_content_filter_retry の非同期版。runnable.astream を使う。"""
+        with accounting.track("llm", context, model=self.model_name, lane=lane) as record:
+            cache_key = self._response_cache_key(runnable, input_data)
+            if cache_key is not None:
+                hit, cached = await asyncio.to_thread(self.response_cache.get, cache_key)
+                if hit:
+                    record.cache_hit = True
+                    yield _chunk_text(cached)
+                    return
+
+            chunks = []
+            async for chunk in self._astream_with_content_filter_retry(runnable, input_data, context, retry_count, lane, record):
+                chunks.append(chunk)
+                yield chunk
+            self._fill_stream_usage(record, runnable, input_data, chunks)
+            if cache_key is not None:
+                await asyncio.to_thread(self.response_cache.put, cache_key, AIMessage(content="".join(chunks)))
+
+    async def _astream_with_content_filter_retry(self, runnable, input_data, context, retry_count, lane, record):
+        for attempt in range(retry_count + 1):
+            record.retries = attempt
+            started = False
+            try:
+                waiting_since = time.time()
+                async with self.dispatcher.aslot(lane, lambda: self._aacquire_rate_limit(runnable, input_data)):
+                    record.rate_wait_seconds += time.time() - waiting_since
+                    async for chunk in runnable.astream(input_data, config={"callbacks": [_UsageCallback(record)]}):
+                        started = True
+                        yield _chunk_text(chunk)
+                return
+            except Exception as e:
+                if started or not is_content_filter_error(e) or attempt >= retry_count:
+                    raise
+                print(
+                    f"[{context}] Content filter triggered. "
+                    f"Retrying once ({attempt + 1}/{retry_count})."
+                )
+
+    def generate(self, prompt: str, lane: str = DEFAULT_LANE) -> str:
         """通常のテキスト生成用のメソッド"""
-        return self.invoke_with_content_filter_retry(self.llm, prompt, context="Generate")
+        return self.invoke_with_content_filter_retry(self.llm, prompt, context="Generate", lane=lane)
+
+    async def agenerate(self, prompt: str, lane: str = DEFAULT_LANE) -> str:
+        """generate の非同期版"""
+        return await self.ainvoke_with_content_filter_retry(self.llm, prompt, context="Generate", lane=lane)
@@ -0,0 +1,181 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional, Tuple
+
+
+WINDOW_SECONDS = 60.0
+
+
+class SharedRateLimiter:
+    """
+    同一ホスト上の複数プロセスで共有するレート制限（SQLite）。
+    デプロイメントごとに直近60秒の requests-per-minute と tokens-per-minute を数え、
+    待機中のリクエストには到着順（waiters テーブルの id 順）で枠を割り当てる。
+
+    トークン数は Azure OpenAI と同様に「プロンプトの推定トークン + max_tokens」で見積もる。
+    """
+
+    def __init__(
+        self,
+        path: str,
+        deployment: str,
+        requests_per_minute: float,
+        tokens_per_minute: Optional[float] = None,
+        poll_seconds: float = 0.5,
+        waiter_timeout_seconds: float = 30.0,
+    ):
+        self.path = path
+        self.deployment = deployment
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.poll_seconds = poll_seconds
+        # この時間 heartbeat の無い待機者は終了したプロセスのものとみなして削除する
+        self.waiter_timeout_seconds = waiter_timeout_seconds
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS grants ("
+            "deployment TEXT NOT NULL, granted_at REAL NOT NULL, tokens INTEGER NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS grants_deployment ON grants(deployment, granted_at)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS waiters ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, deployment TEXT NOT NULL, "
+            "pid INTEGER NOT NULL, tokens INTEGER NOT NULL, last_seen REAL NOT NULL)"
+        )
+
+    def _register_waiter(self, tokens: int) -> int:
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO waiters (deployment, pid, tokens, last_seen) VALUES (?, ?, ?, ?)",
+                (self.deployment, os.getpid(), tokens, time.time()),
+            )
+            return cursor.lastrowid
+
+    def _remove_waiter(self, waiter_id: int):
+        with self._lock:
+            self._conn.execute("DELETE FROM waiters WHERE id = ?", (waiter_id,))
+
+    def _try_acquire(self, waiter_id: int, tokens: int) -> Tuple[bool, float]:
+        """
+        枠が取れれば (True, 0)、取れなければ (False, 次に確認するまでの秒数) を返す。
+        先頭の待機者でない場合は、先に並んでいる待機者が取るまで待つ。
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "DELETE FROM grants WHERE deployment = ? AND granted_at < ?",
+                    (self.deployment, now - WINDOW_SECONDS),
+                )
+                self._conn.execute(
+                    "DELETE FROM waiters WHERE deployment = ? AND last_seen < ?",
+                    (self.deployment, now - self.waiter_timeout_seconds),
+                )
+                self._conn.execute("UPDATE waiters SET last_seen = ? WHERE id = ?", (now, waiter_id))
+
+                head = self._conn.execute(
+                    "SELECT MIN(id) FROM waiters WHERE deployment = ?", (self.deployment,)
+                ).fetchone()[0]
+                if head is not None and head != waiter_id:
+                    self._conn.execute("COMMIT")
+                    return False, self.poll_seconds
+
+                count, used_tokens, oldest = self._conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(tokens), 0), MIN(granted_at) FROM grants WHERE deployment = ?",
+                    (self.deployment,),
+                ).fetchone()
+                within_rpm = count + 1 <= self.requests_per_minute
+                # 1件で TPM を超える見積もりでも、窓が空なら通す（永久に待たないように）
+                within_tpm = (
+                    not self.tokens_per_minute
+                    or used_tokens + tokens <= self.tokens_per_minute
+                    or count == 0
+                )
+                if within_rpm and within_tpm:
+                    self._conn.execute(
+                        "INSERT INTO grants (deployment, granted_at, tokens) VALUES (?, ?, ?)",
+                        (self.deployment, now, tokens),
+                    )
+                    self._conn.execute("DELETE FROM waiters WHERE id = ?", (waiter_id,))
+                    self._conn.execute("COMMIT")
+                    return True, 0.0
+
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+        # 最も古い枠が窓から外れるまで待つ（ただし heartbeat のため poll_seconds を上限とする）
+        wait = (oldest + WINDOW_SECONDS - now) if oldest is not None else self.poll_seconds
+        return False, max(0.05, min(wait, self.poll_seconds))
+
+    def acquire(self, tokens: int = 0) -> float:
+        """枠が空くまでブロックし、待機した秒数を返す"""
+        start = time.time()
+        waiter_id = self._register_waiter(tokens)
+        try:
+            while True:
+                granted, wait = self._try_acquire(waiter_id, tokens)
+                if granted:
+                    return time.time() - start
+                time.sleep(wait)
+        except BaseException:
+            self._remove_waiter(waiter_id)
+            raise
+
+    async def aacquire(self, tokens: int = 0) -> float:
+        """acquire の非同期版。待機中はイベントループを止めない"""
+        start = time.time()
+        waiter_id = await asyncio.to_thread(self._register_waiter, tokens)
+        try:
+            while True:
+                granted, wait = await asyncio.to_thread(self._try_acquire, waiter_id, tokens)
+                if granted:
+                    return time.time() - start
+                await asyncio.sleep(wait)
+        except BaseException:
+            await asyncio.to_thread(self._remove_waiter, waiter_id)
+            raise
+
+
+def estimate_tokens(text: str, max_tokens: Optional[int]) -> int:
+    """プロンプト文字数 / 4 を入力トークン、max_tokens を出力トークンの見積もりとする"""
+    return len(text) // 4 + int(max_tokens or 0)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_shared_rate_limiter(deployment: str) -> Optional[SharedRateLimiter]:
+    """
+    環境変数 AZURE_LLM_SHARED_LIMITER_PATH が設定されていれば、デプロイメントごとの共有リミッタを返す。
+    未設定の場合は None（従来どおりプロセス内の InMemoryRateLimiter を使う）。
+    """
+    path = os.getenv("AZURE_LLM_SHARED_LIMITER_PATH")
+    if not path:
+        return None
+    key = (path, deployment)
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            # 既定の RPM は従来の AZURE_LLM_REQUESTS_PER_SECOND (0.25 rps) と同じ
+            default_rpm = float(os.getenv("AZURE_LLM_REQUESTS_PER_SECOND", "0.25")) * 60
+            tpm = float(os.getenv("AZURE_LLM_TOKENS_PER_MINUTE", "0"))
+            limiter = SharedRateLimiter(
+                path,
+                deployment,
+                requests_per_minute=float(os.getenv("AZURE_LLM_REQUESTS_PER_MINUTE", str(default_rpm))),
+                tokens_per_minute=tpm if tpm > 0 else None,
+                poll_seconds=float(os.getenv("AZURE_LLM_RATE_CHECK_SECONDS", "0.5")),
+            )
+            _limiters[key] = limiter
+        return limiter
@@ -0,0 +1,186 @@
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from typing import Any, Optional, Tuple
+
+
+# runnable.with_config(metadata=...) でキャッシュ用のシグネチャを渡すときのキー
+RESPONSE_CACHE_METADATA_KEY = "llm_response_cache_signature"
+
+
+def serialize_llm_input(input_data: Any) -> Any:
+    """プロンプト（文字列またはメッセージのリスト）をハッシュ用の JSON 互換な値に変換する"""
+    if isinstance(input_data, str):
+        return input_data
+    if isinstance(input_data, (list, tuple)):
+        return [serialize_llm_input(item) for item in input_data]
+    if hasattr(input_data, "content"):
+        return {"type": getattr(input_data, "type", type(input_data).__name__), "content": input_data.content}
+    if isinstance(input_data, dict):
+        return {str(k): serialize_llm_input(v) for k, v in input_data.items()}
+    return str(input_data)
+
+
+def schema_signature(output_schema: Any) -> str:
+    """構造化出力スキーマの識別子。フィールド説明の変更でもキーが変わるよう JSON Schema のハッシュを含める"""
+    name = f"{getattr(output_schema, '__module__', '')}.{getattr(output_schema, '__qualname__', str(output_schema))}"
+    try:
+        schema_json = json.dumps(output_schema.model_json_schema(), sort_keys=True)
+    except Exception:
+        schema_json = name
+    return f"{name}:{hashlib.sha256(schema_json.encode('utf-8')).hexdigest()[:16]}"
+
+
+class LLMResponseCache:
+    """
+    LLM 応答の永続キャッシュ（SQLite）。
+    キーはデプロイメント・生成パラメータ・出力スキーマ・プロンプトのハッシュ。
+    値は pickle した応答（AIMessage または Pydantic モデル）。
+    古いエントリ（max_age_seconds 超過）と、合計サイズが max_bytes を超えた分（最終参照が古い順）を削除する。
+    """
+
+    def __init__(self, path: str, max_age_seconds: Optional[float] = None, max_bytes: Optional[int] = None):
+        self.path = path
+        self.max_age_seconds = max_age_seconds
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # 複数プロセスから同じファイルを使えるよう WAL にし、ロック待ちはタイムアウトまで待つ
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses(last_access)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(signature: dict, input_data: Any) -> str:
+        payload = json.dumps(
+            {"signature": signature, "input": serialize_llm_input(input_data)},
+            sort_keys=True, ensure_ascii=False, default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.max_age_seconds and now - row[1] > self.max_age_seconds:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                self.evictions += 1
+                row = None
+            if row is None:
+                self.misses += 1
+                return False, None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        try:
+            return True, pickle.loads(row[0])
+        except Exception as e:
+            print(f"[LLMCache] 破損したエントリを無視します: {e}")
+            return False, None
+
+    def put(self, key: str, value: Any):
+        try:
+            blob = pickle.dumps(value)
+        except Exception as e:
+            print(f"[LLMCache] 応答を保存できません ({type(value).__name__}): {e}")
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, blob, len(blob), now, now),
+            )
+            self.writes += 1
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float):
+        if self.max_age_seconds:
+            cursor = self._conn.execute(
+                "DELETE FROM responses WHERE created_at < ?", (now - self.max_age_seconds,)
+            )
+            self.evictions += max(cursor.rowcount, 0)
+        if not self.max_bytes:
+            return
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # 最終参照が古いものから、上限の 90% まで削除する
+        target = int(self.max_bytes * 0.9)
+        for key, size in self._conn.execute(
+            "SELECT key, size FROM responses ORDER BY last_access ASC"
+        ).fetchall():
+            if total <= target:
+                break
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, total_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "path": self.path,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "writes": self.writes,
+            "evictions": self.evictions,
+            "entries": entries,
+            "bytes": total_bytes,
+        }
+
+    def get_summary(self) -> str:
+        stats = self.stats()
+        return (
+            f"LLM応答キャッシュ ({stats['path']}): ヒット {stats['hits']}, ミス {stats['misses']} "
+            f"(ヒット率 {stats['hit_rate']:.1%}), 書き込み {stats['writes']}, 削除 {stats['evictions']}, "
+            f"{stats['entries']} 件 / {stats['bytes'] / (1024 * 1024):.1f} MB"
+        )
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_response_cache() -> Optional[LLMResponseCache]:
+    """
+    環境変数 LLM_RESPONSE_CACHE_PATH が設定されていれば、そのパスの共有キャッシュを返す。
+    未設定の場合は None（キャッシュ無効）。
+    """
+    path = os.getenv("LLM_RESPONSE_CACHE_PATH")
+    if not path:
+        return None
+    with _caches_lock:
+        cache = _caches.get(path)
+        if cache is None:
+            max_age_hours = float(os.getenv("LLM_RESPONSE_CACHE_MAX_AGE_HOURS", "0"))
+            max_mb = float(os.getenv("LLM_RESPONSE_CACHE_MAX_MB", "1024"))
+            cache = LLMResponseCache(
+                path,
+                max_age_seconds=max_age_hours * 3600 if max_age_hours > 0 else None,
+                max_bytes=int(max_mb * 1024 * 1024) if max_mb > 0 else None,
+            )
+            _caches[path] = cache
+        return cache
@@ -0,0 +1,173 @@
+import asyncio
+import itertools
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager, contextmanager
+from typing import Awaitable, Callable, Dict, Optional
+
+
+# 値が小さいほど優先。患者が待っている最終診断を最優先し、文献・Web の要約は最後に回す
+LANE_PRIORITIES = {
+    "final": 0,
+    "reflection": 1,
+    "diagnosis": 2,
+    "zeroshot": 3,
+    "summary": 4,
+}
+DEFAULT_LANE = "summary"
+
+
+def _parse_lane_limits(raw: str) -> Dict[str, int]:
+    """'final=2,summary=4' 形式をレーンごとの同時実行上限に変換する（未指定のレーンは無制限）"""
+    limits = {}
+    for part in raw.split(","):
+        if "=" not in part:
+            continue
+        lane, value = part.split("=", 1)
+        lane = lane.strip()
+        if lane not in LANE_PRIORITIES:
+            print(f"[LLMScheduler] 未知のレーン '{lane}' は無視します。")
+            continue
+        limits[lane] = max(1, int(value.strip()))
+    return limits
+
+
+class PriorityDispatcher:
+    """
+    LLM 呼び出しをレーンごとの優先度順にレート制限へ通すディスパッチャ。
+
+    待機中の呼び出しのうち「同時実行上限に空きがあるレーンで最も優先度が高く、先に来たもの」だけが
+    レート制限の枠を取りに行ける。枠の取得は1件ずつ行うため、要約が大量に待っていても
+    後から来た最終診断が次に枠を取る。
+    """
+
+    def __init__(self, lane_limits: Optional[Dict[str, int]] = None, poll_seconds: float = 0.05):
+        self.lane_limits = lane_limits or {}
+        self.poll_seconds = poll_seconds
+        self._cond = threading.Condition()
+        self._waiting = []  # (priority, seq, lane)
+        self._running = defaultdict(int)
+        self._acquiring = False
+        self._seq = itertools.count()
+        self._calls = defaultdict(int)
+        self._wait_seconds = defaultdict(float)
+
+    @classmethod
+    def from_env(cls) -> "PriorityDispatcher":
+        return cls(
+            lane_limits=_parse_lane_limits(os.getenv("LLM_LANE_CONCURRENCY", "")),
+            poll_seconds=float(os.getenv("LLM_LANE_POLL_SECONDS", "0.05")),
+        )
+
+    def _ticket(self, lane: str):
+        if lane not in LANE_PRIORITIES:
+            lane = DEFAULT_LANE
+        ticket = (LANE_PRIORITIES[lane], next(self._seq), lane)
+        with self._cond:
+            self._waiting.append(ticket)
+        return ticket
+
+    def _has_capacity(self, lane: str) -> bool:
+        limit = self.lane_limits.get(lane)
+        return limit is None or self._running[lane] < limit
+
+    def _try_start(self, ticket) -> bool:
+        """ticket が次に枠を取る番であれば待機列から外して True を返す（self._cond 保持中に呼ぶ）"""
+        if self._acquiring:
+            return False
+        eligible = [t for t in self._waiting if self._has_capacity(t[2])]
+        if not eligible or min(eligible) != ticket:
+            return False
+        self._waiting.remove(ticket)
+        self._acquiring = True
+        return True
+
+    def _cancel(self, ticket):
+        with self._cond:
+            if ticket in self._waiting:
+                self._waiting.remove(ticket)
+            self._cond.notify_all()
+
+    def _finish_acquire(self, lane: str, acquired: bool, waited: float):
+        with self._cond:
+            self._acquiring = False
+            if acquired:
+                self._running[lane] += 1
+                self._calls[lane] += 1
+                self._wait_seconds[lane] += waited
+            self._cond.notify_all()
+
+    def _release(self, lane: str):
+        with self._cond:
+            self._running[lane] -= 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, lane: str, acquire_rate_limit: Callable[[], None]):
+        """優先順位に従って acquire_rate_limit() を呼び、ブロック内の API 呼び出し中はレーンの枠を占有する"""
+        start = time.time()
+        ticket = self._ticket(lane)
+        lane = ticket[2]
+        try:
+            with self._cond:
+                while not self._try_start(ticket):
+                    self._cond.wait(self.poll_seconds)
+        except BaseException:
+            self._cancel(ticket)
+            raise
+
+        acquired = False
+        try:
+            acquire_rate_limit()
+            acquired = True
+        finally:
+            self._finish_acquire(lane, acquired, time.time() - start)
+
+        try:
+            yield
+        finally:
+            self._release(lane)
+
+    @asynccontextmanager
+    async def aslot(self, lane: str, acquire_rate_limit: Callable[[], Awaitable[None]]):
+        """slot の非同期版。順番待ちはポーリングで行い、イベントループを止めない"""
+        start = time.time()
+        ticket = self._ticket(lane)
+        lane = ticket[2]
+        try:
+            while True:
+                with self._cond:
+                    if self._try_start(ticket):
+                        break
+                await asyncio.sleep(self.poll_seconds)
+        except BaseException:
+            self._cancel(ticket)
+            raise
+
+        acquired = False
+        try:
+            await acquire_rate_limit()
+            acquired = True
+        finally:
+            self._finish_acquire(lane, acquired, time.time() - start)
+
+        try:
+            yield
+        finally:
+            self._release(lane)
+
+    def get_summary(self) -> str:
+        with self._cond:
+            lines = ["LLM レーン別 呼び出し数 / 平均待ち時間:"]
+            for lane in sorted(LANE_PRIORITIES, key=LANE_PRIORITIES.get):
+                calls = self._calls[lane]
+                if not calls:
+                    continue
+                limit = self.lane_limits.get(lane)
+                lines.append(
+                    f"  {lane:<10} {calls:>5} 回, 平均待ち {self._wait_seconds[lane] / calls:.2f}秒"
+                    f" (上限 {limit if limit else '無制限'})"
+                )
+        return "\n".join(lines)
@@ -1,31 +1,93 @@
+import asyncio
 import os
+import threading
 
 from .state.state_types import State, ReflectionOutput
-from .tools.pcf_api import callingPCF
-from .tools.diagnosis import createDiagnosis
-from .tools.ZeroShot import createZeroshot
+from .tools.pcf_api import callingPCF, acallingPCF
+from .tools.diagnosis import createDiagnosis, acreateDiagnosis, createDiagnosisStreaming, acreateDiagnosisStreaming
+from .tools.ZeroShot import createZeroshot, acreateZeroshot
 from .tools.make_HPOdic import make_hpo_dic
-from .tools.reflection import create_reflection
-from .tools.diseaseSearch import diseaseSearchForDiagnosis
-from .tools.diseaseNormalize import diseaseNormalizeForDiagnosis, normalize_pcf_results, normalize_gestalt_results, normalize_zeroshot_results
-from .tools.finalDiagnosis import createFinalDiagnosis
-from .tools.gestaltMathcher import call_gestalt_matcher_api
-from .tools.HPOwebReserch import search_hpo_terms
-from .tools.embeddingSearchWithHPO import embedding_search_with_hpo
+from .tools.reflection import create_reflection, acreate_reflection
+from .tools.diseaseSearch import (
+    diseaseSearchForDiagnosis, adiseaseSearchForDiagnosis, merge_search_results_into_memory,
+    search_single_disease_wikipedia, search_single_disease_pubmed,
+    asearch_single_disease_wikipedia, asearch_single_disease_pubmed,
+    DISEASE_SEARCH_MAX_WORKERS,
+)
+from .tools.diseaseNormalize import (
+    diseaseNormalizeForDiagnosis, normalize_pcf_results, normalize_gestalt_results, normalize_zeroshot_results,
+    adiseaseNormalizeForDiagnosis, anormalize_zeroshot_results,
+    normalize_diagnosis_item, anormalize_diagnosis_item,
+)
+from .tools.finalDiagnosis import createFinalDiagnosis, acreateFinalDiagnosis
+from .tools.gestaltMathcher import call_gestalt_matcher_api, acall_gestalt_matcher_api, gestalt_result_limit
+from .tools.HPOwebReserch import search_hpo_terms, asearch_hpo_terms
+from .tools.embeddingSearchWithHPO import embedding_search_with_hpo, aembedding_search_with_hpo, phenotype_search_k
 from .tools.rankingMerge import merge_ranked_disease_candidates
 
 from .utils.result_saver import save_result
 from .utils.profiler import profile_node
+from .utils.accounting import ContextThreadPoolExecutor
 
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import as_completed
 
 
 REFLECTION_MAX_WORKERS = int(os.getenv("REFLECTION_MAX_WORKERS", "6"))
+# after_reflection_edge が最終診断へ進む depth。1 の場合は従来どおり再ループしない。
+MAX_FLOW_DEPTH = max(1, int(os.getenv("MAX_FLOW_DEPTH", "1")))
 
 
 def _empty_reflection_output() -> ReflectionOutput:
     return ReflectionOutput(ans=[])
 
+def _run_single_reflection(state: State, diagnosis_to_judge):
+    try:
+        return create_reflection(state, diagnosis_to_judge)
+    except Exception as e:
+        print(f"[ERROR] Reflection failed for {diagnosis_to_judge.disease_name}: {e}")
+        return None, None
+
+async def _arun_single_reflection(state: State, diagnosis_to_judge):
+    try:
+        return await acreate_reflection(state, diagnosis_to_judge)
+    except Exception as e:
+        print(f"[ERROR] Reflection failed for {diagnosis_to_judge.disease_name}: {e}")
+        return None, None
+
+def _build_reflection_update(results):
+    """(reflection_result, prompt) のリストから reflectionNode の出力を作る"""
+    reflection_result_list = [result for result, _ in results if result]
+    prompts = [prompt for result, prompt in results if result]
+    if not reflection_result_list:
+        return {"reflection": _empty_reflection_output()}
+    return {"reflection": ReflectionOutput(ans=reflection_result_list), "prompt": prompts}
+
+def _format_gestalt_results(gestalt_results):
+    return [
+        {
+            "subject_id": res.get("subject_id", ""),
+            "syndrome_name": res.get("syndrome_name", ""),
+            "omim_id": res.get("omim_id", ""),
+            "image_id": res.get("image_id", ""),
+            "score": res.get("score")
+        }
+        for res in gestalt_results
+    ]
+
+# --- 2周目以降のループ用キャッシュ ---
+# depth 1 で MAX_FLOW_DEPTH 分の順位付きリストをまとめて取得して State に保持し、
+# 2周目以降は depth に応じてスライスするだけにする（API・embedding の再呼び出しをしない）。
+
+def _is_repeated_flow(state: State) -> bool:
+    return state.get("depth", 0) > 1
+
+def _hpo_dict_is_current(hpo_dict, hpo_list) -> bool:
+    return bool(hpo_dict) and set(hpo_dict) == set(hpo_list or [])
+
+def _slice_gestalt_results(full_results, depth):
+    # NormalizeGestaltMatcherNode が要素を書き換えるため、キャッシュとは別の dict にする
+    return [dict(res) for res in full_results[:gestalt_result_limit(depth)]]
+
 @profile_node
 def BeginningOfFlowNode(state: State):
     print("BeginningOfFlowNode called")
@@ -39,6 +101,9 @@ def BeginningOfFlowNode(state: State):
 @save_result("HPOwebSearchNode")
 def HPOwebSearchNode(state: State):
     print("HPOwebSearchNode called")
+    if _is_repeated_flow(state) and state.get("webresources"):
+        print("Reusing web resources from the previous loop.")
+        return {"webresources": state["webresources"]}
     try:
         webresources = search_hpo_terms(state)
         
@@ -62,13 +127,19 @@ def DiseaseSearchWithHPONode(state: State):
     # 1. Extract the hpo_list from the state.
     # 2. Execute the search.
     # 3. Return the results as a List[PhenotypeSearchFormat].
-    search_results = embedding_search_with_hpo(state)
+    depth = state.get("depth", 1)
+    full_results = state.get("phenotypeSearchFullResult")
+    if not full_results:
+        full_results = embedding_search_with_hpo(state, top_k=phenotype_search_k(max(depth, MAX_FLOW_DEPTH)))
     
-    if not search_results:
+    if not full_results:
         print("Phenotype search returned no results.")
         return {}
         
-    return {"phenotypeSearchResult": search_results}
+    return {
+        "phenotypeSearchResult": full_results[:phenotype_search_k(depth)],
+        "phenotypeSearchFullResult": full_results,
+    }
 
 
 @profile_node
@@ -78,6 +149,9 @@ def PCFnode(state: State):
     hpo_list = state["hpoList"]
     if not hpo_list:
         return {"pubCaseFinder": []}
+    # PubCaseFinder の上位5件は depth に依存しないため、2周目以降は正規化済みの結果を再利用する
+    if _is_repeated_flow(state) and state.get("pubCaseFinder"):
+        return {"pubCaseFinder": state["pubCaseFinder"]}
     result = callingPCF(hpo_list, depth)
     return {"pubCaseFinder": result}
 
@@ -99,18 +173,16 @@ def GestaltMatcherNode(state: State):
     if not image_path:
         print("No image path provided.")
         return {"GestaltMatcher": []}
+    full_results = state.get("gestaltMatcherFullResult")
+    if full_results:
+        return {"GestaltMatcher": _slice_gestalt_results(full_results, depth)}
     try:
-        gestalt_results = call_gestalt_matcher_api(image_path, depth)
-        syndrome_list = []
-        for res in gestalt_results:
-            syndrome_list.append({
-                "subject_id": res.get("subject_id", ""),
-                "syndrome_name": res.get("syndrome_name", ""),
-                "omim_id": res.get("omim_id", ""),
-                "image_id": res.get("image_id", ""),
-                "score": res.get("score")
-            })
-        return {"GestaltMatcher": syndrome_list}
+        gestalt_results = call_gestalt_matcher_api(image_path, max(depth, MAX_FLOW_DEPTH))
+        full_results = _format_gestalt_results(gestalt_results)
+        return {
+            "GestaltMatcher": _slice_gestalt_results(full_results, depth),
+            "gestaltMatcherFullResult": full_results,
+        }
     except Exception as e:
         print(f"Error calling GestaltMatcher API: {e}")
         return {"GestaltMatcher": []}
@@ -129,6 +201,8 @@ def NormalizeGestaltMatcherNode(state: State):
 def createHPODictNode(state: State):
     print("createHPODictNode called")
     hpo_list = state.get("hpoList", [])
+    if _hpo_dict_is_current(state.get("hpoDict"), hpo_list):
+        return {"hpoDict": state["hpoDict"]}
     hpo_dict = make_hpo_dic(hpo_list, None)
     return {"hpoDict": hpo_dict}
 
@@ -136,6 +210,8 @@ def createHPODictNode(state: State):
 def createAbsentHPODictNode(state: State):
     print("createAbsentHPODictNode called")
     absent_hpo_list = state.get("absentHpoList", [])
+    if _hpo_dict_is_current(state.get("absentHpoDict"), absent_hpo_list):
+        return {"absentHpoDict": state["absentHpoDict"]}
     absent_hpo_dict = make_hpo_dic(absent_hpo_list, None)
     return {"absentHpoDict": absent_hpo_dict}
 
@@ -158,12 +234,15 @@ def createZeroShotNode(state: State):
 def NormalizeZeroShotNode(state: State):
     """ZeroShotの結果に含まれる病名を正規化し、重複を排除する"""
     print("NormalizeZeroShotNode called")
+    # createZeroShotNode は2周目以降も同じ結果を返すため、正規化済みなら再計算しない
+    if state.get("zeroShotNormalized"):
+        return {}
     # stateから値を取り出すのではなく、stateをそのまま渡す
     normalized_result = normalize_zeroshot_results(state)
     if not normalized_result:
         return {}
     # 既存のキー 'zeroShotResult' を上書きする
-    return {"zeroShotResult": normalized_result}
+    return {"zeroShotResult": normalized_result, "zeroShotNormalized": True}
 
 @profile_node
 @save_result("mergeCandidateResultsNode")
@@ -222,21 +301,12 @@ def reflectionNode(state: State):
         reflection_result_list = []
         prompts = []
         
-        # 並列実行関数
-        def process_single_reflection(diagnosis_to_judge):
-            try:
-                reflection_result, prompt = create_reflection(state, diagnosis_to_judge)
-                return reflection_result, prompt
-            except Exception as e:
-                print(f"[ERROR] Reflection failed for {diagnosis_to_judge.disease_name}: {e}")
-                return None, None
-        
         max_workers = min(len(diagnosis_to_judge_lis), REFLECTION_MAX_WORKERS)
         print(f"[Reflection] max_workers={max_workers}")
 
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        with ContextThreadPoolExecutor(max_workers=max_workers) as executor:
             future_to_diagnosis = {
-                executor.submit(process_single_reflection, diagnosis): diagnosis 
+                executor.submit(_run_single_reflection, state, diagnosis): diagnosis 
                 for diagnosis in diagnosis_to_judge_lis
             }
 
@@ -259,6 +329,180 @@ def reflectionNode(state: State):
     return {"reflection": _empty_reflection_output()}
 
 
+def _pipelined_reflection_targets(state: State):
+    """パイプライン版ノードの対象疾患リストを返す。検索・評価できない場合は None。"""
+    tentativeDiagnosis = state.get("tentativeDiagnosis")
+    if not state.get("llm"):
+        print("LLMインスタンスがstate内に見つかりません。検索と評価をスキップします。")
+        return None
+    if not tentativeDiagnosis or not hasattr(tentativeDiagnosis, 'ans'):
+        print("暫定診断が見つからないため、検索と評価をスキップします。")
+        return None
+    return tentativeDiagnosis.ans or None
+
+def _search_and_reflect(state: State):
+    """
+    暫定疾患ごとに Wikipedia/PubMed の検索が揃った時点で、その疾患の reflection を開始する。
+    戻り値は memory と reflectionNode の出力をまとめた dict。
+    """
+    memory = list(state.get("memory", []))
+    diagnoses = _pipelined_reflection_targets(state)
+    if not diagnoses:
+        return {"memory": memory, "reflection": _empty_reflection_output()}
+
+    llm = state["llm"]
+    search_depth = state.get("depth", 1)
+    retrieved_urls = {item['url'] for item in memory}
+    search_results = [[] for _ in diagnoses]
+    remaining_searches = [2] * len(diagnoses)
+    results = [(None, None)] * len(diagnoses)
+
+    search_workers = min(len(diagnoses) * 2, DISEASE_SEARCH_MAX_WORKERS)
+    reflection_workers = min(len(diagnoses), REFLECTION_MAX_WORKERS)
+    print(f"[Pipelined] search max_workers={search_workers}, reflection max_workers={reflection_workers}")
+
+    with ContextThreadPoolExecutor(max_workers=search_workers) as search_executor, \
+         ContextThreadPoolExecutor(max_workers=reflection_workers) as reflection_executor:
+        search_futures = {}
+        for i, diagnosis in enumerate(diagnoses):
+            for source, search_func in (("wikipedia", search_single_disease_wikipedia), ("pubmed", search_single_disease_pubmed)):
+                future = search_executor.submit(search_func, diagnosis.disease_name, search_depth, llm)
+                search_futures[future] = (source, i)
+
+        reflection_futures = {}
+        for future in as_completed(search_futures):
+            source, i = search_futures[future]
+            try:
+                search_results[i].extend(future.result())
+            except Exception as e:
+                print(f"    - [{source}] 「{diagnoses[i].disease_name}」の処理でエラー: {e}")
+            remaining_searches[i] -= 1
+            if remaining_searches[i] > 0:
+                continue
+
+            # この疾患の文献が揃ったので memory に反映し、その時点のスナップショットで reflection を開始する
+            merge_search_results_into_memory(memory, retrieved_urls, search_results[i])
+            if not state.get("hpoDict"):
+                continue
+            candidate_state = {**state, "memory": list(memory)}
+            print(f"[Pipelined] evidence ready for {diagnoses[i].disease_name}; starting reflection")
+            reflection_futures[reflection_executor.submit(_run_single_reflection, candidate_state, diagnoses[i])] = i
+
+        for future in as_completed(reflection_futures):
+            i = reflection_futures[future]
+            try:
+                results[i] = future.result()
+            except Exception as e:
+                print(f"[ERROR] Future exception for {diagnoses[i].disease_name}: {e}")
+
+    return {"memory": memory, **_build_reflection_update(results)}
+
+@profile_node
+@save_result("reflectionNode")
+def diseaseSearchAndReflectionNode(state: State):
+    """diseaseSearchNode と reflectionNode のパイプライン版"""
+    print("diseaseSearchAndReflectionNode called")
+    return _search_and_reflect(state)
+
+def _stream_diagnosis_chain(state: State, reflect: bool):
+    """
+    暫定診断をストリーミング生成し、ケースが完成するたびに
+    OMIM 正規化 → Wikipedia/PubMed 検索（reflect=True なら続けて reflection）を別スレッドで開始する。
+    """
+    llm = state.get("llm")
+    search_depth = state.get("depth", 1)
+    memory = list(state.get("memory", []))
+    retrieved_urls = {item['url'] for item in memory}
+    memory_lock = threading.Lock()
+    # ストリームが失敗したら従来経路でやり直すため、実行中のケースも次の段階（検索・reflection）へ進ませない
+    aborted = threading.Event()
+
+    def process_case(diagnosis, search_executor):
+        if aborted.is_set() or not normalize_diagnosis_item(diagnosis) or aborted.is_set():
+            return False, (None, None)
+        futures = [
+            search_executor.submit(search_func, diagnosis.disease_name, search_depth, llm)
+            for search_func in (search_single_disease_wikipedia, search_single_disease_pubmed)
+        ]
+        results = []
+        for future in futures:
+            results.extend(future.result())
+        with memory_lock:
+            merge_search_results_into_memory(memory, retrieved_urls, results)
+            memory_snapshot = list(memory)
+        if not (reflect and state.get("hpoDict")) or aborted.is_set():
+            return True, (None, None)
+        print(f"[Streaming] evidence ready for {diagnosis.disease_name}; starting reflection")
+        return True, _run_single_reflection({**state, "memory": memory_snapshot}, diagnosis)
+
+    case_futures = []
+    with ContextThreadPoolExecutor(max_workers=DISEASE_SEARCH_MAX_WORKERS) as search_executor, \
+         ContextThreadPoolExecutor(max_workers=REFLECTION_MAX_WORKERS) as case_executor:
+        def on_case(diagnosis):
+            print(f"[Streaming] case parsed: {diagnosis.disease_name} (Rank {diagnosis.rank}); dispatching normalization and search")
+            case_futures.append(case_executor.submit(process_case, diagnosis, search_executor))
+
+        try:
+            diagnosis_output, prompt = createDiagnosisStreaming(state, on_case)
+        except BaseException:
+            # with を抜ける際に executor が全ケースの完了を待つため、未着手のケース・検索は取り消す
+            aborted.set()
+            for future in case_futures:
+                future.cancel()
+            search_executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        outcomes = [future.result() for future in case_futures]
+
+    return _build_streaming_update(diagnosis_output, prompt, outcomes, memory, reflect)
+
+def _build_streaming_update(diagnosis_output, prompt, outcomes, memory, reflect):
+    if diagnosis_output is None:
+        update = {"tentativeDiagnosis": None, "memory": memory}
+    else:
+        # ストリーム中に返したケースと outcomes は同じ順序
+        diagnosis_output.ans = [diag for diag, (accepted, _) in zip(diagnosis_output.ans, outcomes) if accepted]
+        update = {"tentativeDiagnosis": diagnosis_output, "memory": memory, "prompt": prompt}
+    if reflect:
+        update.update(_build_reflection_update([result for accepted, result in outcomes if accepted]))
+    return update
+
+def _diagnosis_chain_without_streaming(state: State, reflect: bool):
+    """ストリーミングに失敗した場合の従来経路（createDiagnosis → 正規化 → 検索 [→ reflection]）"""
+    diagnosis_output, prompt = createDiagnosis(state)
+    if diagnosis_output is not None:
+        diagnosis_output = diseaseNormalizeForDiagnosis(diagnosis_output)
+    chain_state = {**state, "tentativeDiagnosis": diagnosis_output}
+    if reflect:
+        update = _search_and_reflect(chain_state)
+    else:
+        update = {**diseaseSearchForDiagnosis(chain_state), "prompt": prompt}
+    return {"tentativeDiagnosis": diagnosis_output, **update}
+
+def _streaming_diagnosis(state: State, reflect: bool):
+    try:
+        return _stream_diagnosis_chain(state, reflect)
+    except Exception as e:
+        print(f"[Streaming] Streaming diagnosis failed ({type(e).__name__}: {e}). Falling back to non-streaming path.")
+        return _diagnosis_chain_without_streaming(state, reflect)
+
+@profile_node
+@save_result("createDiagnosisNode")
+def streamingDiagnosisNode(state: State):
+    """
+    createDiagnosisNode → diseaseNormalizeNode → diseaseSearchNode のストリーミング版。
+    LLM が暫定診断を生成している間に、完成したケースから正規化と文献検索を進める。
+    """
+    print("streamingDiagnosisNode called")
+    return _streaming_diagnosis(state, reflect=False)
+
+@profile_node
+@save_result("reflectionNode")
+def streamingDiagnosisAndReflectionNode(state: State):
+    """streamingDiagnosisNode に diseaseSearchAndReflectionNode と同じケースごとの reflection を加えたもの"""
+    print("streamingDiagnosisAndReflectionNode called")
+    return _streaming_diagnosis(state, reflect=True)
+
+
 @profile_node
 @save_result("finalDiagnosisNode")
 def finalDiagnosisNode(state: State):
@@ -277,6 +521,281 @@ def diseaseNormalizeForFinalNode(state: State):
     return {"finalDiagnosis": None}
 
 
+
+# --- Async nodes ---
+# RareDiseaseDiagnosisPipeline.arun() (graph.ainvoke) で使われる I/O バウンドなノードの非同期版。
+# 入出力は対応する同期ノードと同一で、ここに無いノードは同期版がそのまま使われる。
+
+@profile_node
+@save_result("HPOwebSearchNode")
+async def HPOwebSearchNodeAsync(state: State):
+    print("HPOwebSearchNodeAsync called")
+    if _is_repeated_flow(state) and state.get("webresources"):
+        print("Reusing web resources from the previous loop.")
+        return {"webresources": state["webresources"]}
+    try:
+        webresources = await asearch_hpo_terms(state)
+        state["webresources"] = state.get("webresources", []) + webresources
+        return {"webresources": state["webresources"]}
+    except Exception as e:
+        print(f"Error in HPOwebSearchNodeAsync: {e}")
+        return {"webresources": state.get("webresources", [])}
+
+@profile_node
+@save_result("DiseaseSearchWithHPONode")
+async def DiseaseSearchWithHPONodeAsync(state: State):
+    print("DiseaseSearchWithHPONodeAsync called")
+    depth = state.get("depth", 1)
+    full_results = state.get("phenotypeSearchFullResult")
+    if not full_results:
+        full_results = await aembedding_search_with_hpo(state, top_k=phenotype_search_k(max(depth, MAX_FLOW_DEPTH)))
+    if not full_results:
+        print("Phenotype search returned no results.")
+        return {}
+    return {
+        "phenotypeSearchResult": full_results[:phenotype_search_k(depth)],
+        "phenotypeSearchFullResult": full_results,
+    }
+
+@profile_node
+async def PCFnodeAsync(state: State):
+    print("PCFnodeAsync called")
+    depth = state.get("depth", 0)
+    hpo_list = state["hpoList"]
+    if not hpo_list:
+        return {"pubCaseFinder": []}
+    # PubCaseFinder の上位5件は depth に依存しないため、2周目以降は正規化済みの結果を再利用する
+    if _is_repeated_flow(state) and state.get("pubCaseFinder"):
+        return {"pubCaseFinder": state["pubCaseFinder"]}
+    result = await acallingPCF(hpo_list, depth)
+    return {"pubCaseFinder": result}
+
+@profile_node
+async def GestaltMatcherNodeAsync(state: State):
+    print("GestaltMatcherNodeAsync called")
+    image_path = state.get("imagePath", None)
+    depth = state.get("depth", 0)
+    if not image_path:
+        print("No image path provided.")
+        return {"GestaltMatcher": []}
+    full_results = state.get("gestaltMatcherFullResult")
+    if full_results:
+        return {"GestaltMatcher": _slice_gestalt_results(full_results, depth)}
+    try:
+        gestalt_results = await acall_gestalt_matcher_api(image_path, max(depth, MAX_FLOW_DEPTH))
+        full_results = _format_gestalt_results(gestalt_results)
+        return {
+            "GestaltMatcher": _slice_gestalt_results(full_results, depth),
+            "gestaltMatcherFullResult": full_results,
+        }
+    except Exception as e:
+        print(f"Error calling GestaltMatcher API: {e}")
+        return {"GestaltMatcher": []}
+
+@profile_node
+async def createZeroShotNodeAsync(state: State):
+    print("createZeroShotNodeAsync called")
+    hpo_dict = state.get("hpoDict", {})
+    if state.get("zeroShotResult") is not None:
+        return {"zeroShotResult": state["zeroShotResult"]}
+    if hpo_dict:
+        result, prompt = await acreateZeroshot(state)
+        if result:
+            return {"zeroShotResult": result, "prompt": prompt}
+    return {"zeroShotResult": None}
+
+@profile_node
+@save_result("NormalizeZeroShotNode")
+async def NormalizeZeroShotNodeAsync(state: State):
+    print("NormalizeZeroShotNodeAsync called")
+    if state.get("zeroShotNormalized"):
+        return {}
+    normalized_result = await anormalize_zeroshot_results(state)
+    if not normalized_result:
+        return {}
+    return {"zeroShotResult": normalized_result, "zeroShotNormalized": True}
+
+@profile_node
+@save_result("createDiagnosisNode")
+async def createDiagnosisNodeAsync(state: State):
+    print("createDiagnosisNodeAsync called")
+    result, prompt = await acreateDiagnosis(state)
+    if result:
+        return {"tentativeDiagnosis": result, "prompt": prompt}
+    return {}
+
+@profile_node
+@save_result("diseaseNormalizeNode")
+async def diseaseNormalizeNodeAsync(state: State):
+    print("diseaseNormalizeNodeAsync called")
+    tentativeDiagnosis = state.get("tentativeDiagnosis", None)
+    if tentativeDiagnosis is not None:
+        normalizedDiagnosis = await adiseaseNormalizeForDiagnosis(tentativeDiagnosis)
+        return {"tentativeDiagnosis": normalizedDiagnosis}
+    return {"tentativeDiagnosis": None}
+
+@profile_node
+async def diseaseSearchNodeAsync(state: State):
+    print("diseaseSearchNodeAsync called")
+    return await adiseaseSearchForDiagnosis(state)
+
+@profile_node
+@save_result("reflectionNode")
+async def reflectionNodeAsync(state: State):
+    print("reflectionNodeAsync called")
+    tentativeDiagnosis = state.get("tentativeDiagnosis")
+    hpo_dict = state.get("hpoDict")
+
+    if not (tentativeDiagnosis and hpo_dict and hasattr(tentativeDiagnosis, 'ans')):
+        return {"reflection": _empty_reflection_output()}
+
+    diagnosis_to_judge_lis = tentativeDiagnosis.ans
+    if not diagnosis_to_judge_lis:
+        return {"reflection": _empty_reflection_output()}
+
+    # 同期版の ThreadPoolExecutor と同じ上限で同時実行数を制限する
+    semaphore = asyncio.Semaphore(REFLECTION_MAX_WORKERS)
+
+    async def process_single_reflection(diagnosis_to_judge):
+        async with semaphore:
+            return await _arun_single_reflection(state, diagnosis_to_judge)
+
+    results = await asyncio.gather(*[process_single_reflection(d) for d in diagnosis_to_judge_lis])
+    return _build_reflection_update(results)
+
+async def _asearch_with_limit(semaphore, source, search_func, disease_name, search_depth, llm):
+    async with semaphore:
+        try:
+            return await search_func(disease_name, search_depth, llm)
+        except Exception as e:
+            print(f"    - [{source}] 「{disease_name}」の処理でエラー: {e}")
+            return []
+
+async def _asearch_disease_literature(semaphore, disease_name, search_depth, llm):
+    wiki_results, pubmed_results = await asyncio.gather(
+        _asearch_with_limit(semaphore, "wikipedia", asearch_single_disease_wikipedia, disease_name, search_depth, llm),
+        _asearch_with_limit(semaphore, "pubmed", asearch_single_disease_pubmed, disease_name, search_depth, llm),
+    )
+    return wiki_results + pubmed_results
+
+async def _asearch_and_reflect(state: State):
+    """_search_and_reflect の非同期版"""
+    memory = list(state.get("memory", []))
+    diagnoses = _pipelined_reflection_targets(state)
+    if not diagnoses:
+        return {"memory": memory, "reflection": _empty_reflection_output()}
+
+    llm = state["llm"]
+    search_depth = state.get("depth", 1)
+    retrieved_urls = {item['url'] for item in memory}
+    search_semaphore = asyncio.Semaphore(DISEASE_SEARCH_MAX_WORKERS)
+    reflection_semaphore = asyncio.Semaphore(REFLECTION_MAX_WORKERS)
+
+    async def search_then_reflect(diagnosis):
+        results = await _asearch_disease_literature(search_semaphore, diagnosis.disease_name, search_depth, llm)
+        # イベントループ上で実行されるため、memory の更新は他の候補と競合しない
+        merge_search_results_into_memory(memory, retrieved_urls, results)
+        if not state.get("hpoDict"):
+            return None, None
+        candidate_state = {**state, "memory": list(memory)}
+        print(f"[Pipelined] evidence ready for {diagnosis.disease_name}; starting reflection")
+        async with reflection_semaphore:
+            return await _arun_single_reflection(candidate_state, diagnosis)
+
+    results = await asyncio.gather(*[search_then_reflect(d) for d in diagnoses])
+    return {"memory": memory, **_build_reflection_update(results)}
+
+@profile_node
+@save_result("reflectionNode")
+async def diseaseSearchAndReflectionNodeAsync(state: State):
+    print("diseaseSearchAndReflectionNodeAsync called")
+    return await _asearch_and_reflect(state)
+
+async def _astream_diagnosis_chain(state: State, reflect: bool):
+    """_stream_diagnosis_chain の非同期版。ケースごとの処理は asyncio.Task として並行実行する。"""
+    llm = state.get("llm")
+    search_depth = state.get("depth", 1)
+    memory = list(state.get("memory", []))
+    retrieved_urls = {item['url'] for item in memory}
+    search_semaphore = asyncio.Semaphore(DISEASE_SEARCH_MAX_WORKERS)
+    reflection_semaphore = asyncio.Semaphore(REFLECTION_MAX_WORKERS)
+
+    async def process_case(diagnosis):
+        if not await anormalize_diagnosis_item(diagnosis):
+            return False, (None, None)
+        results = await _asearch_disease_literature(search_semaphore, diagnosis.disease_name, search_depth, llm)
+        merge_search_results_into_memory(memory, retrieved_urls, results)
+        if not (reflect and state.get("hpoDict")):
+            return True, (None, None)
+        candidate_state = {**state, "memory": list(memory)}
+        print(f"[Streaming] evidence ready for {diagnosis.disease_name}; starting reflection")
+        async with reflection_semaphore:
+            return True, await _arun_single_reflection(candidate_state, diagnosis)
+
+    case_tasks = []
+
+    def on_case(diagnosis):
+        print(f"[Streaming] case parsed: {diagnosis.disease_name} (Rank {diagnosis.rank}); dispatching normalization and search")
+        case_tasks.append(asyncio.create_task(process_case(diagnosis)))
+
+    try:
+        diagnosis_output, prompt = await acreateDiagnosisStreaming(state, on_case)
+        outcomes = await asyncio.gather(*case_tasks)
+    except BaseException:
+        for task in case_tasks:
+            task.cancel()
+        raise
+
+    return _build_streaming_update(diagnosis_output, prompt, outcomes, memory, reflect)
+
+async def _adiagnosis_chain_without_streaming(state: State, reflect: bool):
+    diagnosis_output, prompt = await acreateDiagnosis(state)
+    if diagnosis_output is not None:
+        diagnosis_output = await adiseaseNormalizeForDiagnosis(diagnosis_output)
+    chain_state = {**state, "tentativeDiagnosis": diagnosis_output}
+    if reflect:
+        update = await _asearch_and_reflect(chain_state)
+    else:
+        update = {**await adiseaseSearchForDiagnosis(chain_state), "prompt": prompt}
+    return {"tentativeDiagnosis": diagnosis_output, **update}
+
+async def _astreaming_diagnosis(state: State, reflect: bool):
+    try:
+        return await _astream_diagnosis_chain(state, reflect)
+    except Exception as e:
+        print(f"[Streaming] Streaming diagnosis failed ({type(e).__name__}: {e}). Falling back to non-streaming path.")
+        return await _adiagnosis_chain_without_streaming(state, reflect)
+
+@profile_node
+@save_result("createDiagnosisNode")
+async def streamingDiagnosisNodeAsync(state: State):
+    print("streamingDiagnosisNodeAsync called")
+    return await _astreaming_diagnosis(state, reflect=False)
+
+@profile_node
+@save_result("reflectionNode")
+async def streamingDiagnosisAndReflectionNodeAsync(state: State):
+    print("streamingDiagnosisAndReflectionNodeAsync called")
+    return await _astreaming_diagnosis(state, reflect=True)
+
+@profile_node
+@save_result("finalDiagnosisNode")
+async def finalDiagnosisNodeAsync(state: State):
+    print("finalDiagnosisNodeAsync called")
+    finalDiagnosis, prompt = await acreateFinalDiagnosis(state)
+    return {"finalDiagnosis": finalDiagnosis, "prompt": prompt}
+
+@profile_node
+@save_result("diseaseNormalizeForFinalNode")
+async def diseaseNormalizeForFinalNodeAsync(state: State):
+    print("diseaseNormalizeForFinalNodeAsync called")
+    finalDiagnosis = state.get("finalDiagnosis", None)
+    if finalDiagnosis is not None:
+        normalizedDiagnosis = await adiseaseNormalizeForDiagnosis(finalDiagnosis)
+        return {"finalDiagnosis": normalizedDiagnosis}
+    return {"finalDiagnosis": None}
+
+
 """
 @save_result("reflectionNode")
 def reflectionNode(state: State):
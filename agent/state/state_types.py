@@ -39,11 +39,15 @@ class State(TypedDict):
     pubCaseFinder: List[PCFres]
     GestaltMatcher: List['GestaltMatcherFormat']
     phenotypeSearchResult: Optional[List['PhenotypeSearchFormat']]
+    # depth 1 で取得した順位付きリスト全体。2周目以降は depth に応じてスライスして再利用する
+    gestaltMatcherFullResult: Optional[List[dict]]
+    phenotypeSearchFullResult: Optional[List['PhenotypeSearchFormat']]
     mergedDiseaseCandidates: List[MergedDiseaseCandidate]
     webresources: List['webresource']
     # evidence are stored in memory
     memory: List['InformationItem']
     zeroShotResult: Optional['ZeroShotOutput']
+    zeroShotNormalized: bool
     tentativeDiagnosis: Optional['DiagnosisOutput']
     reflection: Optional['ReflectionOutput']
     finalDiagnosis: Optional['DiagnosisOutput']
@@ -51,6 +55,7 @@ class State(TypedDict):
     sex: Optional[str]
     patient_id: Optional[str]
     llm: Optional[AzureOpenAIWrapper]
+    logfile_path: Optional[str]
     
 # --- Pydantic Model for Zero-Shot Diagnosis Output ---
 class ZeroShotFormat(BaseModel):
@@ -1,7 +1,9 @@
+import asyncio
 from ..state.state_types import State, webresource
 from typing import List
-from ddgs import DDGS
 from ..llm.llm_wrapper import AzureOpenAIWrapper
+from ..utils.accounting import accounting
+from ..utils.profiler import profile_tool
 
 webresearch_prompt_dict = {
    "generate_query_prompt": """You are a medical research assistant specializing in clinical genetics and bioinformatics. Your task is to generate effective DDGS(DuckDuckGo Search) queries to identify potential syndromes or genetic disorders based on a provided list of Human Phenotype Ontology (HPO) terms.
@@ -80,8 +82,21 @@ def generate_queries(state: State, hpo_labels: List[str]) -> List[str]:
         return []
         
     prompt = webresearch_prompt_dict["generate_query_prompt"].format(hpo_terms=', '.join(hpo_labels))
-    queries_msg = llm.generate(prompt)
-    
+    queries_msg = llm.generate(prompt, lane="diagnosis")
+    return _parse_queries(queries_msg)
+
+async def agenerate_queries(state: State, hpo_labels: List[str]) -> List[str]:
+    """generate_queries の非同期版"""
+    llm = state.get("llm")
+    if not llm:
+        print("LLM instance not found in state for generating queries.")
+        return []
+
+    prompt = webresearch_prompt_dict["generate_query_prompt"].format(hpo_terms=', '.join(hpo_labels))
+    queries_msg = await llm.agenerate(prompt, lane="diagnosis")
+    return _parse_queries(queries_msg)
+
+def _parse_queries(queries_msg) -> List[str]:
     content = queries_msg.content if hasattr(queries_msg, "content") else str(queries_msg)
 
     if isinstance(content, str):
@@ -103,10 +118,26 @@ def summarize_content(state: State, article_text: str) -> str:
         return "not a medical-related page"
         
     prompt = webresearch_prompt_dict["summarize_results_prompt"].format(article_text=article_text)
-    summary_msg = llm.generate(prompt)
+    summary_msg = llm.generate(prompt, lane="summary")
+    summary = summary_msg.content if hasattr(summary_msg, "content") else str(summary_msg)
+    return summary.strip()
+
+async def asummarize_content(state: State, article_text: str) -> str:
+    """summarize_content の非同期版"""
+    llm = state.get("llm")
+    if not llm:
+        print("LLM instance not found in state for summarizing content.")
+        return "not a medical-related page"
+
+    if not article_text or not article_text.strip():
+        return "not a medical-related page"
+
+    prompt = webresearch_prompt_dict["summarize_results_prompt"].format(article_text=article_text)
+    summary_msg = await llm.agenerate(prompt, lane="summary")
     summary = summary_msg.content if hasattr(summary_msg, "content") else str(summary_msg)
     return summary.strip()
 
+@profile_tool
 def search_hpo_terms(state: State) -> List[webresource]:
     """
     Performs a web search based on HPO terms, summarizes the results,
@@ -123,10 +154,12 @@ def search_hpo_terms(state: State) -> List[webresource]:
     existing_webresources = state.get("webresources", [])
     existing_urls = {w.get("url") for w in existing_webresources if w.get("url")}
     
+    from ddgs import DDGS  # 最初の検索時に読み込む（import が重いため）
     with DDGS() as ddgs:
         for query in queries:
             try:
-                results = list(ddgs.text(query, max_results=2))
+                with accounting.track("api", "DDGS"):
+                    results = list(ddgs.text(query, max_results=2))
             except Exception as e:
                 print(f"DDGS search failed for query '{query}': {e}")
                 continue
@@ -150,3 +183,59 @@ def search_hpo_terms(state: State) -> List[webresource]:
                 existing_urls.add(url)
                 
     return new_webresources
+
+
+def _ddgs_text_search(query: str, max_results: int = 2) -> list:
+    from ddgs import DDGS  # 最初の検索時に読み込む（import が重いため）
+    with accounting.track("api", "DDGS"), DDGS() as ddgs:
+        return list(ddgs.text(query, max_results=max_results))
+
+
+@profile_tool
+async def asearch_hpo_terms(state: State) -> List[webresource]:
+    """
+    search_hpo_terms の非同期版。
+    DDGS は同期APIのみのためスレッドで実行し、要約は結果ごとに並行して行う。
+    """
+    hpo_dict = state.get("hpoDict", {})
+    if not hpo_dict:
+        return []
+
+    hpo_labels = extract_hpo_labels(hpo_dict)
+    queries = await agenerate_queries(state, hpo_labels)
+
+    existing_webresources = state.get("webresources", [])
+    existing_urls = {w.get("url") for w in existing_webresources if w.get("url")}
+
+    async def _search(query):
+        try:
+            return await asyncio.to_thread(_ddgs_text_search, query, 2)
+        except Exception as e:
+            print(f"DDGS search failed for query '{query}': {e}")
+            return []
+
+    search_results = await asyncio.gather(*[_search(query) for query in queries])
+
+    # 逐次版と同じ順序・重複排除規則で要約対象を決める
+    targets = []
+    for results in search_results:
+        for result in results:
+            url = result.get("href")
+            if not url or url in existing_urls:
+                continue
+            existing_urls.add(url)
+            targets.append(result)
+
+    summaries = await asyncio.gather(*[asummarize_content(state, result.get("body")) for result in targets])
+
+    new_webresources = []
+    for result, summary in zip(targets, summaries):
+        if "not a medical-related page" in summary.lower():
+            continue
+        new_webresources.append(webresource(
+            title=result.get("title", "No Title"),
+            url=result.get("href"),
+            snippet=summary
+        ))
+
+    return new_webresources
@@ -1,22 +1,15 @@
 from langchain.schema import HumanMessage
 from ..state.state_types import ZeroShotOutput, State
 from ..llm.prompt import prompt_dict, build_prompt
+from ..utils.profiler import profile_tool
 
 
-def createZeroshot(state: State):
-    """
-    hpo_dictを使ってZero-Shot診断プロンプトを作成し、LLMに投げる。
-    use_absentHPO=True の場合のみ、明示的に観察されなかったHPOもプロンプトへ含める。
-    """
+def _build_zeroshot_prompt(state: State):
     hpo_dict = state.get("hpoDict", {})
     absent_hpo_dict = state.get("absentHpoDict", {})
     use_absent_hpo = state.get("use_absentHPO", False)
     onset = state.get("onset")
     sex = state.get("sex")
-    llm = state.get("llm")
-
-    if not hpo_dict or not llm:
-        return None, None
 
     present_hpo = ", ".join([v for k, v in hpo_dict.items() if v])
     absent_hpo = (
@@ -25,7 +18,7 @@ def createZeroshot(state: State):
         else ""
     )
 
-    prompt = build_prompt(
+    return build_prompt(
         prompt_dict["zero-shot-diagnosis-prompt"],
         {
             "present_hpo": present_hpo,
@@ -36,6 +29,21 @@ def createZeroshot(state: State):
         }
     )
 
+
+@profile_tool
+def createZeroshot(state: State):
+    """
+    hpo_dictを使ってZero-Shot診断プロンプトを作成し、LLMに投げる。
+    use_absentHPO=True の場合のみ、明示的に観察されなかったHPOもプロンプトへ含める。
+    """
+    hpo_dict = state.get("hpoDict", {})
+    llm = state.get("llm")
+
+    if not hpo_dict or not llm:
+        return None, None
+
+    prompt = _build_zeroshot_prompt(state)
+
     # structured_llmを使う場合
     structured_llm = llm.get_structured_llm(ZeroShotOutput)
     messages = [HumanMessage(content=prompt)]
@@ -43,5 +51,28 @@ def createZeroshot(state: State):
         structured_llm,
         messages,
         context="ZeroShot",
+        lane="zeroshot",
+    )
+    return result, prompt
+
+
+@profile_tool
+async def acreateZeroshot(state: State):
+    """createZeroshot の非同期版"""
+    hpo_dict = state.get("hpoDict", {})
+    llm = state.get("llm")
+
+    if not hpo_dict or not llm:
+        return None, None
+
+    prompt = _build_zeroshot_prompt(state)
+
+    structured_llm = llm.get_structured_llm(ZeroShotOutput)
+    messages = [HumanMessage(content=prompt)]
+    result = await llm.ainvoke_with_content_filter_retry(
+        structured_llm,
+        messages,
+        context="ZeroShot",
+        lane="zeroshot",
     )
     return result, prompt
@@ -1,8 +1,48 @@
-from typing import Optional
+from typing import Callable, List, Optional
 import re
 from langchain.schema import HumanMessage
 from ..state.state_types import State, DiagnosisOutput, DiagnosisFormat
 from ..llm.prompt import prompt_dict, build_prompt
+from ..utils.profiler import profile_tool
+
+CASE_START = "===CASE_START==="
+CASE_END = "===CASE_END==="
+
+
+def parse_diagnosis_case(block: str) -> Optional[DiagnosisFormat]:
+    """
+    ===CASE_START=== と ===CASE_END=== の間の1ブロックを DiagnosisFormat に変換する。
+    必須項目が欠けている場合は None を返す。
+    """
+    rank_match = re.search(r"RANK::(\d+)", block)
+    disease_match = re.search(r"DISEASE::(.*)", block)
+    omim_match = re.search(r"OMIM::(.*)", block)
+    desc_match = re.search(r"DESCRIPTION::(.*)", block, re.DOTALL)
+
+    if not (rank_match and disease_match and desc_match):
+        return None
+
+    rank = int(rank_match.group(1).strip())
+    disease = disease_match.group(1).strip()
+    omim = omim_match.group(1).strip() if omim_match else None
+    desc = desc_match.group(1).strip()
+
+    # Clean up OMIM if it's "None" or empty or "N/A"
+    if omim and (omim.lower() == "none" or omim.lower() == "n/a" or not omim):
+        omim = None
+
+    return DiagnosisFormat(
+        rank=rank,
+        disease_name=disease,
+        OMIM_id=omim,
+        description=desc
+    )
+
+
+def parse_diagnosis_references(text: str) -> Optional[str]:
+    ref_match = re.search(r"===REFERENCES_START===(.*?)===REFERENCES_END===", text, re.DOTALL)
+    return ref_match.group(1).strip() if ref_match else None
+
 
 def parse_diagnosis_text(text: str) -> DiagnosisOutput:
     """
@@ -13,38 +53,50 @@ def parse_diagnosis_text(text: str) -> DiagnosisOutput:
     case_blocks = re.findall(r"===CASE_START===(.*?)===CASE_END===", text, re.DOTALL)
     
     for block in case_blocks:
-        rank_match = re.search(r"RANK::(\d+)", block)
-        disease_match = re.search(r"DISEASE::(.*)", block)
-        omim_match = re.search(r"OMIM::(.*)", block)
-        desc_match = re.search(r"DESCRIPTION::(.*)", block, re.DOTALL)
-        
-        if rank_match and disease_match and desc_match:
-            rank = int(rank_match.group(1).strip())
-            disease = disease_match.group(1).strip()
-            omim = omim_match.group(1).strip() if omim_match else None
-            desc = desc_match.group(1).strip()
-            
-            # Clean up OMIM if it's "None" or empty or "N/A"
-            if omim and (omim.lower() == "none" or omim.lower() == "n/a" or not omim):
-                omim = None
-                
-            cases.append(DiagnosisFormat(
-                rank=rank,
-                disease_name=disease,
-                OMIM_id=omim,
-                description=desc
-            ))
+        case = parse_diagnosis_case(block)
+        if case:
+            cases.append(case)
             
     # Extract references
-    ref_match = re.search(r"===REFERENCES_START===(.*?)===REFERENCES_END===", text, re.DOTALL)
-    references = ref_match.group(1).strip() if ref_match else None
-    
-    return DiagnosisOutput(ans=cases, reference=references)
+    return DiagnosisOutput(ans=cases, reference=parse_diagnosis_references(text))
 
-def createDiagnosis(state: State) -> Optional[DiagnosisOutput]:
+
+class DiagnosisStreamParser:
     """
-    Integrates multiple information sources (PCF, ZeroShot, GestaltMatcher, PhenotypeSearch) 
-    to generate a tentative diagnosis.
+    ストリーミング出力を少しずつ受け取り、===CASE_END=== まで揃ったケースから順に返す。
+    最終的な結果は parse_diagnosis_text(全文) と同じになる。
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.cases: List[DiagnosisFormat] = []
+        self._scan_pos = 0
+
+    def feed(self, chunk: str) -> List[DiagnosisFormat]:
+        """チャンクを追加し、新たに完成したケースを返す。"""
+        self.text += chunk
+        completed = []
+        while True:
+            start = self.text.find(CASE_START, self._scan_pos)
+            if start == -1:
+                break
+            end = self.text.find(CASE_END, start + len(CASE_START))
+            if end == -1:
+                break
+            self._scan_pos = end + len(CASE_END)
+            case = parse_diagnosis_case(self.text[start + len(CASE_START):end])
+            if case:
+                completed.append(case)
+        self.cases.extend(completed)
+        return completed
+
+    def result(self) -> DiagnosisOutput:
+        # feed() で返したオブジェクトをそのまま使う（呼び出し側が正規化で書き換えるため）
+        return DiagnosisOutput(ans=self.cases, reference=parse_diagnosis_references(self.text))
+
+def _build_diagnosis_prompt(state: State) -> str:
+    """
+    Builds the tentative-diagnosis prompt from the merged tool candidates and web search results.
     """
     hpo_list = list(state.get("hpoDict", {}).values())
     use_absent_hpo = state.get("use_absentHPO", False)
@@ -58,11 +110,6 @@ def createDiagnosis(state: State) -> Optional[DiagnosisOutput]:
     gestalt_matcher_results = state.get("GestaltMatcher", [])
     web_search_results = state.get("webresources", [])
     merged_candidates = state.get("mergedDiseaseCandidates", [])
-    llm = state.get("llm")
-
-    if not llm:
-        print("LLM instance not found in state.")
-        return None, None
 
     has_gestalt = gestalt_matcher_results and len(gestalt_matcher_results) > 0
 
@@ -121,6 +168,23 @@ def createDiagnosis(state: State) -> Optional[DiagnosisOutput]:
         },
     )
 
+    return prompt
+
+
+@profile_tool
+def createDiagnosis(state: State) -> Optional[DiagnosisOutput]:
+    """
+    Integrates multiple information sources (PCF, ZeroShot, GestaltMatcher, PhenotypeSearch) 
+    to generate a tentative diagnosis.
+    """
+    llm = state.get("llm")
+
+    if not llm:
+        print("LLM instance not found in state.")
+        return None, None
+
+    prompt = _build_diagnosis_prompt(state)
+
     # --- Query the LLM to get the diagnosis result ---
     messages = [HumanMessage(content=prompt)]
     
@@ -128,6 +192,7 @@ def createDiagnosis(state: State) -> Optional[DiagnosisOutput]:
         llm.llm,
         messages,
         context="Diagnosis",
+        lane="diagnosis",
     )
     content = response.content
     """
@@ -143,3 +208,84 @@ def createDiagnosis(state: State) -> Optional[DiagnosisOutput]:
         return (diagnosis_output, prompt)
     
     return None, None
+
+
+@profile_tool
+async def acreateDiagnosis(state: State) -> Optional[DiagnosisOutput]:
+    """
+    Async version of createDiagnosis.
+    """
+    llm = state.get("llm")
+
+    if not llm:
+        print("LLM instance not found in state.")
+        return None, None
+
+    prompt = _build_diagnosis_prompt(state)
+    messages = [HumanMessage(content=prompt)]
+
+    response = await llm.ainvoke_with_content_filter_retry(
+        llm.llm,
+        messages,
+        context="Diagnosis",
+        lane="diagnosis",
+    )
+    diagnosis_output = parse_diagnosis_text(response.content)
+
+    if diagnosis_output and diagnosis_output.ans:
+        return (diagnosis_output, prompt)
+
+    return None, None
+
+
+@profile_tool
+def createDiagnosisStreaming(state: State, on_case: Callable[[DiagnosisFormat], None]) -> Optional[DiagnosisOutput]:
+    """
+    createDiagnosis のストリーミング版。
+    LLM の出力を逐次パースし、ケースが1件完成するたびに on_case(case) を呼ぶ。
+    """
+    llm = state.get("llm")
+
+    if not llm:
+        print("LLM instance not found in state.")
+        return None, None
+
+    prompt = _build_diagnosis_prompt(state)
+    messages = [HumanMessage(content=prompt)]
+
+    parser = DiagnosisStreamParser()
+    for chunk in llm.stream_with_content_filter_retry(llm.llm, messages, context="Diagnosis", lane="diagnosis"):
+        for case in parser.feed(chunk):
+            on_case(case)
+
+    diagnosis_output = parser.result()
+    if diagnosis_output.ans:
+        return (diagnosis_output, prompt)
+
+    return None, None
+
+
+@profile_tool
+async def acreateDiagnosisStreaming(state: State, on_case: Callable[[DiagnosisFormat], None]) -> Optional[DiagnosisOutput]:
+    """
+    Async version of createDiagnosisStreaming. on_case is called synchronously on the event loop.
+    """
+    llm = state.get("llm")
+
+    if not llm:
+        print("LLM instance not found in state.")
+        return None, None
+
+    prompt = _build_diagnosis_prompt(state)
+    messages = [HumanMessage(content=prompt)]
+
+    parser = DiagnosisStreamParser()
+    async for chunk in llm.astream_with_content_filter_retry(llm.llm, messages, context="Diagnosis", lane="diagnosis"):
+        for case in parser.feed(chunk):
+            on_case(case)
+
+    diagnosis_output = parser.result()
+    if diagnosis_output.ans:
+        return (diagnosis_output, prompt)
+
+    return None, None
@@ -1,12 +1,21 @@
+import asyncio
 import os
+import threading
 import numpy as np
 import faiss
 import json
 import re
-from openai import AzureOpenAI
+from functools import lru_cache
+from openai import AzureOpenAI, AsyncAzureOpenAI
 from dotenv import load_dotenv
-from typing import Optional
+from typing import List, Optional, Tuple
 from ..state.state_types import State,ZeroShotOutput
+from ..utils.accounting import accounting
+from ..utils.data_bundle import bundle_section
+from ..utils.embedding_cache import get_embedding_cache
+from ..utils.faiss_index import HotSwapIndex
+from .omimLexicalMatch import OmimLexicalIndex
+from ..utils.profiler import profile_tool
 
 load_dotenv()
 
@@ -16,19 +25,31 @@ region = "japaneast"
 model = "text-embedding-3-large"
 deployment_name = f"{region}-{model}"
 endpoint = f"https://{tenant}-{region}.openai.azure.com/"
-api_key = os.getenv(f"AZURE_{tenant.upper()}_{region.upper()}")
-if not api_key:
-    raise RuntimeError(f"AZURE_{tenant.upper()}_{region.upper()} is not set in .env")
-
-client = AzureOpenAI(
-    azure_endpoint=endpoint,
-    api_key=api_key,
-    api_version="2024-05-01-preview"
-)
+
+# クライアントと embedding キャッシュは最初の embedding 検索時に作る（import だけなら API キーも不要）
+_clients: Optional[Tuple[AzureOpenAI, AsyncAzureOpenAI]] = None
+_clients_lock = threading.Lock()
+
+def get_embedding_clients() -> Tuple[AzureOpenAI, AsyncAzureOpenAI]:
+    """(同期クライアント, 非同期クライアント) を返す"""
+    global _clients
+    with _clients_lock:
+        if _clients is None:
+            api_key = os.getenv(f"AZURE_{tenant.upper()}_{region.upper()}")
+            if not api_key:
+                raise RuntimeError(f"AZURE_{tenant.upper()}_{region.upper()} is not set in .env")
+            _clients = (
+                AzureOpenAI(azure_endpoint=endpoint, api_key=api_key, api_version="2024-05-01-preview"),
+                AsyncAzureOpenAI(azure_endpoint=endpoint, api_key=api_key, api_version="2024-05-01-preview"),
+            )
+        return _clients
+
+def get_normalize_embedding_cache():
+    # 同じ疾患名は患者をまたいで繰り返し現れるため、embedding をキャッシュして API 呼び出しを省く
+    return get_embedding_cache(model)
 
 # インデックスとマッピングファイルのパス
 INDEX_BASE = os.path.join(os.path.dirname(__file__), "../data/DataForOmimMapping/DataForOmimMapping")
-INDEX_BIN = INDEX_BASE + ".bin"
 INDEX_JSON = INDEX_BASE + ".json"
 OMIM_MAPPING_JSON = os.path.join(os.path.dirname(__file__), "../data/DataForOmimMapping/omim_mapping.json")
 
@@ -40,25 +61,96 @@ def extract_omim_number(omim_id_str: any) -> Optional[str]:
     match = re.search(r'\d+', str(omim_id_str))
     return match.group(0) if match else None
 
-# インデックスとマッピングのロード
-faiss_index = faiss.read_index(INDEX_BIN)
-with open(INDEX_JSON, encoding="utf-8") as f:
-    index_map = json.load(f)
-with open(OMIM_MAPPING_JSON, encoding="utf-8") as f:
-    original_omim_mapping = json.load(f)
-
-# 数字IDをキーとする新しい検索用マッピングを作成
-omim_mapping_by_number = {
-    extract_omim_number(key): value 
-    for key, value in original_omim_mapping.items() 
-    if extract_omim_number(key)
+def _reset_lexical_index():
+    global _lexical_index
+    with _lexical_index_lock:
+        _lexical_index = None
+
+def _load_index_map() -> dict:
+    """データバンドル（utils/createDataBundle.py）があれば mmap した文字列表を、なければ JSON を使う"""
+    omim_ids = bundle_section("omim_index_ids")
+    labels = bundle_section("omim_index_labels")
+    if omim_ids is not None and labels is not None:
+        return {"omim_ids": omim_ids, "labels": labels}
+    with open(INDEX_JSON, encoding="utf-8") as f:
+        return json.load(f)
+
+# インデックスとマッピング（種類は OMIM_INDEX_TYPE で選ぶ）。最初の検索時に読み込み、再構築でマッピングが置き換えられたら読み込み直す
+omim_index = HotSwapIndex(
+    INDEX_BASE, INDEX_JSON, "OMIM",
+    row_count=lambda mapping: len(mapping["omim_ids"]),
+    on_reload=_reset_lexical_index,
+    load_mapping=_load_index_map,
+    lazy=True,
+)
+
+@lru_cache(maxsize=1)
+def get_omim_mapping():
+    """{OMIM ID: 正式病名}。データバンドルがあれば mmap した辞書を、なければ JSON を使う"""
+    mapping = bundle_section("omim_labels")
+    if mapping is None:
+        with open(OMIM_MAPPING_JSON, encoding="utf-8") as f:
+            mapping = json.load(f)
+    return mapping
+
+@lru_cache(maxsize=1)
+def get_omim_mapping_by_number():
+    """数字IDをキーとする検索用マッピング（バンドルには作成済みのものが入っている）"""
+    mapping = bundle_section("omim_labels_by_number")
+    if mapping is None:
+        mapping = {
+            extract_omim_number(key): value 
+            for key, value in get_omim_mapping().items() 
+            if extract_omim_number(key)
+        }
+    return mapping
+
+# 以前のモジュール変数名（client / async_client / embedding_cache / original_omim_mapping / omim_mapping_by_number）は
+# 参照されたときに上の関数で作る
+_LAZY_ATTRIBUTES = {
+    "client": lambda: get_embedding_clients()[0],
+    "async_client": lambda: get_embedding_clients()[1],
+    "embedding_cache": get_normalize_embedding_cache,
+    "original_omim_mapping": get_omim_mapping,
+    "omim_mapping_by_number": get_omim_mapping_by_number,
 }
 
+def __getattr__(name: str):
+    if name in _LAZY_ATTRIBUTES:
+        return _LAZY_ATTRIBUTES[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# 表記揺れ程度の疾患名は embedding を使わずに文字列照合で正規化する（初回の正規化時に構築する）
+LEXICAL_MATCH_ENABLED = os.getenv("OMIM_LEXICAL_MATCH", "1").lower() in ("1", "true", "yes", "on")
+FUZZY_MATCH_THRESHOLD = float(os.getenv("OMIM_FUZZY_MATCH_THRESHOLD", "0.9"))
+_lexical_index = None
+_lexical_index_lock = threading.Lock()
+
+def get_lexical_index() -> Optional[OmimLexicalIndex]:
+    global _lexical_index
+    if not LEXICAL_MATCH_ENABLED:
+        return None
+    with _lexical_index_lock:
+        if _lexical_index is None:
+            _, index_map = omim_index.get()
+            entries = list(zip(index_map["omim_ids"], index_map["labels"])) + list(get_omim_mapping().items())
+            _lexical_index = OmimLexicalIndex(entries, fuzzy_threshold=FUZZY_MATCH_THRESHOLD)
+        return _lexical_index
+
+def warm_up():
+    """常駐プロセス向け: 最初の正規化まで遅らせているクライアント・インデックス・マッピングを読み込んでおく"""
+    get_embedding_clients()
+    get_normalize_embedding_cache()
+    omim_index.get()
+    get_omim_mapping_by_number()
+    get_lexical_index()
+
 def normalize_pcf_results(state: State) -> list:
     """
     Stateを受け取り、その中のPCFの結果リストを正規化する。
     """
     pcf_results = state.get("pubCaseFinder", [])
+    omim_mapping_by_number = get_omim_mapping_by_number()
     for result in pcf_results:
         omim_id_num = extract_omim_number(result.get("omim_id"))
         if omim_id_num and omim_id_num in omim_mapping_by_number:
@@ -71,6 +163,7 @@ def normalize_gestalt_results(state: State) -> list:
     Stateを受け取り、その中のGestaltMatcherの結果リストを正規化する。
     """
     gestalt_results = state.get("GestaltMatcher", [])
+    omim_mapping_by_number = get_omim_mapping_by_number()
     for result in gestalt_results:
         omim_id_num = extract_omim_number(result.get("omim_id"))
         if omim_id_num and omim_id_num in omim_mapping_by_number:
@@ -78,23 +171,16 @@ def normalize_gestalt_results(state: State) -> list:
             result["syndrome_name"] = omim_mapping_by_number[omim_id_num]
     return gestalt_results
 
-def normalize_zeroshot_results(state: State) -> Optional[ZeroShotOutput]:
-    """
-    Stateを受け取り、その中のZeroShotOutputを正規化し、OMIM IDを付与し、重複を排除する。
-    """
-    zeroshot_output = state.get("zeroShotResult")
-    if not zeroshot_output or not zeroshot_output.ans:
-        return zeroshot_output
+def _clean_zeroshot_name(disease_name: str) -> str:
+    cleaned_name = disease_name.strip().strip('*')
+    cleaned_name = re.sub(r'\s*\(.*\)\s*', '', cleaned_name).strip()
+    return cleaned_name.upper()
 
+def _select_zeroshot_candidates(zeroshot_output: ZeroShotOutput, normalized: list) -> ZeroShotOutput:
     unique_omim_ids = set()
     normalized_ans = []
 
-    for diag in zeroshot_output.ans:
-        cleaned_name = diag.disease_name.strip().strip('*')
-        cleaned_name = re.sub(r'\s*\(.*\)\s*', '', cleaned_name).strip()
-        disease_name_upper = cleaned_name.upper()
-        omim_id, omim_label, sim = disease_normalize(disease_name_upper)
-
+    for diag, (omim_id, omim_label, sim) in zip(zeroshot_output.ans, normalized):
         # 類似度が高い場合のみ採用し、OMIM IDがユニークであることを確認
         if sim >= 0.70 and omim_id not in unique_omim_ids:
             diag.OMIM_id = omim_id
@@ -107,31 +193,169 @@ def normalize_zeroshot_results(state: State) -> Optional[ZeroShotOutput]:
     zeroshot_output.ans = normalized_ans
     return zeroshot_output
 
-def disease_normalize(disease_name: str):
+def normalize_zeroshot_results(state: State) -> Optional[ZeroShotOutput]:
     """
-    疾患名をembeddingし、FAISSインデックスで最も類似するOMIM IDと正規化病名を返す。
+    Stateを受け取り、その中のZeroShotOutputを正規化し、OMIM IDを付与し、重複を排除する。
     """
-    # 疾患名をembedding
-    response = client.embeddings.create(
-        model=deployment_name,
-        input=[disease_name]
-    )
-    query_embedding = np.array(response.data[0].embedding, dtype="float32").reshape(1, -1)
-    faiss.normalize_L2(query_embedding)
+    zeroshot_output = state.get("zeroShotResult")
+    if not zeroshot_output or not zeroshot_output.ans:
+        return zeroshot_output
+
+    names = [_clean_zeroshot_name(diag.disease_name) for diag in zeroshot_output.ans]
+    return _select_zeroshot_candidates(zeroshot_output, disease_normalize_batch(names))
+
+async def anormalize_zeroshot_results(state: State) -> Optional[ZeroShotOutput]:
+    """normalize_zeroshot_results の非同期版"""
+    zeroshot_output = state.get("zeroShotResult")
+    if not zeroshot_output or not zeroshot_output.ans:
+        return zeroshot_output
+
+    names = [_clean_zeroshot_name(diag.disease_name) for diag in zeroshot_output.ans]
+    return _select_zeroshot_candidates(zeroshot_output, await adisease_normalize_batch(names))
+
+NormalizedDisease = Tuple[str, str, float]
+
+def _search_omim_index(query_embeddings: np.ndarray) -> List[NormalizedDisease]:
+    """
+    embedding 行列 (n, dim) で FAISS インデックスを1回だけ検索し、
+    行ごとに (OMIM ID, 正規化病名, 類似度) を返す。
+    """
+    query_embeddings = np.ascontiguousarray(query_embeddings, dtype="float32")
+    faiss.normalize_L2(query_embeddings)
     
     # 類似度最大のインデックスを取得
-    distance, indices = faiss_index.search(query_embedding, 1)
-    idx = indices[0][0]
-    sim = float(distance[0][0])  # コサイン類似度
-    
-    omim_id_from_index = index_map["omim_ids"][idx]
-    label_from_index = index_map["labels"][idx]
-    
+    faiss_index, index_map = omim_index.get()
+    distances, indices = faiss_index.search(query_embeddings, 1)
+    return [
+        _omim_result(index_map["omim_ids"][idx], index_map["labels"][idx], float(sim))  # コサイン類似度
+        for idx, sim in zip(indices[:, 0], distances[:, 0])
+    ]
+
+def _omim_result(omim_id: str, fallback_label: str, sim: float) -> NormalizedDisease:
     # omim_mapping.jsonから正式病名を取得
-    omim_id_num = extract_omim_number(omim_id_from_index)
-    omim_label = omim_mapping_by_number.get(omim_id_num, label_from_index)
-    
-    return omim_id_from_index, omim_label, sim
+    omim_label = get_omim_mapping_by_number().get(extract_omim_number(omim_id), fallback_label)
+    return omim_id, omim_label, sim
+
+def _match_lexically(disease_names: List[str], lexical_index: Optional[OmimLexicalIndex]) -> Tuple[dict, List[str]]:
+    """文字列照合で決まった結果と、embedding 検索が必要な疾患名（重複除去済み）を返す"""
+    unique_names = list(dict.fromkeys(disease_names))
+    if lexical_index is None:
+        return {}, unique_names
+    matched = {}
+    for name in unique_names:
+        hit = lexical_index.match(name)
+        if hit is not None:
+            omim_id, sim = hit
+            matched[name] = _omim_result(omim_id, name, sim)
+    return matched, [name for name in unique_names if name not in matched]
+
+def _cached_vectors(disease_names: List[str]) -> Tuple[dict, List[str]]:
+    """キャッシュ済みの embedding と、API で取得が必要な疾患名（重複除去済み）を返す"""
+    embedding_cache = get_normalize_embedding_cache()
+    vectors = {}
+    missing = []
+    for name in disease_names:
+        if name in vectors or name in missing:
+            continue
+        vector = embedding_cache.get(name)
+        if vector is None:
+            missing.append(name)
+        else:
+            vectors[name] = vector
+    return vectors, missing
+
+def _store_embeddings(response, missing: List[str], vectors: dict, record):
+    record.add_usage(response.usage.prompt_tokens)
+    embedding_cache = get_normalize_embedding_cache()
+    for name, item in zip(missing, sorted(response.data, key=lambda d: d.index)):
+        vector = np.array(item.embedding, dtype="float32")
+        embedding_cache.put(name, vector)
+        vectors[name] = vector
+
+def disease_normalize_batch(disease_names: List[str]) -> List[NormalizedDisease]:
+    """
+    複数の疾患名をまとめて正規化し、名前ごとに (OMIM ID, 正規化病名, 類似度) を返す。
+    まず OMIM ラベルとの文字列照合（完全一致・トライグラム近似一致）を行い、
+    決まらなかった名前のうちキャッシュに無いものだけを1回の embeddings リクエストで取得し、FAISS 検索も1回で行う。
+    """
+    if not disease_names:
+        return []
+    results, remaining = _match_lexically(disease_names, get_lexical_index())
+    if remaining:
+        with accounting.track("embedding", "DiseaseNormalize", model=model) as record:
+            vectors, missing = _cached_vectors(remaining)
+            if missing:
+                response = get_embedding_clients()[0].embeddings.create(model=deployment_name, input=missing)
+                _store_embeddings(response, missing, vectors, record)
+            else:
+                record.cache_hit = True
+        results.update(zip(remaining, _search_omim_index(np.vstack([vectors[name] for name in remaining]))))
+    return [results[name] for name in disease_names]
+
+async def adisease_normalize_batch(disease_names: List[str]) -> List[NormalizedDisease]:
+    """disease_normalize_batch の非同期版（文字列照合インデックスの初回構築はスレッドで行う）"""
+    if not disease_names:
+        return []
+    results, remaining = _match_lexically(disease_names, await asyncio.to_thread(get_lexical_index))
+    if remaining:
+        with accounting.track("embedding", "DiseaseNormalize", model=model) as record:
+            vectors, missing = _cached_vectors(remaining)
+            if missing:
+                response = await get_embedding_clients()[1].embeddings.create(model=deployment_name, input=missing)
+                _store_embeddings(response, missing, vectors, record)
+            else:
+                record.cache_hit = True
+        results.update(zip(remaining, _search_omim_index(np.vstack([vectors[name] for name in remaining]))))
+    return [results[name] for name in disease_names]
+
+def disease_normalize(disease_name: str) -> NormalizedDisease:
+    """
+    疾患名をembeddingし、FAISSインデックスで最も類似するOMIM IDと正規化病名を返す。
+    embedding はキャッシュにあれば API を呼ばずに再利用する。
+    """
+    return disease_normalize_batch([disease_name])[0]
+
+async def adisease_normalize(disease_name: str) -> NormalizedDisease:
+    """disease_normalize の非同期版"""
+    return (await adisease_normalize_batch([disease_name]))[0]
+
+def _apply_existing_omim_id(diag) -> bool:
+    """既にOMIM IDが付与されている候補はそのIDで正規化し、True を返す。"""
+    existing_omim_num = extract_omim_number(getattr(diag, "OMIM_id", None))
+    if not existing_omim_num:
+        return False
+    diag.OMIM_id = f"OMIM:{existing_omim_num}"
+    diag.disease_name = get_omim_mapping_by_number().get(
+        existing_omim_num,
+        diag.disease_name.strip().strip("*")
+    )
+    return True
+
+def _accept_normalized_diagnosis(diag, normalized) -> bool:
+    omim_id, omim_label, sim = normalized
+    if sim >= 0.75:
+        diag.OMIM_id = omim_id
+        diag.disease_name = omim_label
+        return True
+    print(f"Filtered out {diag.disease_name} due to low similarity ({sim:.2f})")
+    return False
+
+@profile_tool
+def normalize_diagnosis_item(diag) -> bool:
+    """
+    診断候補1件にOMIM idと正規化病名を付与する。採用する場合は True、棄却する場合は False。
+    ストリーミング診断でケースごとに正規化する際にも使う。
+    """
+    if _apply_existing_omim_id(diag):
+        return True
+    return _accept_normalized_diagnosis(diag, disease_normalize(diag.disease_name.upper()))
+
+@profile_tool
+async def anormalize_diagnosis_item(diag) -> bool:
+    """normalize_diagnosis_item の非同期版"""
+    if _apply_existing_omim_id(diag):
+        return True
+    return _accept_normalized_diagnosis(diag, await adisease_normalize(diag.disease_name.upper()))
 
 def diseaseNormalizeForDiagnosis(Diagnosis):
     """
@@ -139,29 +363,27 @@ def diseaseNormalizeForDiagnosis(Diagnosis):
     各診断候補にOMIM idと正規化病名を付与し、類似度0.75未満は棄却。
     既にOMIM IDが付与されている候補は、そのIDを疾患同定の根拠として優先する。
     """
-    filtered_ans = []
     if not hasattr(Diagnosis, "ans"):
         return Diagnosis
-        
-    for diag in Diagnosis.ans:
-        existing_omim_num = extract_omim_number(getattr(diag, "OMIM_id", None))
-        if existing_omim_num:
-            diag.OMIM_id = f"OMIM:{existing_omim_num}"
-            diag.disease_name = omim_mapping_by_number.get(
-                existing_omim_num,
-                diag.disease_name.strip().strip("*")
-            )
-            filtered_ans.append(diag)
-            continue
 
-        disease_name_upper = diag.disease_name.upper()
-        omim_id, omim_label, sim = disease_normalize(disease_name_upper)
+    pending = [diag for diag in Diagnosis.ans if not _apply_existing_omim_id(diag)]
+    normalized = disease_normalize_batch([diag.disease_name.upper() for diag in pending])
+    return _filter_normalized_diagnosis(Diagnosis, pending, normalized)
 
-        if sim >= 0.75:
-            diag.OMIM_id = omim_id
-            diag.disease_name = omim_label
-            filtered_ans.append(diag)
-        else:
-            print(f"Filtered out {diag.disease_name} due to low similarity ({sim:.2f})")
-    Diagnosis.ans = filtered_ans
+async def adiseaseNormalizeForDiagnosis(Diagnosis):
+    """diseaseNormalizeForDiagnosis の非同期版"""
+    if not hasattr(Diagnosis, "ans"):
+        return Diagnosis
+
+    pending = [diag for diag in Diagnosis.ans if not _apply_existing_omim_id(diag)]
+    normalized = await adisease_normalize_batch([diag.disease_name.upper() for diag in pending])
+    return _filter_normalized_diagnosis(Diagnosis, pending, normalized)
+
+def _filter_normalized_diagnosis(Diagnosis, pending: list, normalized: List[NormalizedDisease]):
+    """embedding で正規化した候補のうち、類似度が閾値未満のものを Diagnosis.ans から除く"""
+    rejected = {
+        id(diag) for diag, result in zip(pending, normalized)
+        if not _accept_normalized_diagnosis(diag, result)
+    }
+    Diagnosis.ans = [diag for diag in Diagnosis.ans if id(diag) not in rejected]
     return Diagnosis
@@ -1,8 +1,10 @@
+import asyncio
 from typing import List, Dict, Any
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from langchain_community.retrievers import PubMedRetriever, WikipediaRetriever
+from concurrent.futures import as_completed
 from ..state.state_types import State, InformationItem
 from ..llm.llm_wrapper import AzureOpenAIWrapper
+from ..utils.accounting import ContextThreadPoolExecutor, accounting
+from ..utils.profiler import profile_tool
 import os
 import time
 import random
@@ -11,10 +13,7 @@ import random
 DISEASE_SEARCH_MAX_WORKERS = int(os.getenv("DISEASE_SEARCH_MAX_WORKERS", "4"))
 
 
-def summarize_text(text: str, llm: AzureOpenAIWrapper) -> str:
-    """入力テキストを要約する関数"""
-    try:
-        prompt = """
+DISEASE_SUMMARY_PROMPT = """
 You are an expert clinical geneticist and a diagnostician. Your critical task is to analyze a medical text and convert it into a high-yield, structured summary designed specifically for differential diagnosis. Your output must not only list symptoms but also highlight features that distinguish the condition from its clinical mimics.
 
 Instructions:
@@ -70,8 +69,26 @@ Unique Constellation: [Describe a diagnostically powerful combination of symptom
 
 Now, process the following text:
 
-""" + text
-        summary_msg = llm.generate(prompt)
+"""
+
+
+def summarize_text(text: str, llm: AzureOpenAIWrapper) -> str:
+    """入力テキストを要約する関数"""
+    try:
+        prompt = DISEASE_SUMMARY_PROMPT + text
+        summary_msg = llm.generate(prompt, lane="summary")
+        summary = summary_msg.content if hasattr(summary_msg, "content") else str(summary_msg)
+        return summary.strip()
+    except Exception as e:
+        print(f"要約時にエラー: {e}")
+        return text
+
+
+async def asummarize_text(text: str, llm: AzureOpenAIWrapper) -> str:
+    """summarize_text の非同期版"""
+    try:
+        prompt = DISEASE_SUMMARY_PROMPT + text
+        summary_msg = await llm.agenerate(prompt, lane="summary")
         summary = summary_msg.content if hasattr(summary_msg, "content") else str(summary_msg)
         return summary.strip()
     except Exception as e:
@@ -79,6 +96,7 @@ Now, process the following text:
         return text
 
 
+@profile_tool
 def search_single_disease_wikipedia(disease_name: str, search_depth: int, llm: AzureOpenAIWrapper) -> List[Dict[str, Any]]:
     """
     1つの疾患についてWikipediaを検索する（並列実行用）
@@ -86,9 +104,12 @@ def search_single_disease_wikipedia(disease_name: str, search_depth: int, llm: A
     """
     results = []
     try:
+        # langchain_community は import が重いため、最初の検索時に読み込む
+        from langchain_community.retrievers import WikipediaRetriever
         wiki_retriever = WikipediaRetriever(top_k_results=search_depth * 1, doc_content_chars_max=2000)
         print(f"    - [Wikipedia] 「{disease_name}」を検索中...")
-        wiki_docs = wiki_retriever.invoke(disease_name)
+        with accounting.track("api", "Wikipedia"):
+            wiki_docs = wiki_retriever.invoke(disease_name)
 
         for doc in wiki_docs:
             url = doc.metadata.get("source", "N/A")
@@ -105,6 +126,7 @@ def search_single_disease_wikipedia(disease_name: str, search_depth: int, llm: A
     return results
 
 
+@profile_tool
 def search_single_disease_pubmed(disease_name: str, search_depth: int, llm: AzureOpenAIWrapper) -> List[Dict[str, Any]]:
     """
     1つの疾患についてPubMedを検索する（並列実行用）
@@ -116,9 +138,11 @@ def search_single_disease_pubmed(disease_name: str, search_depth: int, llm: Azur
     
     for attempt in range(max_retries):
         try:
+            from langchain_community.retrievers import PubMedRetriever
             pubmed_retriever = PubMedRetriever(top_k_results=search_depth * 3, doc_content_chars_max=3000)
             print(f"    - [PubMed] 「{disease_name}」を検索中...")
-            pubmed_docs = pubmed_retriever.invoke(disease_name)
+            with accounting.track("api", "PubMed"):
+                pubmed_docs = pubmed_retriever.invoke(disease_name)
 
             for doc in pubmed_docs:
                 url = f"https://pubmed.ncbi.nlm.nih.gov/{doc.metadata['uid']}/"
@@ -152,6 +176,20 @@ def search_single_disease_pubmed(disease_name: str, search_depth: int, llm: Azur
     return results
 
 
+def merge_search_results_into_memory(memory: List[InformationItem], retrieved_urls: set, results: List[Dict[str, Any]]) -> int:
+    """
+    検索結果のうち未取得URLのものだけを memory に追加し、追加件数を返す。
+    memory と retrieved_urls はその場で更新するため、呼び出しは1スレッドから行うこと。
+    """
+    new_items_count = 0
+    for item in results:
+        if item['url'] not in retrieved_urls:
+            memory.append(item)
+            retrieved_urls.add(item['url'])
+            new_items_count += 1
+    return new_items_count
+
+
 def diseaseSearchForDiagnosis(state: State) -> Dict[str, List[InformationItem]]:
     """
     暫定診断リストの各疾患について知識検索を並列実行し、重複を避けながらStateのmemoryに結果を追加する。
@@ -190,7 +228,7 @@ def diseaseSearchForDiagnosis(state: State) -> Dict[str, List[InformationItem]]:
     # 並列実行で取得した全結果を一時保存
     all_results = []
     
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+    with ContextThreadPoolExecutor(max_workers=max_workers) as executor:
         # 全ての検索タスクを投入
         futures = {}
         
@@ -232,12 +270,136 @@ def diseaseSearchForDiagnosis(state: State) -> Dict[str, List[InformationItem]]:
                 completed_count += 1
 
     # --- スレッドプール終了後に重複チェックして追加（スレッドセーフ） ---
-    new_items_count = 0
-    for item in all_results:
-        if item['url'] not in retrieved_urls:
-            memory.append(item)
-            retrieved_urls.add(item['url'])
-            new_items_count += 1
+    new_items_count = merge_search_results_into_memory(memory, retrieved_urls, all_results)
+
+    elapsed_time = time.time() - start_time
+    print(f"✅ 知識検索が完了しました（{elapsed_time:.2f}秒, {new_items_count}件の新規情報を追加）")
+
+    return {"memory": memory}
+
+
+@profile_tool
+async def asearch_single_disease_wikipedia(disease_name: str, search_depth: int, llm: AzureOpenAIWrapper) -> List[Dict[str, Any]]:
+    """search_single_disease_wikipedia の非同期版。取得した文書の要約は並行して行う。"""
+    try:
+        # langchain_community は import が重いため、最初の検索時に読み込む
+        from langchain_community.retrievers import WikipediaRetriever
+        wiki_retriever = WikipediaRetriever(top_k_results=search_depth * 1, doc_content_chars_max=2000)
+        print(f"    - [Wikipedia] 「{disease_name}」を検索中...")
+        with accounting.track("api", "Wikipedia"):
+            wiki_docs = await wiki_retriever.ainvoke(disease_name)
+        summaries = await asyncio.gather(*[asummarize_text(doc.page_content, llm) for doc in wiki_docs])
+    except Exception as e:
+        print(f"    - [Wikipedia] 「{disease_name}」の検索でエラー: {e}")
+        return []
+
+    return [
+        {
+            "title": doc.metadata.get("title", disease_name),
+            "url": doc.metadata.get("source", "N/A"),
+            "content": f"[Source: Wikipedia] {summary}",
+            "disease_name": disease_name
+        }
+        for doc, summary in zip(wiki_docs, summaries)
+    ]
+
+
+@profile_tool
+async def asearch_single_disease_pubmed(disease_name: str, search_depth: int, llm: AzureOpenAIWrapper) -> List[Dict[str, Any]]:
+    """search_single_disease_pubmed の非同期版。429エラー時は asyncio.sleep で待機してリトライする。"""
+    max_retries = 3
+    base_delay = 2.0
+
+    for attempt in range(max_retries):
+        try:
+            from langchain_community.retrievers import PubMedRetriever
+            pubmed_retriever = PubMedRetriever(top_k_results=search_depth * 3, doc_content_chars_max=3000)
+            print(f"    - [PubMed] 「{disease_name}」を検索中...")
+            with accounting.track("api", "PubMed"):
+                pubmed_docs = await pubmed_retriever.ainvoke(disease_name)
+            summaries = await asyncio.gather(*[asummarize_text(doc.page_content, llm) for doc in pubmed_docs])
+
+            return [
+                {
+                    "title": doc.metadata.get("Title", disease_name),
+                    "url": f"https://pubmed.ncbi.nlm.nih.gov/{doc.metadata['uid']}/",
+                    "content": f"[Source: PubMed] {summary}",
+                    "disease_name": disease_name
+                }
+                for doc, summary in zip(pubmed_docs, summaries)
+            ]
+
+        except Exception as e:
+            error_msg = str(e)
+
+            if "429" in error_msg or "Too Many Requests" in error_msg:
+                if attempt < max_retries - 1:
+                    delay = base_delay * (2 ** attempt) + random.uniform(0, 1)
+                    print(f"    - [PubMed] 「{disease_name}」でレート制限エラー (429)")
+                    print(f"      -> {delay:.1f}秒待機してリトライします...")
+                    await asyncio.sleep(delay)
+                    continue
+                else:
+                    print(f"    - [PubMed] 「{disease_name}」で最大リトライ回数到達。スキップします。")
+                    return []
+            else:
+                print(f"    - [PubMed] 「{disease_name}」の検索でエラー: {e}")
+                return []
+
+    return []
+
+
+async def adiseaseSearchForDiagnosis(state: State) -> Dict[str, List[InformationItem]]:
+    """
+    diseaseSearchForDiagnosis の非同期版。
+    同時実行数は DISEASE_SEARCH_MAX_WORKERS で制限し、スレッドを占有せずに待機する。
+    """
+    print("🔬 知識検索を開始します（非同期処理）...")
+    start_time = time.time()
+
+    llm = state.get("llm")
+    tentativeDiagnosis = state.get("tentativeDiagnosis")
+    search_depth = state.get("depth", 1)
+
+    if not llm:
+        print("LLMインスタンスがstate内に見つかりません。検索をスキップします。")
+        return {"memory": state.get("memory", [])}
+
+    memory = state.get("memory", [])
+    retrieved_urls = {item['url'] for item in memory}
+
+    if not tentativeDiagnosis or not hasattr(tentativeDiagnosis, "ans"):
+        print("暫定診断が見つからないため、検索をスキップします。")
+        return {"memory": memory}
+
+    disease_names = [diag.disease_name for diag in tentativeDiagnosis.ans]
+    if not disease_names:
+        print("検索対象の疾患名がないため、スキップします。")
+        return {"memory": memory}
+
+    print(f"  - 検索深度: {search_depth}, 対象疾患: {disease_names}")
+
+    semaphore = asyncio.Semaphore(DISEASE_SEARCH_MAX_WORKERS)
+    total_tasks = len(disease_names) * 2
+    completed_count = 0
+
+    async def _run(source, search_func, disease_name):
+        nonlocal completed_count
+        async with semaphore:
+            try:
+                results = await search_func(disease_name, search_depth, llm)
+            except Exception as e:
+                print(f"    - [{source}] 「{disease_name}」の処理でエラー: {e}")
+                results = []
+        completed_count += 1
+        print(f"  進捗: {completed_count}/{total_tasks} 完了 ({source}: {disease_name}, {len(results)}件)")
+        return results
+
+    tasks = [_run('wikipedia', asearch_single_disease_wikipedia, name) for name in disease_names]
+    tasks += [_run('pubmed', asearch_single_disease_pubmed, name) for name in disease_names]
+    all_results = [item for results in await asyncio.gather(*tasks) for item in results]
+
+    new_items_count = merge_search_results_into_memory(memory, retrieved_urls, all_results)
 
     elapsed_time = time.time() - start_time
     print(f"✅ 知識検索が完了しました（{elapsed_time:.2f}秒, {new_items_count}件の新規情報を追加）")
@@ -1,64 +1,115 @@
 import os
 import json
+import threading
 import numpy as np
 import faiss
-from openai import AzureOpenAI
+from openai import AzureOpenAI, AsyncAzureOpenAI
 from dotenv import load_dotenv
 from typing import List, Optional
 
 from ..state.state_types import State, PhenotypeSearchFormat, OMIMEntry
+from ..utils.accounting import accounting
+from ..utils.data_bundle import bundle_section
+from ..utils.faiss_index import HotSwapIndex
+from ..utils.hpo_term_embeddings import load_hpo_term_embeddings
+from ..utils.profiler import profile_tool, profiler
 
 # --- Initialization ---
-# This block runs only once when the module is first imported.
+# Nothing heavy happens at import: the Azure clients and the FAISS index are created on first use,
+# so importing the pipeline (or a worker that never runs this tool) stays fast.
 
 load_dotenv()
 
 # 1. Configure file paths
 # Construct relative paths to data files based on this file's location.
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-INDEX_PATH = os.path.join(BASE_DIR, '..', 'data', 'DataForDiseaseSearchFromHPO', 'phenotype_index.bin')
+INDEX_BASE = os.path.join(BASE_DIR, '..', 'data', 'DataForDiseaseSearchFromHPO', 'phenotype_index')
 MAPPING_PATH = os.path.join(BASE_DIR, '..', 'data', 'DataForDiseaseSearchFromHPO', 'phenotype_index.json')
 
-# 2. Configure Azure OpenAI client
-try:
-    AZURE_TENANT = "dbcls"
-    AZURE_REGION = "japaneast"
-    AZURE_MODEL = "text-embedding-3-large"
-    DEPLOYMENT_NAME = f"{AZURE_REGION}-{AZURE_MODEL}"
-    ENDPOINT = f"https://{AZURE_TENANT}-{AZURE_REGION}.openai.azure.com/"
-    API_KEY = os.getenv(f"AZURE_{AZURE_TENANT.upper()}_{AZURE_REGION.upper()}")
-
-    if not API_KEY:
-        raise ValueError(f"API key AZURE_{AZURE_TENANT.upper()}_{AZURE_REGION.upper()} is not set in .env file.")
-
-    client = AzureOpenAI(
-        azure_endpoint=ENDPOINT,
-        api_key=API_KEY,
-        api_version="2024-05-01-preview"
-    )
-except Exception as e:
-    print(f"Error initializing Azure OpenAI client: {e}")
-    client = None
-
-# 3. Load FAISS index and mapping data
-try:
-    index = faiss.read_index(INDEX_PATH)
+# 2. Azure OpenAI client settings (clients are created by get_embedding_clients())
+AZURE_TENANT = "dbcls"
+AZURE_REGION = "japaneast"
+AZURE_MODEL = "text-embedding-3-large"
+DEPLOYMENT_NAME = f"{AZURE_REGION}-{AZURE_MODEL}"
+ENDPOINT = f"https://{AZURE_TENANT}-{AZURE_REGION}.openai.azure.com/"
+
+_clients = None
+_clients_lock = threading.Lock()
+
+
+def get_embedding_clients():
+    """Return (client, async_client), creating them on first call; (None, None) if they cannot be created."""
+    global _clients
+    with _clients_lock:
+        if _clients is None:
+            try:
+                api_key = os.getenv(f"AZURE_{AZURE_TENANT.upper()}_{AZURE_REGION.upper()}")
+                if not api_key:
+                    raise ValueError(f"API key AZURE_{AZURE_TENANT.upper()}_{AZURE_REGION.upper()} is not set in .env file.")
+                _clients = (
+                    AzureOpenAI(azure_endpoint=ENDPOINT, api_key=api_key, api_version="2024-05-01-preview"),
+                    AsyncAzureOpenAI(azure_endpoint=ENDPOINT, api_key=api_key, api_version="2024-05-01-preview"),
+                )
+            except Exception as e:
+                print(f"Error initializing Azure OpenAI client: {e}")
+                _clients = (None, None)
+        return _clients
+
+# 3. FAISS index and mapping data
+# PHENOTYPE_INDEX_TYPE selects the index variant; see agent/utils/faiss_index.py.
+# The pair is loaded on the first search and reloaded when a rebuild replaces the mapping file.
+def _load_phenotype_mapping():
+    # Prefer the memory-mapped data bundle (utils/createDataBundle.py); entries are decoded on access.
+    entries = bundle_section("phenotype_index_entries")
+    if entries is not None:
+        return entries
     with open(MAPPING_PATH, 'r', encoding='utf-8') as f:
-        phenotype_mapping = json.load(f)
+        return json.load(f)
+
+phenotype_index = HotSwapIndex(INDEX_BASE, MAPPING_PATH, "PHENOTYPE", load_mapping=_load_phenotype_mapping, lazy=True)
+_phenotype_index_failed = False
+
+
+def _phenotype_index_ready() -> bool:
+    """Load the index on first use; a failed load is reported once and not retried."""
+    global _phenotype_index_failed
+    if phenotype_index.loaded:
+        return True
+    if _phenotype_index_failed:
+        return False
+    try:
+        phenotype_index.get()
+    except Exception as e:
+        print(f"Fatal Error: Could not load FAISS index or mapping file. {e}")
+        _phenotype_index_failed = True
+        return False
     print("Successfully loaded phenotype FAISS index and mapping data.")
-except Exception as e:
-    print(f"Fatal Error: Could not load FAISS index or mapping file. {e}")
-    index = None
-    phenotype_mapping = None
+    return True
+
+# 4. Local HPO term embeddings (utils/createHPOTermEmbeddings.py)
+# When the table is available, the query vector is composed locally as an IC-weighted mean of
+# the term vectors instead of embedding the joined labels. Set PHENOTYPE_LOCAL_QUERY=0 to disable.
+LOCAL_QUERY_ENABLED = os.getenv("PHENOTYPE_LOCAL_QUERY", "1").lower() in ("1", "true", "yes", "on")
+
+def warm_up() -> bool:
+    """Create the clients and load the index and term table now (for long-running processes)."""
+    get_embedding_clients()
+    if LOCAL_QUERY_ENABLED:
+        load_hpo_term_embeddings()
+    return _phenotype_index_ready()
+
+# Old module attributes (client / async_client) are still available, created on access.
+def __getattr__(name: str):
+    if name == "client":
+        return get_embedding_clients()[0]
+    if name == "async_client":
+        return get_embedding_clients()[1]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # --- Main Search Function ---
 
-def embedding_search_with_hpo(state: State) -> Optional[List[PhenotypeSearchFormat]]:
-    """
-    Generates a search query from the patient's HPO dictionary and uses a FAISS index
-    to find diseases with similar phenotypes.
-    """
-    if not index or not phenotype_mapping or not client:
+def _get_hpo_dict(state: State) -> Optional[dict]:
+    if not _phenotype_index_ready():
         print("Search cannot be performed due to initialization errors.")
         return None
 
@@ -66,7 +117,23 @@ def embedding_search_with_hpo(state: State) -> Optional[List[PhenotypeSearchForm
     if not hpo_dict:
         print("No HPO dictionary found in state. Skipping phenotype search.")
         return None
+    return hpo_dict
+
+
+def _local_query_vector(hpo_dict: dict) -> Optional[np.ndarray]:
+    """Compose the query vector from the local term table; None if it cannot cover every term."""
+    if not LOCAL_QUERY_ENABLED:
+        return None
+    term_embeddings = load_hpo_term_embeddings()
+    if term_embeddings is None or term_embeddings.dim != phenotype_index.get()[0].d:
+        return None
+    if term_embeddings.model and term_embeddings.model != AZURE_MODEL:
+        return None
+    with profiler.span("PhenotypeQueryLocal", "embedding", terms=len(hpo_dict)):
+        return term_embeddings.compose(hpo_dict.keys())
 
+
+def _build_query_text(hpo_dict: dict) -> Optional[str]:
     # 1. Generate search query (comma-separated HPO labels)
     query_text = ", ".join(hpo_dict.values())
     if not query_text:
@@ -74,47 +141,115 @@ def embedding_search_with_hpo(state: State) -> Optional[List[PhenotypeSearchForm
         return None
     
     #print(f"Phenotype search query: {query_text}")
+    return query_text
+
+
+def phenotype_search_k(depth: int) -> int:
+    """depth ごとの表現型検索件数（上位 5*<depth> 件）"""
+    return 5 * depth
+
+
+def _search_phenotype_index(query_vector: np.ndarray, k: int) -> List[PhenotypeSearchFormat]:
+    # 3. Normalize the vector (required for cosine similarity search with IndexFlatIP)
+    faiss.normalize_L2(query_vector)
+
+    # 4. Execute search with FAISS (top k results)
+    index, phenotype_mapping = phenotype_index.get()
+    distances, indices = index.search(query_vector, k)
+
+    # 5. Format the results into a list of PhenotypeSearchFormat
+    search_results = []
+    for i in range(k):
+        idx = indices[0][i]
+        score = distances[0][i]
+
+        # An index of -1 indicates no more valid results
+        if idx == -1:
+            continue
+
+        # Retrieve the corresponding disease data from the mapping file
+        disease_data = phenotype_mapping[idx]
+        
+        # Convert to Pydantic models
+        omim_entry = OMIMEntry(**disease_data)
+        
+        result_format = PhenotypeSearchFormat(
+            disease_info=omim_entry,
+            similarity_score=float(score)
+        )
+        search_results.append(result_format)
+    
+    return search_results
+
+
+@profile_tool
+def embedding_search_with_hpo(state: State, top_k: Optional[int] = None) -> Optional[List[PhenotypeSearchFormat]]:
+    """
+    Generates a search query from the patient's HPO dictionary and uses a FAISS index
+    to find diseases with similar phenotypes.
+    top_k defaults to 5*<depth>; callers that cache results across loops may ask for more.
+    The query vector comes from the local HPO term table when it covers every term,
+    otherwise from the Azure embedding endpoint.
+    """
+    hpo_dict = _get_hpo_dict(state)
+    if not hpo_dict:
+        return None
+    k = top_k or phenotype_search_k(state.get("depth", 1))
 
     try:
+        query_vector = _local_query_vector(hpo_dict)
+        if query_vector is not None:
+            return _search_phenotype_index(query_vector, k)
+
+        query_text = _build_query_text(hpo_dict)
+        client, _ = get_embedding_clients()
+        if not query_text or not client:
+            return None
+
         # 2. Vectorize the query
-        response = client.embeddings.create(
-            model=DEPLOYMENT_NAME,
-            input=[query_text],
-        )
+        with accounting.track("embedding", "PhenotypeSearch", model=AZURE_MODEL) as record:
+            response = client.embeddings.create(
+                model=DEPLOYMENT_NAME,
+                input=[query_text],
+            )
+            record.add_usage(response.usage.prompt_tokens)
         query_vector = np.array(response.data[0].embedding, dtype='float32').reshape(1, -1)
-        
-        # 3. Normalize the vector (required for cosine similarity search with IndexFlatIP)
-        faiss.normalize_L2(query_vector)
-
-        # 4. Execute search with FAISS (top 5*<depth> results)
-        depth = state.get("depth", 1)
-        k = 5 * depth
-        distances, indices = index.search(query_vector, k)
-
-        # 5. Format the results into a list of PhenotypeSearchFormat
-        search_results = []
-        for i in range(k):
-            idx = indices[0][i]
-            score = distances[0][i]
-
-            # An index of -1 indicates no more valid results
-            if idx == -1:
-                continue
-
-            # Retrieve the corresponding disease data from the mapping file
-            disease_data = phenotype_mapping[idx]
-            
-            # Convert to Pydantic models
-            omim_entry = OMIMEntry(**disease_data)
-            
-            result_format = PhenotypeSearchFormat(
-                disease_info=omim_entry,
-                similarity_score=float(score)
+        return _search_phenotype_index(query_vector, k)
+
+    except Exception as e:
+        print(f"An error occurred during phenotype embedding search: {e}")
+        return None
+
+
+@profile_tool
+async def aembedding_search_with_hpo(state: State, top_k: Optional[int] = None) -> Optional[List[PhenotypeSearchFormat]]:
+    """
+    Async version of embedding_search_with_hpo.
+    """
+    hpo_dict = _get_hpo_dict(state)
+    if not hpo_dict:
+        return None
+    k = top_k or phenotype_search_k(state.get("depth", 1))
+
+    try:
+        query_vector = _local_query_vector(hpo_dict)
+        if query_vector is not None:
+            return _search_phenotype_index(query_vector, k)
+
+        query_text = _build_query_text(hpo_dict)
+        _, async_client = get_embedding_clients()
+        if not query_text or not async_client:
+            return None
+
+        with accounting.track("embedding", "PhenotypeSearch", model=AZURE_MODEL) as record:
+            response = await async_client.embeddings.create(
+                model=DEPLOYMENT_NAME,
+                input=[query_text],
             )
-            search_results.append(result_format)
-        
-        return search_results
+            record.add_usage(response.usage.prompt_tokens)
+        query_vector = np.array(response.data[0].embedding, dtype='float32').reshape(1, -1)
+        return _search_phenotype_index(query_vector, k)
 
     except Exception as e:
         print(f"An error occurred during phenotype embedding search: {e}")
-        return None
\ No newline at end of file
+        return None
@@ -1,3 +1,4 @@
+import asyncio
 import os
 import time
 from langchain.schema import HumanMessage
@@ -5,6 +6,7 @@ from typing_extensions import Optional
 from ..state.state_types import State, DiagnosisOutput
 from ..llm.prompt import prompt_dict, build_prompt
 from ..llm.llm_wrapper import is_content_filter_error
+from ..utils.profiler import profile_tool
 
 
 def _is_content_filter_error(error: Exception) -> bool:
@@ -130,15 +132,16 @@ def _invoke_final_with_retry(llm, prompt: str, attempt_name: str):
     retry_count = 0
     while True:
         try:
-            temp_llm = llm.get_temp_llm_with_max_tokens(
-                llm.default_max_tokens,
+            structured_llm = llm.get_structured_llm(
+                DiagnosisOutput,
+                max_completion_tokens=llm.default_max_tokens,
                 timeout_seconds=_final_request_timeout_seconds(),
             )
-            structured_llm = temp_llm.with_structured_output(DiagnosisOutput)
             return llm.invoke_with_content_filter_retry(
                 structured_llm,
                 messages,
                 context=f"FinalDiagnosis:{attempt_name}",
+                lane="final",
             )
         except Exception as e:
             if not _is_retryable_final_error(e):
@@ -152,11 +155,39 @@ def _invoke_final_with_retry(llm, prompt: str, attempt_name: str):
             time.sleep(retry_wait_seconds)
 
 
-def createFinalDiagnosis(state: State) -> Optional[DiagnosisOutput]:
+async def _ainvoke_final_with_retry(llm, prompt: str, attempt_name: str):
+    messages = [HumanMessage(content=prompt)]
+    retry_wait_seconds = _final_retry_wait_seconds()
+    retry_count = 0
+    while True:
+        try:
+            structured_llm = llm.get_structured_llm(
+                DiagnosisOutput,
+                max_completion_tokens=llm.default_max_tokens,
+                timeout_seconds=_final_request_timeout_seconds(),
+            )
+            return await llm.ainvoke_with_content_filter_retry(
+                structured_llm,
+                messages,
+                context=f"FinalDiagnosis:{attempt_name}",
+                lane="final",
+            )
+        except Exception as e:
+            if not _is_retryable_final_error(e):
+                raise
+            retry_count += 1
+            print(
+                f"[FinalDiagnosis] Retryable Azure error on {attempt_name} prompt "
+                f"({type(e).__name__}: {e}). "
+                f"Retry #{retry_count} after {retry_wait_seconds:.1f}s."
+            )
+            await asyncio.sleep(retry_wait_seconds)
+
+
+def _build_final_attempts(state: State) -> list[tuple[str, str]]:
     """
-    Generate FinalDiagnosis using State, prompt, and DiagnosisOutput
+    content filter 対策として、詳細度を段階的に下げた (attempt_name, prompt) のリストを作成する。
     """
-   
     hpo_dict = state.get("hpoDict", {})
     absent_hpo_dict = state.get("absentHpoDict", {}) 
     use_absent_hpo = state.get("use_absentHPO", False)
@@ -165,11 +196,6 @@ def createFinalDiagnosis(state: State) -> Optional[DiagnosisOutput]:
     judgements = state.get("reflection", None)
     onset=state.get("onset", "Unknown")
     sex=state.get("sex", "Unknown")
-    llm = state.get("llm")
-
-    if not llm:
-        print("LLM instance not found in state.")
-        return None, None
 
     present_hpo = ", ".join([v for k, v in hpo_dict.items()]) if hpo_dict else ""
     absent_hpo = (
@@ -205,18 +231,53 @@ def createFinalDiagnosis(state: State) -> Optional[DiagnosisOutput]:
         ),
     ]
 
-    last_prompt = ""
-    for attempt_name, tentative_text, judgement_text, similar_case_text in attempts:
-        prompt = _build_final_prompt(
-            present_hpo=present_hpo,
-            absent_hpo=absent_hpo,
-            use_absent_hpo=use_absent_hpo,
-            onset=onset,
-            sex=sex,
-            similar_case_detailed_str=similar_case_text,
-            tentative_result_str=tentative_text,
-            judgements_str=judgement_text,
+    return [
+        (
+            attempt_name,
+            _build_final_prompt(
+                present_hpo=present_hpo,
+                absent_hpo=absent_hpo,
+                use_absent_hpo=use_absent_hpo,
+                onset=onset,
+                sex=sex,
+                similar_case_detailed_str=similar_case_text,
+                tentative_result_str=tentative_text,
+                judgements_str=judgement_text,
+            ),
         )
+        for attempt_name, tentative_text, judgement_text, similar_case_text in attempts
+    ]
+
+
+def _content_filter_fallback(tentative_result, prompt: str):
+    print("[FinalDiagnosis] Content filter triggered on all retry prompts. Falling back to tentative diagnosis.")
+    if tentative_result is not None and hasattr(tentative_result, "ans"):
+        tentative_result.reference = (
+            (tentative_result.reference or "")
+            + "\n[Fallback] Final diagnosis LLM call was blocked by Azure content filter; "
+            "tentative diagnosis was used as finalDiagnosis."
+        ).strip()
+        return tentative_result, prompt
+    return DiagnosisOutput(
+        ans=[],
+        reference="Final diagnosis LLM call was blocked by Azure content filter.",
+    ), prompt
+
+
+@profile_tool
+def createFinalDiagnosis(state: State) -> Optional[DiagnosisOutput]:
+    """
+    Generate FinalDiagnosis using State, prompt, and DiagnosisOutput
+    """
+    llm = state.get("llm")
+
+    if not llm:
+        print("LLM instance not found in state.")
+        return None, None
+
+    attempts = _build_final_attempts(state)
+    last_prompt = ""
+    for attempt_name, prompt in attempts:
         last_prompt = prompt
         try:
             if attempt_name != "full":
@@ -228,18 +289,38 @@ def createFinalDiagnosis(state: State) -> Optional[DiagnosisOutput]:
                 print(f"[FinalDiagnosis] Content filter triggered on {attempt_name} prompt. Retrying with less detail.")
                 continue
             if _is_content_filter_error(e):
-                print("[FinalDiagnosis] Content filter triggered on all retry prompts. Falling back to tentative diagnosis.")
-                if tentative_result is not None and hasattr(tentative_result, "ans"):
-                    tentative_result.reference = (
-                        (tentative_result.reference or "")
-                        + "\n[Fallback] Final diagnosis LLM call was blocked by Azure content filter; "
-                        "tentative diagnosis was used as finalDiagnosis."
-                    ).strip()
-                    return tentative_result, prompt
-                return DiagnosisOutput(
-                    ans=[],
-                    reference="Final diagnosis LLM call was blocked by Azure content filter.",
-                ), prompt
+                return _content_filter_fallback(state.get("tentativeDiagnosis", None), prompt)
+            raise
+
+    return None, last_prompt
+
+
+@profile_tool
+async def acreateFinalDiagnosis(state: State) -> Optional[DiagnosisOutput]:
+    """
+    Async version of createFinalDiagnosis
+    """
+    llm = state.get("llm")
+
+    if not llm:
+        print("LLM instance not found in state.")
+        return None, None
+
+    attempts = _build_final_attempts(state)
+    last_prompt = ""
+    for attempt_name, prompt in attempts:
+        last_prompt = prompt
+        try:
+            if attempt_name != "full":
+                print(f"[FinalDiagnosis] Retrying with {attempt_name} prompt.")
+            result = await _ainvoke_final_with_retry(llm, prompt, attempt_name)
+            return result, prompt
+        except Exception as e:
+            if _is_content_filter_error(e) and attempt_name != attempts[-1][0]:
+                print(f"[FinalDiagnosis] Content filter triggered on {attempt_name} prompt. Retrying with less detail.")
+                continue
+            if _is_content_filter_error(e):
+                return _content_filter_fallback(state.get("tentativeDiagnosis", None), prompt)
             raise
 
     return None, last_prompt
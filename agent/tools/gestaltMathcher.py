@@ -1,11 +1,56 @@
+import asyncio
 import base64
+import httpx
 import requests
 import json
 import os
 import time
 from dotenv import load_dotenv
 
+from ..utils.accounting import accounting
+
 MAX_DISTANCE = 1.3
+GESTALT_API_URL = "https://pubcasefinder.dbcls.jp/gm_endpoint/predict"
+
+
+def _load_gestalt_credentials():
+    load_dotenv()
+    username = os.environ.get("GESTALT_API_USER")
+    password = os.environ.get("GESTALT_API_PASS")
+    if not username or not password:
+        raise ValueError("環境変数 GESTALT_API_USER または GESTALT_API_PASS が設定されていません。")
+    return username, password
+
+
+def _build_gestalt_payload(image_path: str) -> dict:
+    with open(image_path, "rb") as f:
+        img_b64 = base64.b64encode(f.read()).decode("utf-8")
+    return {"img": img_b64}
+
+
+def gestalt_result_limit(depth: int) -> int:
+    """depth ごとに返す GestaltMatcher 候補数（上位 depth + 4 件）"""
+    return depth + 4
+
+
+def _format_gestalt_syndromes(result: dict, depth: int) -> list:
+    syndromes = result.get("suggested_syndromes_list", [])
+    # Return only the top depth + 4 items
+    syndromes = syndromes[:gestalt_result_limit(depth)]
+    # Remove distance and gestalt_score and replace with a single score value
+    # New score is normalized to 0-1 range rather than 0-1.3 distance
+
+    for syndrome in syndromes:
+        distance = syndrome.get("distance") or syndrome.get("gestalt_score")
+        if distance is not None:
+            distance = float(distance)
+            score = (MAX_DISTANCE - distance) / MAX_DISTANCE
+        else:
+            score = 0.0
+        syndrome["score"] = score
+
+    return syndromes
+
 
 def call_gestalt_matcher_api(image_path: str, depth: int, max_retries=3):
     """
@@ -21,53 +66,62 @@ def call_gestalt_matcher_api(image_path: str, depth: int, max_retries=3):
     Returns:
         list: suggested_genes_listの上位(depth+2)件
     """
-    load_dotenv()
-    api_url = "https://pubcasefinder.dbcls.jp/gm_endpoint/predict"
-    username = os.environ.get("GESTALT_API_USER")
-    password = os.environ.get("GESTALT_API_PASS")
-    if not username or not password:
-        raise ValueError("環境変数 GESTALT_API_USER または GESTALT_API_PASS が設定されていません。")
+    username, password = _load_gestalt_credentials()
+    payload = _build_gestalt_payload(image_path)
+    headers = {"Content-Type": "application/json"}
 
-    with open(image_path, "rb") as f:
-        img_b64 = base64.b64encode(f.read()).decode("utf-8")
+    with accounting.track("api", "GestaltMatcher") as record:
+        for attempt in range(max_retries):
+            record.retries = attempt
+            try:
+                response = requests.post(
+                    GESTALT_API_URL,
+                    headers=headers,
+                    data=json.dumps(payload),
+                    auth=(username, password),
+                    timeout=120
+                )
+                response.raise_for_status()
+                return _format_gestalt_syndromes(response.json(), depth)
 
-    headers = {"Content-Type": "application/json"}
-    payload = {"img": img_b64}
-
-    for attempt in range(max_retries):
-        try:
-            response = requests.post(
-                api_url,
-                headers=headers,
-                data=json.dumps(payload),
-                auth=(username, password),
-                timeout=120
-            )
-            response.raise_for_status()
-            result = response.json()
-            syndromes = result.get("suggested_syndromes_list", [])
-            # Return only the top depth + 4 items
-            syndromes = syndromes[:depth + 4]
-            # Remove distance and gestalt_score and replace with a single score value
-            # New score is normalized to 0-1 range rather than 0-1.3 distance
-
-            for syndrome in syndromes:
-                distance = syndrome.get("distance") or syndrome.get("gestalt_score")
-                if distance is not None:
-                    distance = float(distance)
-                    score = (MAX_DISTANCE - distance) / MAX_DISTANCE
+            except Exception as e:
+                print(f"[GestaltMatcher] API失敗 (試行 {attempt + 1}/{max_retries}): {e}")
+                if attempt < max_retries - 1:
+                    wait_time = 2 ** attempt  # 指数バックオフ: 1秒, 2秒, 4秒
+                    print(f"  {wait_time}秒後にリトライします...")
+                    time.sleep(wait_time)
                 else:
-                    score = 0.0
-                syndrome["score"] = score
-
-            return syndromes
-            
-        except Exception as e:
-            print(f"[GestaltMatcher] API失敗 (試行 {attempt + 1}/{max_retries}): {e}")
-            if attempt < max_retries - 1:
-                wait_time = 2 ** attempt  # 指数バックオフ: 1秒, 2秒, 4秒
-                print(f"  {wait_time}秒後にリトライします...")
-                time.sleep(wait_time)
-            else:
-                print("  最大リトライ回数に達しました。空のリストを返します。")
-                return []
\ No newline at end of file
+                    print("  最大リトライ回数に達しました。空のリストを返します。")
+                    record.success = False
+                    return []
+
+
+async def acall_gestalt_matcher_api(image_path: str, depth: int, max_retries=3):
+    """call_gestalt_matcher_api の非同期版（httpx.AsyncClient を使用）"""
+    username, password = _load_gestalt_credentials()
+    payload = await asyncio.to_thread(_build_gestalt_payload, image_path)
+    headers = {"Content-Type": "application/json"}
+
+    async with httpx.AsyncClient(timeout=120, auth=(username, password)) as client:
+        with accounting.track("api", "GestaltMatcher") as record:
+            for attempt in range(max_retries):
+                record.retries = attempt
+                try:
+                    response = await client.post(
+                        GESTALT_API_URL,
+                        headers=headers,
+                        content=json.dumps(payload),
+                    )
+                    response.raise_for_status()
+                    return _format_gestalt_syndromes(response.json(), depth)
+
+                except Exception as e:
+                    print(f"[GestaltMatcher] API失敗 (試行 {attempt + 1}/{max_retries}): {e}")
+                    if attempt < max_retries - 1:
+                        wait_time = 2 ** attempt  # 指数バックオフ: 1秒, 2秒, 4秒
+                        print(f"  {wait_time}秒後にリトライします...")
+                        await asyncio.sleep(wait_time)
+                    else:
+                        print("  最大リトライ回数に達しました。空のリストを返します。")
+                        record.success = False
+                        return []
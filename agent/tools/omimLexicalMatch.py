@@ -0,0 +1,162 @@
+import re
+import threading
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+
+# 英綴り → 米綴り（語の一部として置換する）
+SPELLING_VARIANTS = [
+    ("OESOPHAG", "ESOPHAG"),
+    ("ORTHOPAED", "ORTHOPED"),
+    ("LEUKAEM", "LEUKEM"),
+    ("OEDEMA", "EDEMA"),
+    ("FOETAL", "FETAL"),
+    ("PAEDI", "PEDI"),
+    ("HAEM", "HEM"),
+    ("AEMIA", "EMIA"),
+]
+
+ROMAN_NUMERALS = {
+    "II": "2", "III": "3", "IV": "4", "V": "5", "VI": "6",
+    "VII": "7", "VIII": "8", "IX": "9", "X": "10", "XI": "11", "XII": "12",
+}
+
+# "SYNDROME 2, AUTOSOMAL RECESSIVE" のような遺伝形式の修飾語（ラベルの別名を作るときに外す）
+INHERITANCE_QUALIFIER = re.compile(
+    r",\s*(AUTOSOMAL (DOMINANT|RECESSIVE)|X-LINKED( (DOMINANT|RECESSIVE))?|Y-LINKED|MITOCHONDRIAL|SOMATIC)\b.*$"
+)
+
+
+def normalize_disease_label(text: str) -> str:
+    """
+    疾患名を比較用に正規化する。
+    大文字化、括弧書き（"(OMIM 123456)" など）・所有格・記号の除去、英綴りの統一、
+    ローマ数字の算用数字化（TYPE の後の I を含む）、"TYPE" の除去を行う。
+    """
+    text = text.upper().replace("*", " ")
+    text = re.sub(r"\([^)]*\)", " ", text)
+    text = re.sub(r"'S\b", "", text)
+    text = re.sub(r"[^A-Z0-9]+", " ", text)
+    tokens = []
+    previous = None
+    for token in text.split():
+        for british, american in SPELLING_VARIANTS:
+            token = token.replace(british, american)
+        if token in ROMAN_NUMERALS:
+            token = ROMAN_NUMERALS[token]
+        elif token == "I" and previous == "TYPE":
+            token = "1"
+        previous = token
+        if token != "TYPE":
+            tokens.append(token)
+    return " ".join(tokens)
+
+
+def _label_variants(label: str) -> Set[str]:
+    """OMIM ラベル "NAME, QUALIFIER; ABBREV" から照合用の別名を作る"""
+    parts = [part.strip() for part in label.split(";") if part.strip()]
+    if not parts:
+        return set()
+    title = parts[0]
+    variants = {label, title, INHERITANCE_QUALIFIER.sub("", title)}
+    # 2つ目以降は略称（SPG25, KFS2 など）。"AS" のような2文字以下の略称は誤一致しやすいので使わない
+    variants.update(part for part in parts[1:] if len(part) >= 3)
+    return {normalize_disease_label(v) for v in variants} - {""}
+
+
+def _numbered_tokens(key: str) -> Set[str]:
+    """"25", "1A" のような数字を含むトークン（病型・サブタイプの区別に使う）"""
+    return {token for token in key.split() if any(ch.isdigit() for ch in token)}
+
+
+def _trigrams(key: str) -> Set[str]:
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class OmimLexicalIndex:
+    """
+    OMIM ラベルの正規化済み完全一致インデックスと、文字トライグラムによる近似一致。
+    同じ正規化キーが複数の OMIM ID に対応する場合は曖昧とみなし、embedding 検索に任せる。
+    """
+
+    def __init__(self, entries: Iterable[Tuple[str, str]], fuzzy_threshold: float = 0.9,
+                 fuzzy_margin: float = 0.05, max_posting_size: int = 3000):
+        self.fuzzy_threshold = fuzzy_threshold
+        self.fuzzy_margin = fuzzy_margin
+        self.exact_hits = 0
+        self.fuzzy_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        key_ids: Dict[str, Set[str]] = defaultdict(set)
+        for omim_id, label in entries:
+            for key in _label_variants(label):
+                key_ids[key].add(omim_id)
+
+        self.exact: Dict[str, str] = {key: next(iter(ids)) for key, ids in key_ids.items() if len(ids) == 1}
+        self._keys: List[str] = list(self.exact)
+        postings: Dict[str, List[int]] = defaultdict(list)
+        for key_id, key in enumerate(self._keys):
+            for gram in _trigrams(key):
+                postings[gram].append(key_id)
+        # "SYN" "ROM" のような頻出トライグラムは候補の絞り込みに役立たないので照合に使わない
+        self._postings = {gram: ids for gram, ids in postings.items() if len(ids) <= max_posting_size}
+        # Dice 係数の分母も照合に使うトライグラムだけで数える
+        self._key_trigram_counts = [0] * len(self._keys)
+        for ids in self._postings.values():
+            for key_id in ids:
+                self._key_trigram_counts[key_id] += 1
+
+    def _fuzzy(self, key: str) -> Optional[Tuple[str, float]]:
+        grams = [gram for gram in _trigrams(key) if gram in self._postings]
+        shared: Counter = Counter()
+        for gram in grams:
+            shared.update(self._postings[gram])
+        if not shared:
+            return None
+
+        numbers = _numbered_tokens(key)
+        scored = []
+        for key_id, count in shared.most_common(50):
+            # 綴りが近くても病型番号が異なるもの（"MARFAN SYNDROME" と "MARFAN SYNDROME 2"）は別疾患
+            if _numbered_tokens(self._keys[key_id]) != numbers:
+                continue
+            dice = 2 * count / (len(grams) + self._key_trigram_counts[key_id])
+            scored.append((dice, self.exact[self._keys[key_id]]))
+        if not scored:
+            return None
+        scored.sort(reverse=True)
+        best_score, best_id = scored[0]
+        if best_score < self.fuzzy_threshold:
+            return None
+        runner_up = next((score for score, omim_id in scored[1:] if omim_id != best_id), 0.0)
+        if best_score - runner_up < self.fuzzy_margin:
+            return None
+        return best_id, best_score
+
+    def match(self, disease_name: str) -> Optional[Tuple[str, float]]:
+        """一致すれば (OMIM ID, 類似度) を返す。完全一致は 1.0、近似一致は Dice 係数"""
+        key = normalize_disease_label(disease_name)
+        if not key:
+            return None
+        omim_id = self.exact.get(key)
+        if omim_id is not None:
+            with self._lock:
+                self.exact_hits += 1
+            return omim_id, 1.0
+        result = self._fuzzy(key) if self.fuzzy_threshold < 1.0 else None
+        with self._lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.fuzzy_hits += 1
+        return result
+
+    def get_summary(self) -> str:
+        total = self.exact_hits + self.fuzzy_hits + self.misses
+        rate = (self.exact_hits + self.fuzzy_hits) / total if total else 0.0
+        return (
+            f"OMIM 文字列照合: 完全一致 {self.exact_hits}, 近似一致 {self.fuzzy_hits}, "
+            f"embedding へ {self.misses} (照合率 {rate:.1%})"
+        )
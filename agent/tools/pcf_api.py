@@ -1,31 +1,71 @@
-
+import asyncio
+import httpx
 import requests
 import time
 
-def callingPCF(hpo_list, depth, max_retries=3):
+from ..utils.accounting import accounting
+
+PCF_API_URL = "https://pubcasefinder.dbcls.jp/api/pcf_get_ranked_list"
+
+
+def _build_pcf_url(hpo_list):
     hpo_ids = ",".join(hpo_list)
-    url = f"https://pubcasefinder.dbcls.jp/api/pcf_get_ranked_list?target=omim&format=json&hpo_id={hpo_ids}"
-    
-    for attempt in range(max_retries):
-        try:
-            response = requests.get(url, timeout=120)
-            response.raise_for_status()
-            data = response.json()
-            top = []
-            for item in data[:5]:
-                top.append({
-                    "omim_disease_name_en": item.get("omim_disease_name_en", ""),
-                    "description": item.get("description", ""),
-                    "score": item.get("score", None),
-                    "omim_id": item.get("id", "")
-                })
-            return top
-        except Exception as e:
-            print(f"[PhenotypeAnalyzer] PubCaseFinder API失敗 (試行 {attempt + 1}/{max_retries}): {e}")
-            if attempt < max_retries - 1:
-                wait_time = 2 ** attempt  # 指数バックオフ: 1秒, 2秒, 4秒
-                print(f"  {wait_time}秒後にリトライします...")
-                time.sleep(wait_time)
-            else:
-                print("  最大リトライ回数に達しました。空のリストを返します。")
-                return []
\ No newline at end of file
+    return f"{PCF_API_URL}?target=omim&format=json&hpo_id={hpo_ids}"
+
+
+def _format_pcf_results(data):
+    top = []
+    for item in data[:5]:
+        top.append({
+            "omim_disease_name_en": item.get("omim_disease_name_en", ""),
+            "description": item.get("description", ""),
+            "score": item.get("score", None),
+            "omim_id": item.get("id", "")
+        })
+    return top
+
+
+def callingPCF(hpo_list, depth, max_retries=3):
+    url = _build_pcf_url(hpo_list)
+
+    with accounting.track("api", "PubCaseFinder") as record:
+        for attempt in range(max_retries):
+            record.retries = attempt
+            try:
+                response = requests.get(url, timeout=120)
+                response.raise_for_status()
+                return _format_pcf_results(response.json())
+            except Exception as e:
+                print(f"[PhenotypeAnalyzer] PubCaseFinder API失敗 (試行 {attempt + 1}/{max_retries}): {e}")
+                if attempt < max_retries - 1:
+                    wait_time = 2 ** attempt  # 指数バックオフ: 1秒, 2秒, 4秒
+                    print(f"  {wait_time}秒後にリトライします...")
+                    time.sleep(wait_time)
+                else:
+                    print("  最大リトライ回数に達しました。空のリストを返します。")
+                    record.success = False
+                    return []
+
+
+async def acallingPCF(hpo_list, depth, max_retries=3):
+    """callingPCF の非同期版（httpx.AsyncClient を使用）"""
+    url = _build_pcf_url(hpo_list)
+
+    async with httpx.AsyncClient(timeout=120) as client:
+        with accounting.track("api", "PubCaseFinder") as record:
+            for attempt in range(max_retries):
+                record.retries = attempt
+                try:
+                    response = await client.get(url)
+                    response.raise_for_status()
+                    return _format_pcf_results(response.json())
+                except Exception as e:
+                    print(f"[PhenotypeAnalyzer] PubCaseFinder API失敗 (試行 {attempt + 1}/{max_retries}): {e}")
+                    if attempt < max_retries - 1:
+                        wait_time = 2 ** attempt  # 指数バックオフ: 1秒, 2秒, 4秒
+                        print(f"  {wait_time}秒後にリトライします...")
+                        await asyncio.sleep(wait_time)
+                    else:
+                        print("  最大リトライ回数に達しました。空のリストを返します。")
+                        record.success = False
+                        return []
@@ -1,3 +1,4 @@
+import asyncio
 import os
 import re
 import time
@@ -6,6 +7,7 @@ from openai import LengthFinishReasonError
 from ..state.state_types import ReflectionFormat, State
 from ..llm.prompt import prompt_dict, build_prompt
 from ..llm.llm_wrapper import is_content_filter_error
+from ..utils.profiler import profile_tool
 
 
 def _reflection_token_limits() -> list[int]:
@@ -52,6 +54,7 @@ def _invoke_reflection_with_retry(llm, structured_llm, messages, diagnosis_name:
                 structured_llm,
                 messages,
                 context=f"Reflection:{diagnosis_name}",
+                lane="reflection",
             )
         except Exception as e:
             if not _is_retryable_reflection_error(e):
@@ -65,6 +68,29 @@ def _invoke_reflection_with_retry(llm, structured_llm, messages, diagnosis_name:
             time.sleep(retry_wait_seconds)
 
 
+async def _ainvoke_reflection_with_retry(llm, structured_llm, messages, diagnosis_name: str):
+    retry_wait_seconds = _reflection_retry_wait_seconds()
+    retry_count = 0
+    while True:
+        try:
+            return await llm.ainvoke_with_content_filter_retry(
+                structured_llm,
+                messages,
+                context=f"Reflection:{diagnosis_name}",
+                lane="reflection",
+            )
+        except Exception as e:
+            if not _is_retryable_reflection_error(e):
+                raise
+            retry_count += 1
+            print(
+                f"[Reflection] Retryable Azure error for {diagnosis_name} "
+                f"({type(e).__name__}: {e}). "
+                f"Retry #{retry_count} after {retry_wait_seconds:.1f}s."
+            )
+            await asyncio.sleep(retry_wait_seconds)
+
+
 def format_disease_knowledge(info_list, disease_name):
     """
     InformationItemのリストから、rankに該当するものだけをプロンプト用に整形
@@ -232,7 +258,8 @@ def _apply_tool_supported_reflection_override(result: ReflectionFormat, state: S
     return result
 
 
-def create_reflection(state: State, diagnosis_to_judge):
+def _build_reflection_prompt(state: State, diagnosis_to_judge):
+    """reflection プロンプトと、fallback 結果に使う present HPO 文字列を返す。"""
     prompt_template = prompt_dict["reflection_prompt"]
     
     hpo_dict = state.get("hpoDict", {})
@@ -241,11 +268,6 @@ def create_reflection(state: State, diagnosis_to_judge):
     disease_knowledge_list = state.get("memory", [])
     onset = state.get("onset")
     sex = state.get("sex")
-    llm = state.get("llm")
-
-    if not llm:
-        print("LLM instance not found in state.")
-        return None, None
 
     diagnosis_name = diagnosis_to_judge.disease_name
     description = diagnosis_to_judge.description
@@ -273,7 +295,53 @@ def create_reflection(state: State, diagnosis_to_judge):
         "disease_knowledge": disease_knowledge_str
     }
     
-    prompt = build_prompt(prompt_template, inputs)
+    return build_prompt(prompt_template, inputs), present_hpo
+
+
+def _finalize_reflection_result(result, state: State, diagnosis_to_judge) -> ReflectionFormat:
+    if isinstance(result, dict):
+        reflection_result = ReflectionFormat(**result)
+    else:
+        reflection_result = result
+    return _apply_tool_supported_reflection_override(
+        reflection_result,
+        state,
+        diagnosis_to_judge,
+    )
+
+
+def _token_limit_fallback(diagnosis_name: str, present_hpo: str, token_limits: list[int]) -> ReflectionFormat:
+    # 最大試行回数に達した場合、保守的な結果を返す
+    return ReflectionFormat(
+        disease_name=diagnosis_name,
+        Correctness=False,
+        PatientSummary=f"Token limit exceeded for reflection. Present HPO: {present_hpo[:100]}...",
+        DiagnosisAnalysis=f"Reflection could not be completed due to token limit after {len(token_limits)} attempts with max_tokens up to {token_limits[-1]}.",
+        references=[]
+    )
+
+
+def _error_fallback(diagnosis_name: str, present_hpo: str, error: Exception) -> ReflectionFormat:
+    # その他のエラーの場合も保守的な結果を返す
+    return ReflectionFormat(
+        disease_name=diagnosis_name,
+        Correctness=False,
+        PatientSummary=f"Error during reflection: {present_hpo[:100]}...",
+        DiagnosisAnalysis=f"Reflection failed with error: {str(error)}",
+        references=[]
+    )
+
+
+@profile_tool
+def create_reflection(state: State, diagnosis_to_judge):
+    llm = state.get("llm")
+
+    if not llm:
+        print("LLM instance not found in state.")
+        return None, None
+
+    diagnosis_name = diagnosis_to_judge.disease_name
+    prompt, present_hpo = _build_reflection_prompt(state, diagnosis_to_judge)
     messages = [HumanMessage(content=prompt)]
     
     # トークン数を段階的に増やして再試行する。
@@ -285,28 +353,18 @@ def create_reflection(state: State, diagnosis_to_judge):
         try:
             print(f"[Reflection] 試行 {attempt}/{len(token_limits)}: max_completion_tokens={max_tokens}")
             
-            # 一時的なLLMインスタンスを作成（元のllmは変更しない）
-            temp_llm = llm.get_temp_llm_with_max_tokens(
-                max_tokens,
+            # 一時的なLLMインスタンスから構造化出力用LLMを作成（元のllmは変更しない）
+            structured_llm = llm.get_structured_llm(
+                ReflectionFormat,
+                max_completion_tokens=max_tokens,
                 timeout_seconds=_reflection_request_timeout_seconds(),
             )
-            structured_llm = temp_llm.with_structured_output(ReflectionFormat)
             
             # 推論実行
             result = _invoke_reflection_with_retry(llm, structured_llm, messages, diagnosis_name)
             
             print(f"[Reflection] 成功 (max_completion_tokens={max_tokens})")
-            
-            if isinstance(result, dict):
-                reflection_result = ReflectionFormat(**result)
-            else:
-                reflection_result = result
-            reflection_result = _apply_tool_supported_reflection_override(
-                reflection_result,
-                state,
-                diagnosis_to_judge,
-            )
-            return reflection_result, prompt
+            return _finalize_reflection_result(result, state, diagnosis_to_judge), prompt
             
         except LengthFinishReasonError as e:
             print(f"[Reflection] トークン上限到達 (max_completion_tokens={max_tokens})")
@@ -315,24 +373,47 @@ def create_reflection(state: State, diagnosis_to_judge):
                 continue
             else:
                 print(f"  -> 最大試行回数に達しました。デフォルト結果を返します。")
-                # 最大試行回数に達した場合、保守的な結果を返す
-                fallback_result = ReflectionFormat(
-                    disease_name=diagnosis_name,
-                    Correctness=False,
-                    PatientSummary=f"Token limit exceeded for reflection. Present HPO: {present_hpo[:100]}...",
-                    DiagnosisAnalysis=f"Reflection could not be completed due to token limit after {len(token_limits)} attempts with max_tokens up to {token_limits[-1]}.",
-                    references=[]
-                )
-                return fallback_result, prompt
+                return _token_limit_fallback(diagnosis_name, present_hpo, token_limits), prompt
                 
         except Exception as e:
             print(f"[ERROR] Reflection failed for {diagnosis_name}: {type(e).__name__}: {e}")
-            # その他のエラーの場合も保守的な結果を返す
-            fallback_result = ReflectionFormat(
-                disease_name=diagnosis_name,
-                Correctness=False,
-                PatientSummary=f"Error during reflection: {present_hpo[:100]}...",
-                DiagnosisAnalysis=f"Reflection failed with error: {str(e)}",
-                references=[]
+            return _error_fallback(diagnosis_name, present_hpo, e), prompt
+
+
+@profile_tool
+async def acreate_reflection(state: State, diagnosis_to_judge):
+    """create_reflection の非同期版"""
+    llm = state.get("llm")
+
+    if not llm:
+        print("LLM instance not found in state.")
+        return None, None
+
+    diagnosis_name = diagnosis_to_judge.disease_name
+    prompt, present_hpo = _build_reflection_prompt(state, diagnosis_to_judge)
+    messages = [HumanMessage(content=prompt)]
+    token_limits = _reflection_token_limits()
+
+    for attempt, max_tokens in enumerate(token_limits, 1):
+        try:
+            print(f"[Reflection] 試行 {attempt}/{len(token_limits)}: max_completion_tokens={max_tokens}")
+            structured_llm = llm.get_structured_llm(
+                ReflectionFormat,
+                max_completion_tokens=max_tokens,
+                timeout_seconds=_reflection_request_timeout_seconds(),
             )
-            return fallback_result, prompt
+            result = await _ainvoke_reflection_with_retry(llm, structured_llm, messages, diagnosis_name)
+            print(f"[Reflection] 成功 (max_completion_tokens={max_tokens})")
+            return _finalize_reflection_result(result, state, diagnosis_to_judge), prompt
+
+        except LengthFinishReasonError:
+            print(f"[Reflection] トークン上限到達 (max_completion_tokens={max_tokens})")
+            if attempt < len(token_limits):
+                print(f"  -> より大きなトークン数で再試行します")
+                continue
+            print(f"  -> 最大試行回数に達しました。デフォルト結果を返します。")
+            return _token_limit_fallback(diagnosis_name, present_hpo, token_limits), prompt
+
+        except Exception as e:
+            print(f"[ERROR] Reflection failed for {diagnosis_name}: {type(e).__name__}: {e}")
+            return _error_fallback(diagnosis_name, present_hpo, e), prompt
@@ -0,0 +1,209 @@
+# agent/utils/accounting.py
+import contextvars
+import csv
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field, fields
+from typing import Dict, Iterator, List, Optional
+
+from .profiler import current_node, current_run, profiler
+
+
+# 実行中の患者。pipeline.run / arun が設定し、ノード名（profile_node が設定）とともに記録に付与する
+current_patient: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_patient", default=None)
+
+
+# 100万トークンあたりの USD 単価 (input, cached input, output)。ACCOUNTING_PRICES_PATH の JSON で上書きできる
+DEFAULT_PRICES_PER_MILLION = {
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-5-1": (1.25, 0.125, 10.00),
+    "gpt-5-2": (1.75, 0.175, 14.00),
+    "text-embedding-3-large": (0.13, 0.13, 0.0),
+}
+
+
+def _load_prices() -> Dict[str, tuple]:
+    prices = dict(DEFAULT_PRICES_PER_MILLION)
+    path = os.getenv("ACCOUNTING_PRICES_PATH")
+    if path:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for model, values in json.load(f).items():
+                    prices[model] = tuple(float(v) for v in values)
+        except Exception as e:
+            print(f"[Accounting] 単価ファイルを読み込めません ({path}): {e}")
+    return prices
+
+
+@dataclass
+class CallRecord:
+    """LLM・embedding・外部 API 呼び出し1回分（再試行を含む）の記録"""
+    kind: str  # "llm" / "embedding" / "api"
+    name: str
+    patient_id: Optional[str] = None
+    run_id: Optional[int] = None
+    node: Optional[str] = None
+    model: Optional[str] = None
+    lane: Optional[str] = None
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_prompt_tokens: int = 0
+    retries: int = 0
+    rate_wait_seconds: float = 0.0
+    latency_seconds: float = 0.0
+    cost_usd: float = 0.0
+    cache_hit: bool = False
+    success: bool = True
+    started_at: float = field(default_factory=time.time)
+
+    def add_usage(self, prompt_tokens: int = 0, completion_tokens: int = 0, cached_prompt_tokens: int = 0):
+        self.prompt_tokens += int(prompt_tokens or 0)
+        self.completion_tokens += int(completion_tokens or 0)
+        self.cached_prompt_tokens += int(cached_prompt_tokens or 0)
+
+
+class CallAccounting:
+    """呼び出しごとのトークン数・待ち時間・レイテンシ・コストを集計する（スレッドセーフ）"""
+
+    def __init__(self):
+        self.records: List[CallRecord] = []
+        self.prices = _load_prices()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def patient_scope(self, patient_id: Optional[str]):
+        """この中で行われた呼び出しを patient_id に紐づける"""
+        token = current_patient.set(patient_id)
+        try:
+            yield
+        finally:
+            current_patient.reset(token)
+
+    def estimate_cost(self, model: Optional[str], record: CallRecord) -> float:
+        price = self.prices.get(model or "")
+        if price is None:
+            return 0.0
+        input_price, cached_price, output_price = price
+        uncached = max(record.prompt_tokens - record.cached_prompt_tokens, 0)
+        return (
+            uncached * input_price
+            + record.cached_prompt_tokens * cached_price
+            + record.completion_tokens * output_price
+        ) / 1_000_000
+
+    @contextmanager
+    def track(self, kind: str, name: str, model: Optional[str] = None, lane: Optional[str] = None) -> Iterator[CallRecord]:
+        """
+        ブロックの所要時間からレート制限の待ち時間を除いたものを latency_seconds として記録する。
+        トークン数・再試行回数・レート制限の待ち時間は、呼び出し側が yield された record に書き込む。
+        同じ区間をプロファイラーにも kind をカテゴリとするスパンとして記録する。
+        """
+        run = current_run.get()
+        record = CallRecord(
+            kind=kind,
+            name=name,
+            patient_id=current_patient.get(),
+            run_id=run.run_id if run else None,
+            node=current_node.get(),
+            model=model,
+            lane=lane,
+        )
+        start = time.time()
+        try:
+            with profiler.span(name, kind, model=model, lane=lane):
+                yield record
+        except BaseException:
+            record.success = False
+            raise
+        finally:
+            record.latency_seconds = max(time.time() - start - record.rate_wait_seconds, 0.0)
+            record.cost_usd = self.estimate_cost(model, record)
+            with self._lock:
+                self.records.append(record)
+
+    def snapshot(self, patient_id: Optional[str] = None) -> List[CallRecord]:
+        with self._lock:
+            records = list(self.records)
+        if patient_id is not None:
+            records = [r for r in records if r.patient_id == patient_id]
+        return records
+
+    def totals(self, keys=("patient_id", "node", "kind"), patient_id: Optional[str] = None) -> List[dict]:
+        """keys ごとに合計した行を返す"""
+        grouped: Dict[tuple, dict] = defaultdict(lambda: defaultdict(float))
+        for record in self.snapshot(patient_id):
+            row = grouped[tuple(getattr(record, key) for key in keys)]
+            row["calls"] += 1
+            row["cache_hits"] += int(record.cache_hit)
+            row["failures"] += int(not record.success)
+            for name in ("prompt_tokens", "completion_tokens", "cached_prompt_tokens", "retries",
+                         "rate_wait_seconds", "latency_seconds", "cost_usd"):
+                row[name] += getattr(record, name)
+        return [
+            {**dict(zip(keys, group)), **row}
+            for group, row in sorted(grouped.items(), key=lambda item: -item[1]["latency_seconds"])
+        ]
+
+    def export_json(self, path: str, patient_id: Optional[str] = None):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "calls": [asdict(r) for r in self.snapshot(patient_id)],
+                    "totals": self.totals(patient_id=patient_id),
+                },
+                f, ensure_ascii=False, indent=2,
+            )
+
+    def export_csv(self, path: str, patient_id: Optional[str] = None):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=[fld.name for fld in fields(CallRecord)])
+            writer.writeheader()
+            for record in self.snapshot(patient_id):
+                writer.writerow(asdict(record))
+
+    def get_summary(self) -> str:
+        rows = self.totals(keys=("node", "kind"))
+        if not rows:
+            return "No accounting data available."
+        lines = ["ノード別 呼び出し集計 (合計時間順):"]
+        for row in rows:
+            lines.append(
+                f"  {row['node'] or '-'} [{row['kind']}]: {int(row['calls'])} 回, "
+                f"入力 {int(row['prompt_tokens'])} (キャッシュ {int(row['cached_prompt_tokens'])}) / "
+                f"出力 {int(row['completion_tokens'])} tokens, 再試行 {int(row['retries'])}, "
+                f"待ち {row['rate_wait_seconds']:.1f}秒, 通信 {row['latency_seconds']:.1f}秒, ${row['cost_usd']:.4f}"
+            )
+        total_cost = sum(row["cost_usd"] for row in rows)
+        lines.append(f"  合計コスト: ${total_cost:.4f}")
+        return "\n".join(lines)
+
+    def discard_runs(self, run_ids) -> List[CallRecord]:
+        """指定したラン（profiler.run_scope）の記録を破棄し、破棄した記録を返す"""
+        run_ids = set(run_ids)
+        with self._lock:
+            removed = [r for r in self.records if r.run_id in run_ids]
+            self.records = [r for r in self.records if r.run_id not in run_ids]
+        return removed
+
+    def reset(self):
+        with self._lock:
+            self.records.clear()
+
+
+class ContextThreadPoolExecutor(ThreadPoolExecutor):
+    """submit 時の contextvars（患者・ノード）をワーカースレッドに引き継ぐ ThreadPoolExecutor"""
+
+    def submit(self, fn, /, *args, **kwargs):
+        context = contextvars.copy_context()
+        return super().submit(context.run, fn, *args, **kwargs)
+
+
+# グローバルインスタンス
+accounting = CallAccounting()
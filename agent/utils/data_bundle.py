@@ -0,0 +1,280 @@
+# agent/utils/data_bundle.py
+import bisect
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from collections.abc import Mapping, Sequence
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+
+# 参照用 JSON（HPO ラベル、OMIM ラベル、正規化・表現型インデックスのマッピング）をまとめたバイナリ。
+# utils/createDataBundle.py で作成し、mmap で開いて必要な要素だけを読む。
+#
+# レイアウト（数値はリトルエンディアン、各セクションは 8 バイト境界）:
+#   ヘッダ: MAGIC (8) | version uint32 | reserved uint32 | toc_offset uint64 | toc_length uint64
+#   文字列表: uint64 offsets[count + 1] | UTF-8 を連結したバイト列
+#   目次 (TOC): JSON。セクション名 → kind / offset / count、元ファイルの size / mtime_ns / sha256
+MAGIC = b"RDBUNDLE"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<8sIIQQ")
+
+DATA_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "data"))
+DEFAULT_BUNDLE_PATH = os.path.join(DATA_DIR, "reference_bundle.bin")
+
+
+class StringTable(Sequence):
+    """offsets + 連結バイト列の文字列表。要素はアクセス時にデコードする"""
+
+    def __init__(self, buffer: memoryview, offset: int, count: int):
+        self._offsets = np.frombuffer(buffer, dtype="<u8", count=count + 1, offset=offset)
+        self._blob = buffer[offset + (count + 1) * 8:]
+        self._count = count
+
+    def __len__(self) -> int:
+        return self._count
+
+    def raw(self, i: int) -> bytes:
+        return bytes(self._blob[int(self._offsets[i]):int(self._offsets[i + 1])])
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self._count))]
+        if i < 0:
+            i += self._count
+        if not 0 <= i < self._count:
+            raise IndexError(i)
+        return self.raw(i).decode("utf-8")
+
+
+class JsonTable(StringTable):
+    """1要素 1 JSON の表（表現型インデックスのエントリなど）"""
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return json.loads(super().__getitem__(i))
+
+
+class _KeyView(Sequence):
+    """二分探索用に、キーをバイト列のまま比較するビュー"""
+
+    def __init__(self, table: StringTable):
+        self._table = table
+
+    def __len__(self) -> int:
+        return len(self._table)
+
+    def __getitem__(self, i: int) -> bytes:
+        return self._table.raw(i)
+
+
+class StringMap(Mapping):
+    """UTF-8 バイト順に並べたキーの表と値の表。検索は二分探索"""
+
+    def __init__(self, keys: StringTable, values: StringTable):
+        self._keys = keys
+        self._key_view = _KeyView(keys)
+        self._values = values
+        self._key_array: Optional[np.ndarray] = None
+
+    def _find(self, key) -> int:
+        if not isinstance(key, str):
+            return -1
+        encoded = key.encode("utf-8")
+        i = bisect.bisect_left(self._key_view, encoded)
+        return i if i < len(self._keys) and self._keys.raw(i) == encoded else -1
+
+    def __getitem__(self, key):
+        i = self._find(key)
+        if i < 0:
+            raise KeyError(key)
+        return self._values[i]
+
+    def __contains__(self, key) -> bool:
+        return self._find(key) >= 0
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def items(self):
+        return zip(self._keys, self._values)
+
+    def get_many(self, keys: Sequence[str], default=None) -> list:
+        """複数キーをまとめて引く。キーの固定長バイト配列（初回に作成）に対して np.searchsorted する"""
+        if self._key_array is None:
+            # 'S' 型の比較は末尾 NUL 埋めのバイト順なので、UTF-8 のバイト順と一致する
+            self._key_array = np.array([self._keys.raw(i) for i in range(len(self._keys))], dtype=bytes)
+        if not keys or not len(self._key_array):
+            return [default] * len(keys)
+        encoded = [key.encode("utf-8") if isinstance(key, str) else b"" for key in keys]
+        positions = np.searchsorted(self._key_array, np.array(encoded, dtype=self._key_array.dtype))
+        results = []
+        for key, position in zip(encoded, positions.tolist()):
+            hit = key and position < len(self._key_array) and self._key_array[position] == key
+            results.append(self._values[position] if hit else default)
+        return results
+
+
+def source_fingerprint(path: str, with_hash: bool = True) -> dict:
+    stat = os.stat(path)
+    fingerprint = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if with_hash:
+        with open(path, "rb") as f:
+            fingerprint["sha256"] = hashlib.sha256(f.read()).hexdigest()
+    return fingerprint
+
+
+class DataBundle:
+    """
+    mmap で開いたバンドル。section() は元の JSON が更新されていれば None を返す（呼び出し側は JSON を読む）。
+    元の JSON が存在しない場合（バンドルだけを配布した場合）はバンドルを使う。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._buffer = memoryview(self._mmap)
+        magic, version, _, toc_offset, toc_length = HEADER.unpack_from(self._buffer, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a version {FORMAT_VERSION} data bundle")
+        self.toc = json.loads(bytes(self._buffer[toc_offset:toc_offset + toc_length]))
+        self._fresh: Dict[tuple, bool] = {}
+        self._sections: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _is_fresh(self, source: dict) -> bool:
+        """元の JSON がバンドル作成時と同じ内容か（判定結果は元ファイルの size / mtime ごとに覚えておく）"""
+        path = os.path.join(DATA_DIR, source["path"])
+        if not os.path.exists(path):
+            return True
+        current = source_fingerprint(path, with_hash=False)
+        key = (path, current["size"], current["mtime_ns"])
+        fresh = self._fresh.get(key)
+        if fresh is None:
+            # mtime だけが違う場合（git checkout など）は内容のハッシュで確かめる
+            fresh = current["size"] == source["size"] and (
+                current["mtime_ns"] == source["mtime_ns"]
+                or source_fingerprint(path)["sha256"] == source["sha256"]
+            )
+            if not fresh:
+                print(f"[DataBundle] {path} がバンドル作成後に更新されているため JSON を読み込みます")
+            self._fresh[key] = fresh
+        return fresh
+
+    def _table(self, kind: str, offset: int, count: int) -> StringTable:
+        return (JsonTable if kind == "json" else StringTable)(self._buffer, offset, count)
+
+    def section(self, name: str):
+        entry = self.toc["sections"].get(name)
+        if entry is None:
+            return None
+        with self._lock:
+            if not self._is_fresh(entry["source"]):
+                return None
+            section = self._sections.get(name)
+            if section is None:
+                if entry["kind"] == "map":
+                    section = StringMap(
+                        self._table("str", entry["keys_offset"], entry["count"]),
+                        self._table("str", entry["values_offset"], entry["count"]),
+                    )
+                else:
+                    section = self._table(entry["kind"], entry["offset"], entry["count"])
+                self._sections[name] = section
+            return section
+
+
+class BundleWriter:
+    """utils/createDataBundle.py から使う書き出し側"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._size = HEADER.size
+        self.sections: Dict[str, dict] = {}
+
+    def _append(self, data: bytes) -> int:
+        padding = -self._size % 8
+        if padding:
+            self._chunks.append(b"\0" * padding)
+            self._size += padding
+        offset = self._size
+        self._chunks.append(data)
+        self._size += len(data)
+        return offset
+
+    def _append_table(self, items: Iterable[bytes]) -> Tuple[int, int]:
+        encoded = list(items)
+        offsets = np.zeros(len(encoded) + 1, dtype="<u8")
+        np.cumsum([len(item) for item in encoded], out=offsets[1:])
+        return self._append(offsets.tobytes() + b"".join(encoded)), len(encoded)
+
+    def add_strings(self, name: str, values: Iterable[str], source: dict):
+        offset, count = self._append_table(v.encode("utf-8") for v in values)
+        self.sections[name] = {"kind": "str", "offset": offset, "count": count, "source": source}
+
+    def add_json_records(self, name: str, records: Iterable, source: dict):
+        offset, count = self._append_table(
+            json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8") for record in records
+        )
+        self.sections[name] = {"kind": "json", "offset": offset, "count": count, "source": source}
+
+    def add_map(self, name: str, mapping: Dict[str, str], source: dict):
+        pairs = sorted(((k.encode("utf-8"), v.encode("utf-8")) for k, v in mapping.items()), key=lambda kv: kv[0])
+        keys_offset, count = self._append_table(k for k, _ in pairs)
+        values_offset, _ = self._append_table(v for _, v in pairs)
+        self.sections[name] = {
+            "kind": "map", "keys_offset": keys_offset, "values_offset": values_offset, "count": count, "source": source,
+        }
+
+    def write(self, path: str):
+        toc = json.dumps(
+            {"format_version": FORMAT_VERSION, "created_at": time.time(), "sections": self.sections},
+            ensure_ascii=False,
+        ).encode("utf-8")
+        toc_offset = self._append(toc)
+        header = HEADER.pack(MAGIC, FORMAT_VERSION, 0, toc_offset, len(toc))
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        with open(tmp_path, "wb") as f:
+            f.write(header)
+            for chunk in self._chunks:
+                f.write(chunk)
+        # 稼働中のプロセスが mmap している旧ファイルはそのまま残る
+        os.replace(tmp_path, path)
+
+
+_bundle: Optional[DataBundle] = None
+_bundle_loaded = False
+_bundle_lock = threading.Lock()
+
+
+def get_data_bundle() -> Optional[DataBundle]:
+    """
+    共有のバンドルを返す。DATA_BUNDLE_PATH（既定 agent/data/reference_bundle.bin）がなければ None。
+    DATA_BUNDLE=0 で無効化できる。
+    """
+    global _bundle, _bundle_loaded
+    with _bundle_lock:
+        if not _bundle_loaded:
+            _bundle_loaded = True
+            path = os.getenv("DATA_BUNDLE_PATH", DEFAULT_BUNDLE_PATH)
+            if os.getenv("DATA_BUNDLE", "1").lower() in ("1", "true", "yes", "on") and os.path.exists(path):
+                try:
+                    _bundle = DataBundle(path)
+                except Exception as e:
+                    print(f"[DataBundle] {path} を開けないため JSON を読み込みます: {e}")
+        return _bundle
+
+
+def bundle_section(name: str):
+    bundle = get_data_bundle()
+    return bundle.section(name) if bundle is not None else None
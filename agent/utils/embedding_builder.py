@@ -0,0 +1,84 @@
+# agent/utils/embedding_builder.py
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Optional
+
+import numpy as np
+
+from ..llm.rate_limiter import SharedRateLimiter, estimate_tokens
+from .embedding_cache import EmbeddingCache
+
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_CONCURRENCY = 4
+DEFAULT_REQUESTS_PER_MINUTE = 300
+MAX_ATTEMPTS = 5
+
+
+def embed_texts(
+    client,
+    deployment_name: str,
+    model: str,
+    texts: List[str],
+    store_dir: str,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    requests_per_minute: float = DEFAULT_REQUESTS_PER_MINUTE,
+    tokens_per_minute: Optional[float] = None,
+    limiter_path: Optional[str] = None,
+) -> np.ndarray:
+    """
+    インデックス作成用に texts を embedding 化し、(len(texts), dim) の float32 行列を返す。
+
+    - テキスト内容のハッシュをキーとするベクトルストア（EmbeddingCache、store_dir）に保存済みのものは再利用し、
+      新規・変更されたテキストだけを API に送る。
+    - バッチは concurrency 並列で送り、SharedRateLimiter で RPM / TPM の範囲に収める
+      （limiter_path を AZURE_LLM_SHARED_LIMITER_PATH と同じにすれば、稼働中のワーカーと枠を共有する）。
+    - バッチごとにストアへ保存するので、途中で失敗しても再実行すれば続きから埋まる。
+    """
+    store = EmbeddingCache(model, directory=store_dir, lru_size=0)
+    vectors = {}
+    missing = []
+    for text in dict.fromkeys(texts):
+        vector = store.get(text)
+        if vector is None:
+            missing.append(text)
+        else:
+            vectors[text] = vector
+    print(f"{len(vectors)} texts reused from {store_dir}, {len(missing)} to embed.")
+
+    if missing:
+        limiter = SharedRateLimiter(
+            limiter_path or os.getenv("AZURE_LLM_SHARED_LIMITER_PATH") or os.path.join(store_dir, "rate_limiter.sqlite3"),
+            deployment_name,
+            requests_per_minute=requests_per_minute,
+            tokens_per_minute=tokens_per_minute,
+        )
+
+        def embed_batch(batch: List[str]) -> List[str]:
+            for attempt in range(1, MAX_ATTEMPTS + 1):
+                limiter.acquire(tokens=sum(estimate_tokens(text, 0) for text in batch))
+                try:
+                    response = client.embeddings.create(model=deployment_name, input=batch)
+                    break
+                except Exception as e:
+                    if attempt == MAX_ATTEMPTS:
+                        raise
+                    wait = 2 ** attempt
+                    print(f"Embedding request failed ({e}); retrying in {wait}s ({attempt}/{MAX_ATTEMPTS})")
+                    time.sleep(wait)
+            batch_vectors = [item.embedding for item in response.data]
+            store.put_many(batch, batch_vectors)
+            for text, vector in zip(batch, batch_vectors):
+                vectors[text] = np.asarray(vector, dtype="float32")
+            return batch
+
+        batches = [missing[i:i + batch_size] for i in range(0, len(missing), batch_size)]
+        done = 0
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+            for future in as_completed([pool.submit(embed_batch, batch) for batch in batches]):
+                done += len(future.result())
+                print(f"Embedded {done}/{len(missing)}")
+
+    return np.array([vectors[text] for text in texts], dtype="float32")
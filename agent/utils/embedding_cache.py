@@ -0,0 +1,187 @@
+# agent/utils/embedding_cache.py
+import fcntl
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """
+    テキスト + モデル名 → float32 ベクトルのキャッシュ。
+
+    - プロセス内: 直近 lru_size 件を OrderedDict の LRU に保持する。
+    - 永続化（directory 指定時）: `<model>.f32` にベクトルを行単位で追記し（np.memmap で参照）、
+      `<model>.keys` に「キーのハッシュ 行番号」を追記する。先頭行は次元数。
+      追記は fcntl のファイルロックで直列化し、ベクトルを書いてからキーを書くため、
+      他プロセスの読み手がベクトル未書き込みの行を参照することはない。
+    """
+
+    def __init__(self, model: str, directory: Optional[str] = None, lru_size: int = 4096):
+        self.model = model
+        self.lru_size = lru_size
+        self.hits = 0
+        self.misses = 0
+        self._lru: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._rows: Dict[str, int] = {}
+        self._dim: Optional[int] = None
+        self._keys_offset = 0
+        self._memmap: Optional[np.memmap] = None
+        self._lock = threading.Lock()
+
+        self.vectors_path = self.keys_path = None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            safe_model = model.replace("/", "_")
+            self.vectors_path = os.path.join(directory, f"{safe_model}.f32")
+            self.keys_path = os.path.join(directory, f"{safe_model}.keys")
+            with self._lock:
+                self._sync_keys()
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model}\0{text}".encode("utf-8")).hexdigest()
+
+    def _sync_keys(self):
+        """他プロセスが追記したキーを読み込む（self._lock 保持中に呼ぶ）"""
+        if not self.keys_path or not os.path.exists(self.keys_path):
+            return
+        with open(self.keys_path, "r", encoding="ascii") as f:
+            f.seek(self._keys_offset)
+            while True:
+                line = f.readline()
+                # 書き込み途中の行は次回読む
+                if not line or not line.endswith("\n"):
+                    break
+                self._keys_offset = f.tell()
+                parts = line.split()
+                if len(parts) == 2 and parts[0] == "dim":
+                    self._dim = int(parts[1])
+                elif len(parts) == 2:
+                    self._rows[parts[0]] = int(parts[1])
+
+    def _read_row(self, row: int) -> Optional[np.ndarray]:
+        if self._memmap is None or row >= self._memmap.shape[0]:
+            row_bytes = self._dim * 4
+            size = os.path.getsize(self.vectors_path)
+            # 行全体がファイル内に収まっていなければ読まない（書き込み途中・切り詰め前の端数）
+            if (row + 1) * row_bytes > size:
+                return None
+            rows = size // row_bytes
+            self._memmap = np.memmap(self.vectors_path, dtype="float32", mode="r", shape=(rows, self._dim))
+        return np.array(self._memmap[row])
+
+    def _remember(self, key: str, vector: np.ndarray):
+        self._lru[key] = vector
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        key = self._key(text)
+        with self._lock:
+            vector = self._lru.get(key)
+            if vector is None and self.keys_path:
+                if key not in self._rows:
+                    self._sync_keys()
+                row = self._rows.get(key)
+                if row is not None:
+                    vector = self._read_row(row)
+            if vector is None:
+                self.misses += 1
+                return None
+            self._remember(key, vector)
+            self.hits += 1
+            return vector.copy()
+
+    def put(self, text: str, vector: np.ndarray):
+        self.put_many([text], [vector])
+
+    def put_many(self, texts: List[str], vectors):
+        """複数件をまとめて保存する（ファイルロックと fsync は1回）"""
+        items = [
+            (self._key(text), np.ascontiguousarray(vector, dtype="float32").reshape(-1))
+            for text, vector in zip(texts, vectors)
+        ]
+        with self._lock:
+            for key, vector in items:
+                self._remember(key, vector.copy())
+            if not self.keys_path or not items:
+                return
+            with open(self.keys_path, "a", encoding="ascii") as keys_file:
+                fcntl.flock(keys_file, fcntl.LOCK_EX)
+                try:
+                    self._sync_keys()
+                    if self._dim is None:
+                        self._dim = items[0][1].shape[0]
+                        keys_file.write(f"dim {self._dim}\n")
+                    pending = {}
+                    for key, vector in items:
+                        if key in self._rows or key in pending:
+                            continue
+                        if vector.shape[0] != self._dim:
+                            print(f"[EmbeddingCache] 次元数が一致しないため保存しません ({vector.shape[0]} != {self._dim})")
+                            continue
+                        pending[key] = vector
+                    if not pending:
+                        return
+                    with open(self.vectors_path, "ab") as vectors_file:
+                        first_row = self._align_vectors_file(vectors_file)
+                        vectors_file.write(b"".join(vector.tobytes() for vector in pending.values()))
+                        vectors_file.flush()
+                        os.fsync(vectors_file.fileno())
+                    for row, key in enumerate(pending, start=first_row):
+                        keys_file.write(f"{key} {row}\n")
+                        self._rows[key] = row
+                    keys_file.flush()
+                    self._keys_offset = keys_file.tell()
+                finally:
+                    fcntl.flock(keys_file, fcntl.LOCK_UN)
+
+    def _align_vectors_file(self, vectors_file) -> int:
+        """
+        ベクトルファイルの末尾を行境界に揃え、次に書く行番号を返す（ファイルロック保持中に呼ぶ）。
+        書き込み途中で止まったプロセスの端数が残っていると以降の行番号がずれるため、端数は切り捨てる。
+        端数の行はキーが書かれていないので、切り捨てても参照している読み手はいない。
+        """
+        row_bytes = self._dim * 4
+        size = os.fstat(vectors_file.fileno()).st_size
+        remainder = size % row_bytes
+        if remainder:
+            print(f"[EmbeddingCache] {self.vectors_path} の末尾の書きかけ {remainder} バイトを切り捨てます")
+            vectors_file.truncate(size - remainder)
+        return (size - remainder) // row_bytes
+
+    def get_summary(self) -> str:
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0.0
+        location = self.vectors_path or "メモリのみ"
+        return (
+            f"Embedding キャッシュ ({self.model}, {location}): ヒット {self.hits}, ミス {self.misses} "
+            f"(ヒット率 {hit_rate:.1%}), 永続化 {len(self._rows)} 件"
+        )
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_embedding_cache(model: str) -> EmbeddingCache:
+    """
+    モデルごとの共有キャッシュを返す。
+    環境変数 EMBEDDING_CACHE_DIR が設定されていればディスクにも保存し、プロセス間・実行間で共有する。
+    """
+    directory = os.getenv("EMBEDDING_CACHE_DIR") or None
+    key = (model, directory)
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = EmbeddingCache(
+                model,
+                directory=directory,
+                lru_size=int(os.getenv("EMBEDDING_CACHE_LRU_SIZE", "4096")),
+            )
+            _caches[key] = cache
+        return cache
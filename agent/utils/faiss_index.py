@@ -0,0 +1,349 @@
+# agent/utils/faiss_index.py
+import json
+import os
+import threading
+from typing import Any, Callable, Optional, Tuple
+
+import faiss
+import numpy as np
+
+
+# 内積（正規化済みベクトルのコサイン類似度）で検索するインデックスの種類
+#   flat: 総当たり（IndexFlatIP）。正確だがクエリごとに全件を走査する
+#   hnsw: グラフ探索（IndexHNSWFlat）。学習不要で高速、メモリはやや増える
+#   ivf:  クラスタ分割（IndexIVFFlat）。nprobe 個のクラスタだけを走査する
+#   fp16: 総当たり、ベクトルを float16 で保持（IndexScalarQuantizer）。サイズは flat の半分
+#   pq:   クラスタ分割 + 直積量子化（IndexIVFPQ）。1件あたり pq_m バイト。上位候補を float32 で再ランキングする
+INDEX_TYPES = ("flat", "hnsw", "ivf", "fp16", "pq")
+# 近似スコアを float32 ベクトルで再計算する種類
+QUANTIZED_TYPES = ("fp16", "pq")
+
+DEFAULT_HNSW_M = 32
+DEFAULT_HNSW_EF_CONSTRUCTION = 200
+DEFAULT_HNSW_EF_SEARCH = 128
+DEFAULT_IVF_NPROBE = 32
+DEFAULT_RERANK_FACTOR = 10
+DEFAULT_COARSE_CANDIDATES = 300
+
+
+def _check_type(index_type: str) -> str:
+    index_type = (index_type or "flat").lower()
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown FAISS index type: {index_type} (expected one of {', '.join(INDEX_TYPES)})")
+    return index_type
+
+
+def index_path(base: str, index_type: str = "flat") -> str:
+    """flat は従来どおり <base>.bin、それ以外は <base>.<type>.bin"""
+    index_type = _check_type(index_type)
+    return f"{base}.bin" if index_type == "flat" else f"{base}.{index_type}.bin"
+
+
+def coarse_base(base: str, dim: int) -> str:
+    """先頭 dim 次元に切り詰めたベクトルの粗検索インデックス（<base>.coarse<dim>.bin など）"""
+    return f"{base}.coarse{dim}"
+
+
+def truncate_vectors(vectors: np.ndarray, dim: int) -> np.ndarray:
+    """
+    先頭 dim 次元に切り詰めて L2 正規化する。
+    text-embedding-3 系は次元削減（dimensions 指定）の出力がこれと同じになるよう学習されている。
+    """
+    # 1行の配列ではスライスが連続とみなされビューになるため、必ずコピーする（元のクエリを書き換えない）
+    truncated = np.array(vectors[:, :dim], dtype="float32", order="C", copy=True)
+    faiss.normalize_L2(truncated)
+    return truncated
+
+
+def vectors_path(base: str) -> str:
+    """再ランキング用の float32 ベクトル（np.save 形式、mmap で読む）"""
+    return f"{base}.vectors.npy"
+
+
+def default_ivf_nlist(n: int) -> int:
+    """IVF のクラスタ数の目安（約 4√n、学習データが各クラスタ 39 件以上になる範囲）"""
+    return max(1, min(int(4 * np.sqrt(n)), n // 39 or 1))
+
+
+def default_pq_m(dim: int) -> int:
+    """PQ のサブベクトル数。各サブベクトルが約 32 次元になる、dim の約数"""
+    m = max(dim // 32, 1)
+    while dim % m:
+        m -= 1
+    return m
+
+
+def build_index(
+    vectors: np.ndarray,
+    index_type: str = "flat",
+    hnsw_m: int = DEFAULT_HNSW_M,
+    ef_construction: int = DEFAULT_HNSW_EF_CONSTRUCTION,
+    nlist: Optional[int] = None,
+    pq_m: Optional[int] = None,
+) -> faiss.Index:
+    """L2 正規化済みの float32 行列から内積検索のインデックスを作る"""
+    index_type = _check_type(index_type)
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    dim = vectors.shape[1]
+
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = ef_construction
+    elif index_type == "ivf":
+        quantizer = faiss.IndexFlatIP(dim)
+        index = faiss.IndexIVFFlat(quantizer, dim, nlist or default_ivf_nlist(len(vectors)), faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+    elif index_type == "fp16":
+        index = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_INNER_PRODUCT)
+    elif index_type == "pq":
+        quantizer = faiss.IndexFlatIP(dim)
+        index = faiss.IndexIVFPQ(
+            quantizer, dim, nlist or default_ivf_nlist(len(vectors)), pq_m or default_pq_m(dim), 8,
+            faiss.METRIC_INNER_PRODUCT,
+        )
+        index.train(vectors)
+    else:
+        index = faiss.IndexFlatIP(dim)
+    index.add(vectors)
+    return index
+
+
+class RerankingIndex:
+    """
+    近似インデックスで max(rerank_factor * k, min_candidates) 件の候補を取り、
+    float32 ベクトルとの内積で並べ直して上位 k 件を返す。
+    - 量子化インデックス（fp16 / pq）: 量子化誤差で崩れた順位を正確なスコアで直す。
+    - coarse_dim 指定時: クエリを先頭 coarse_dim 次元に切り詰めて粗検索し、全次元で並べ直す（2段階検索）。
+    ベクトルは mmap した配列を渡せば、候補の行だけがページキャッシュから読まれる。
+    d は全次元の次元数、それ以外の属性（ntotal など）は元のインデックスのものを返す。
+    """
+
+    def __init__(self, index: faiss.Index, vectors: np.ndarray, rerank_factor: int = DEFAULT_RERANK_FACTOR,
+                 coarse_dim: Optional[int] = None, min_candidates: int = 0):
+        self.index = index
+        self.vectors = vectors
+        self.rerank_factor = rerank_factor
+        self.coarse_dim = coarse_dim
+        self.min_candidates = min_candidates
+
+    def __getattr__(self, name):
+        return getattr(self.index, name)
+
+    @property
+    def d(self) -> int:
+        return self.vectors.shape[1]
+
+    def search(self, queries: np.ndarray, k: int):
+        coarse_queries = truncate_vectors(queries, self.coarse_dim) if self.coarse_dim else queries
+        n_candidates = min(max(k * self.rerank_factor, self.min_candidates, k), self.index.ntotal)
+        _, candidates = self.index.search(coarse_queries, n_candidates)
+        distances = np.full((len(queries), k), -np.inf, dtype="float32")
+        indices = np.full((len(queries), k), -1, dtype="int64")
+        for i, (query, ids) in enumerate(zip(queries, candidates)):
+            # 行番号順に読むと mmap の参照が局所的になる
+            ids = np.sort(ids[ids >= 0])
+            if not len(ids):
+                continue
+            scores = np.asarray(self.vectors[ids] @ query, dtype="float32")
+            top = np.argsort(-scores)[:k]
+            distances[i, :len(top)] = scores[top]
+            indices[i, :len(top)] = ids[top]
+        return distances, indices
+
+
+def configure_search(index: faiss.Index, ef_search: Optional[int] = None, nprobe: Optional[int] = None) -> faiss.Index:
+    """検索時パラメータ（HNSW の efSearch、IVF の nprobe）を設定する。flat では何もしない"""
+    if isinstance(index, RerankingIndex):
+        configure_search(index.index, ef_search, nprobe)
+        return index
+    hnsw = getattr(faiss.downcast_index(index), "hnsw", None)
+    if hnsw is not None:
+        hnsw.efSearch = ef_search or DEFAULT_HNSW_EF_SEARCH
+    try:
+        ivf = faiss.extract_index_ivf(index)
+    except RuntimeError:
+        ivf = None
+    if ivf is not None:
+        ivf.nprobe = min(nprobe or DEFAULT_IVF_NPROBE, ivf.nlist)
+    return index
+
+
+def _replace_atomically(path: str, write: Callable[[str], None]):
+    """
+    同じディレクトリの一時ファイルに書いてから os.replace で置き換える。
+    読み込み中・mmap 中のプロセスは置き換え前のファイルを参照し続けるので、書きかけのファイルを読むことはない。
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def write_index(index: faiss.Index, path: str):
+    _replace_atomically(path, lambda tmp_path: faiss.write_index(index, tmp_path))
+
+
+def write_json(data: Any, path: str, **dump_kwargs):
+    def write(tmp_path: str):
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, **dump_kwargs)
+    _replace_atomically(path, write)
+
+
+def save_vectors(base: str, vectors: np.ndarray):
+    def write(tmp_path: str):
+        # np.save はファイル名に .npy を付け足すため、ファイルオブジェクトで渡す
+        with open(tmp_path, "wb") as f:
+            np.save(f, np.ascontiguousarray(vectors, dtype="float32"))
+    _replace_atomically(vectors_path(base), write)
+
+
+def read_index(path: str, mmap: bool = True) -> faiss.Index:
+    """
+    mmap=True ならベクトル（コード）部分をファイルから直接参照する（IO_FLAG_MMAP_IFC）。
+    プロセスごとのコピーを持たず、同じノードのワーカー間でページキャッシュを共有できる。
+    """
+    flag = getattr(faiss, "IO_FLAG_MMAP_IFC", None) or getattr(faiss, "IO_FLAG_MMAP", 0)
+    if mmap and flag:
+        try:
+            return faiss.read_index(path, flag)
+        except RuntimeError as e:
+            print(f"[FAISS] {path} を mmap で開けないため通常の読み込みに切り替えます: {e}")
+    return faiss.read_index(path)
+
+
+def load_index(base: str, env_prefix: str) -> faiss.Index:
+    """
+    <env_prefix>_INDEX_TYPE（flat / hnsw / ivf / fp16 / pq、既定 flat）で選んだインデックスを読み込み、
+    <env_prefix>_HNSW_EF_SEARCH / <env_prefix>_IVF_NPROBE を検索時パラメータとして設定する。
+    選んだ種類のファイルがなければ flat を読み込む。
+    インデックスは FAISS_MMAP=0 でない限り mmap で開く。
+    fp16 / pq は <base>.vectors.npy があれば <env_prefix>_RERANK_FACTOR（既定 10、0 で無効）倍の候補を再ランキングする。
+    <env_prefix>_COARSE_DIM（256 など）を設定すると、切り詰めたベクトルの粗検索インデックスで
+    <env_prefix>_COARSE_CANDIDATES（既定 300）件以上の候補を取り、全次元のベクトルで再ランキングする。
+    """
+    index_type = _check_type(os.getenv(f"{env_prefix}_INDEX_TYPE", "flat"))
+    mmap = os.getenv("FAISS_MMAP", "1").lower() in ("1", "true", "yes", "on")
+    rerank_factor = int(os.getenv(f"{env_prefix}_RERANK_FACTOR", str(DEFAULT_RERANK_FACTOR)))
+    search_params = dict(
+        ef_search=int(os.getenv(f"{env_prefix}_HNSW_EF_SEARCH", str(DEFAULT_HNSW_EF_SEARCH))),
+        nprobe=int(os.getenv(f"{env_prefix}_IVF_NPROBE", str(DEFAULT_IVF_NPROBE))),
+    )
+
+    coarse_dim = int(os.getenv(f"{env_prefix}_COARSE_DIM", "0"))
+    if coarse_dim:
+        path = index_path(coarse_base(base, coarse_dim), index_type)
+        if os.path.exists(path) and os.path.exists(vectors_path(base)):
+            index = RerankingIndex(
+                read_index(path, mmap=mmap),
+                np.load(vectors_path(base), mmap_mode="r"),
+                rerank_factor=rerank_factor,
+                coarse_dim=coarse_dim,
+                min_candidates=int(os.getenv(f"{env_prefix}_COARSE_CANDIDATES", str(DEFAULT_COARSE_CANDIDATES))),
+            )
+            return configure_search(index, **search_params)
+        print(f"[FAISS] {path} または {vectors_path(base)} がないため2段階検索を使いません")
+
+    path = index_path(base, index_type)
+    if index_type != "flat" and not os.path.exists(path):
+        print(f"[FAISS] {path} がないため flat インデックスを使います")
+        index_type = "flat"
+        path = index_path(base, index_type)
+    index = read_index(path, mmap=mmap)
+
+    if index_type in QUANTIZED_TYPES and rerank_factor > 0:
+        if os.path.exists(vectors_path(base)):
+            index = RerankingIndex(index, np.load(vectors_path(base), mmap_mode="r"), rerank_factor)
+        else:
+            print(f"[FAISS] {vectors_path(base)} がないため再ランキングせずに量子化スコアを使います")
+    return configure_search(index, **search_params)
+
+
+def reconstruct_vectors(index: faiss.Index) -> np.ndarray:
+    """flat インデックスに格納済みのベクトルを取り出す（embedding をやり直さずに別種のインデックスを作るため）"""
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def _file_version(path: str) -> Tuple[int, int]:
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_mtime_ns
+
+
+class HotSwapIndex:
+    """
+    インデックスとマッピング JSON の組を保持し、マッピング JSON が置き換えられたら両方を読み込み直す。
+    ビルダーはインデックス類を書き終えてから最後にマッピング JSON を置き換えるので、その更新を再構築完了の合図とする。
+    get() は (インデックス, マッピング) の組を返す。呼び出し側は1回の検索の間この組を使い続けること。
+    load_mapping を渡すと、マッピングは JSON の代わりにその戻り値を使う（データバンドルなど）。
+    FAISS_HOT_RELOAD=0 なら起動時に読み込んだものを使い続ける。
+    lazy=True なら最初の get() まで読み込まない（読み込みの失敗もそこで送出される）。
+    """
+
+    def __init__(self, base: str, mapping_path: str, env_prefix: str,
+                 row_count: Callable[[Any], int] = len, on_reload: Optional[Callable[[], None]] = None,
+                 load_mapping: Optional[Callable[[], Any]] = None, lazy: bool = False):
+        self.base = base
+        self.mapping_path = mapping_path
+        self.env_prefix = env_prefix
+        self.row_count = row_count
+        self.load_mapping = load_mapping or self._load_json
+        self.on_reload = on_reload
+        self.hot_reload = os.getenv("FAISS_HOT_RELOAD", "1").lower() in ("1", "true", "yes", "on")
+        self._lock = threading.Lock()
+        self._version: Optional[Tuple[int, int]] = None
+        self._current: Optional[Tuple[faiss.Index, Any]] = None
+        if not lazy:
+            self._load_initial()
+
+    def _load_initial(self):
+        with self._lock:
+            if self._current is None:
+                version = _file_version(self.mapping_path)
+                self._current = self._load()
+                self._version = version
+
+    def _load_json(self) -> Any:
+        with open(self.mapping_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _load(self) -> Tuple[faiss.Index, Any]:
+        index = load_index(self.base, self.env_prefix)
+        mapping = self.load_mapping()
+        if index.ntotal != self.row_count(mapping):
+            raise ValueError(f"index has {index.ntotal} rows but {self.mapping_path} has {self.row_count(mapping)}")
+        return index, mapping
+
+    @property
+    def loaded(self) -> bool:
+        return self._current is not None
+
+    def get(self) -> Tuple[faiss.Index, Any]:
+        if self._current is None:
+            self._load_initial()
+        if self.hot_reload:
+            try:
+                version = _file_version(self.mapping_path)
+            except OSError:
+                version = self._version
+            if version != self._version:
+                self._reload(version)
+        return self._current
+
+    def _reload(self, version: Tuple[int, int]):
+        with self._lock:
+            if version == self._version:
+                return
+            # 失敗しても同じファイルで読み込みを繰り返さない（次の置き換えを待つ）
+            self._version = version
+            try:
+                self._current = self._load()
+            except Exception as e:
+                print(f"[FAISS] {self.base} を読み込み直せないため、以前のインデックスを使い続けます: {e}")
+                return
+        print(f"[FAISS] {self.base} を読み込み直しました ({self._current[0].ntotal} 件)")
+        if self.on_reload:
+            self.on_reload()
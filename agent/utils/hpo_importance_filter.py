@@ -3,6 +3,8 @@ import os
 from functools import lru_cache
 from typing import List
 
+from .hpo_store import get_hpo_store
+
 
 TOP_HPO_IMPORTANCE_LIMIT = 15
 UNKNOWN_HPO_IMPORTANCE = float("inf")
@@ -36,10 +38,12 @@ def filter_hpo_by_importance(
         return hpo_list
 
     importance = load_hpo_importance()
+    # alt_id / obsolete の ID は現行 ID の関連疾患数で比べる（返す ID は入力のまま）
+    resolved = get_hpo_store().resolve_many(hpo_list)
     ranked_hpo = sorted(
         enumerate(hpo_list),
         key=lambda item: (
-            importance.get(item[1], UNKNOWN_HPO_IMPORTANCE),
+            importance.get(item[1], importance.get(resolved[item[0]], UNKNOWN_HPO_IMPORTANCE)),
             item[0],
         ),
     )
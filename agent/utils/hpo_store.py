@@ -0,0 +1,177 @@
+# agent/utils/hpo_store.py
+import json
+import os
+import re
+import threading
+from collections.abc import Mapping
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from .data_bundle import DATA_DIR, bundle_section
+
+
+PHENOTYPE_MAPPING_PATH = os.path.join(DATA_DIR, "phenotype_mapping.json")
+# hp.obo があれば alt_id / replaced_by / consider から旧 ID → 現行 ID の対応を作る（任意）
+HPO_OBO_PATH = os.path.join(DATA_DIR, "hp.obo")
+OBSOLETE_PREFIX = "obsolete "
+MAX_REPLACEMENT_HOPS = 5
+
+_HPO_ID_PATTERN = re.compile(r"^(?:HP[:_]?)?(\d{7})$", re.IGNORECASE)
+
+
+def normalize_hpo_id(hpo_id: str) -> str:
+    """"hp_0001263" や "0001263" などの表記ゆれを "HP:0001263" に揃える（HPO ID でなければそのまま返す）"""
+    if not isinstance(hpo_id, str):
+        return hpo_id
+    match = _HPO_ID_PATTERN.match(hpo_id.strip())
+    return f"HP:{match.group(1)}" if match else hpo_id.strip()
+
+
+def is_obsolete_label(label: str) -> bool:
+    return label.lower().startswith(OBSOLETE_PREFIX)
+
+
+def parse_obo_replacements(path: str) -> Dict[str, str]:
+    """
+    hp.obo から {旧 ID: 現行 ID} を作る。
+    - alt_id: 統合された ID → 統合先のターム
+    - is_obsolete のターム: replaced_by を優先し、なければ consider が1つだけの場合にそれを使う
+    """
+    replacements: Dict[str, str] = {}
+
+    def flush(term: dict):
+        term_id = term.get("id")
+        if not term_id:
+            return
+        for alt_id in term.get("alt_id", []):
+            replacements[alt_id] = term_id
+        if term.get("is_obsolete") == ["true"]:
+            target = term.get("replaced_by") or (term.get("consider") if len(term.get("consider", [])) == 1 else None)
+            if target:
+                replacements[term_id] = target[0]
+
+    term: Optional[dict] = None
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("["):
+                if term is not None:
+                    flush(term)
+                term = {} if line == "[Term]" else None
+            elif term is not None and ": " in line:
+                key, value = line.split(": ", 1)
+                # "consider: HP:0000001 ! comment" などの末尾コメントを落とす
+                value = value.split(" !", 1)[0].strip()
+                if key == "id":
+                    term["id"] = value
+                else:
+                    term.setdefault(key, []).append(value)
+    if term is not None:
+        flush(term)
+    return replacements
+
+
+def derive_replacements(labels: Mapping, obo_replacements: Optional[Mapping] = None) -> Dict[str, str]:
+    """
+    旧 ID → 現行 ID の対応。hp.obo の対応を優先し、
+    残りの obsolete タームは "obsolete <名前>" の <名前> を持つ現行タームが1つだけあればそれに寄せる。
+    """
+    current: Dict[str, List[str]] = {}
+    obsolete: Dict[str, str] = {}
+    for hpo_id, label in labels.items():
+        if is_obsolete_label(label):
+            obsolete[hpo_id] = label[len(OBSOLETE_PREFIX):].strip().lower()
+        else:
+            current.setdefault(label.strip().lower(), []).append(hpo_id)
+
+    replacements = dict(obo_replacements or {})
+    for hpo_id, name in obsolete.items():
+        candidates = current.get(name, [])
+        if hpo_id not in replacements and len(candidates) == 1:
+            replacements[hpo_id] = candidates[0]
+    return replacements
+
+
+class HPOTermStore:
+    """
+    HPO ID → ラベルの参照をプロセス内で共有する。
+    labels / replacements はデータバンドルの mmap 辞書（StringMap）か、JSON から作った dict。
+    """
+
+    def __init__(self, labels: Mapping, replacements: Optional[Mapping] = None):
+        self._labels = labels
+        self._replacements = replacements or {}
+
+    def __len__(self) -> int:
+        return len(self._labels)
+
+    def __contains__(self, hpo_id) -> bool:
+        return self.resolve(hpo_id) in self._labels
+
+    def _get_many(self, mapping: Mapping, keys: Sequence[str]) -> list:
+        get_many = getattr(mapping, "get_many", None)
+        if get_many is not None:
+            return get_many(keys)
+        return [mapping.get(key) for key in keys]
+
+    def resolve_many(self, hpo_ids: Sequence[str]) -> List[str]:
+        """表記を揃え、alt_id / obsolete の ID を現行 ID に置き換える（置き換え先がなければそのまま）"""
+        resolved = [normalize_hpo_id(hpo_id) for hpo_id in hpo_ids]
+        if not self._replacements:
+            return resolved
+        pending = list(range(len(resolved)))
+        for _ in range(MAX_REPLACEMENT_HOPS):
+            targets = self._get_many(self._replacements, [resolved[i] for i in pending])
+            pending_next = []
+            for i, target in zip(pending, targets):
+                if target and target != resolved[i]:
+                    resolved[i] = target
+                    pending_next.append(i)
+            pending = pending_next
+            if not pending:
+                break
+        return resolved
+
+    def resolve(self, hpo_id: str) -> str:
+        return self.resolve_many([hpo_id])[0]
+
+    def labels(self, hpo_ids: Sequence[str], default: str = "") -> List[str]:
+        """HPO ID の並びに対応するラベルの並び（未登録は default）"""
+        found = self._get_many(self._labels, self.resolve_many(hpo_ids))
+        return [default if label is None else label for label in found]
+
+    def label(self, hpo_id: str, default: str = "") -> str:
+        return self.labels([hpo_id], default)[0]
+
+    def label_dict(self, hpo_ids: Iterable[str]) -> Dict[str, str]:
+        """{入力どおりの HPO ID: ラベル}。make_hpo_dic と同じ形"""
+        hpo_ids = list(hpo_ids)
+        return dict(zip(hpo_ids, self.labels(hpo_ids)))
+
+
+def load_hpo_store() -> HPOTermStore:
+    """データバンドルの hpo_labels / hpo_replacements があれば使い、なければ JSON（と hp.obo）から作る"""
+    labels = bundle_section("hpo_labels")
+    if labels is not None:
+        replacements = bundle_section("hpo_replacements")
+        if replacements is not None:
+            return HPOTermStore(labels, replacements)
+    else:
+        with open(PHENOTYPE_MAPPING_PATH, "r", encoding="utf-8") as f:
+            labels = json.load(f)
+    obo_replacements = parse_obo_replacements(HPO_OBO_PATH) if os.path.exists(HPO_OBO_PATH) else None
+    return HPOTermStore(labels, derive_replacements(labels, obo_replacements))
+
+
+_store: Optional[HPOTermStore] = None
+_store_lock = threading.Lock()
+
+
+def get_hpo_store() -> HPOTermStore:
+    """プロセス共有の HPOTermStore（初回呼び出し時に1回だけ読み込む）"""
+    global _store
+    if _store is not None:
+        return _store
+    with _store_lock:
+        if _store is None:
+            _store = load_hpo_store()
+        return _store
@@ -0,0 +1,70 @@
+import json
+import os
+from functools import lru_cache
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+
+
+HPO_TERM_EMBEDDINGS_BASE = os.path.abspath(
+    os.path.join(
+        os.path.dirname(__file__),
+        "..",
+        "data",
+        "DataForDiseaseSearchFromHPO",
+        "hpo_term_embeddings",
+    )
+)
+# IC が 0 のターム（ルート付近）も完全には無視しない
+MIN_TERM_WEIGHT = 0.1
+
+
+class HPOTermEmbeddings:
+    """
+    utils/createHPOTermEmbeddings.py で作成した HPO タームごとの正規化済みベクトルと IC。
+    患者の表現型クエリベクトルを、タームベクトルの IC 重み付き平均としてローカルで合成する。
+    """
+
+    def __init__(self, vectors: np.ndarray, hpo_ids: Iterable[str], ic: Iterable[float], model: Optional[str] = None):
+        self.vectors = vectors
+        self.model = model
+        self.rows: Dict[str, int] = {hpo_id: row for row, hpo_id in enumerate(hpo_ids)}
+        self.weights = np.maximum(np.asarray(list(ic), dtype="float32"), MIN_TERM_WEIGHT)
+
+    @property
+    def dim(self) -> int:
+        return self.vectors.shape[1]
+
+    def compose(self, hpo_ids: Iterable[str]) -> Optional[np.ndarray]:
+        """
+        (1, dim) の float32 クエリベクトルを返す。
+        テーブルにないタームが1つでもあれば None（呼び出し側は embedding API に切り替える）。
+        """
+        rows = []
+        for hpo_id in hpo_ids:
+            row = self.rows.get(hpo_id)
+            if row is None:
+                return None
+            rows.append(row)
+        if not rows:
+            return None
+        weights = self.weights[rows]
+        query = weights @ self.vectors[rows] / weights.sum()
+        return query.astype("float32").reshape(1, -1)
+
+
+@lru_cache(maxsize=1)
+def load_hpo_term_embeddings(base_path: str = HPO_TERM_EMBEDDINGS_BASE) -> Optional[HPOTermEmbeddings]:
+    """テーブルが存在しなければ None（ベクトルは mmap で読み込む）"""
+    if not (os.path.exists(base_path + ".npy") and os.path.exists(base_path + ".json")):
+        return None
+    try:
+        vectors = np.load(base_path + ".npy", mmap_mode="r")
+        with open(base_path + ".json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if len(meta["hpo_ids"]) != vectors.shape[0]:
+            raise ValueError(f"row count mismatch ({len(meta['hpo_ids'])} != {vectors.shape[0]})")
+        return HPOTermEmbeddings(vectors, meta["hpo_ids"], meta.get("ic") or [1.0] * vectors.shape[0], meta.get("model"))
+    except Exception as e:
+        print(f"[HPOTermEmbeddings] タームベクトルを読み込めません ({base_path}): {e}")
+        return None
@@ -2,6 +2,13 @@ import json
 from typing import Any
 from agent.state.state_types import ZeroShotOutput, DiagnosisOutput, ReflectionOutput, PhenotypeSearchFormat
 
+# 検索と reflection を兼ねるノードは両方の形式で書き込む
+DISEASE_SEARCH_NODES = {
+    "diseaseSearchNode", "diseaseSearchAndReflectionNode",
+    "streamingDiagnosisNode", "streamingDiagnosisAndReflectionNode",
+}
+REFLECTION_NODES = {"reflectionNode", "diseaseSearchAndReflectionNode", "streamingDiagnosisAndReflectionNode"}
+
 def _write_disease_search_prompt(f):
     """diseaseSearchNode用の固定プロンプトを書き込む"""
     f.write("\n----- Summarize Prompt for DiseaseSearch -----\n")
@@ -135,7 +142,7 @@ def log_node_result(logfile_path: str, node_name: str, result: Any):
     with open(logfile_path, "a", encoding="utf-8") as f:
         f.write(f"\n=== {node_name} ===\n")
         
-        if node_name == "diseaseSearchNode":
+        if node_name in DISEASE_SEARCH_NODES:
             _write_disease_search_prompt(f)
         
         try:
@@ -146,7 +153,7 @@ def log_node_result(logfile_path: str, node_name: str, result: Any):
             if isinstance(result, dict) and "prompt" in result:
                 prompt = result["prompt"]
                 # reflectionNodeの場合、結果本体は"reflection"キーの中身
-                if node_name == "reflectionNode":
+                if node_name in REFLECTION_NODES:
                     core_result = result.get("reflection", result)
                 elif node_name == "finalDiagnosisNode":
                     core_result = result.get("finalDiagnosis", result)
@@ -154,7 +161,7 @@ def log_node_result(logfile_path: str, node_name: str, result: Any):
                     core_result = result.get("result", result)
 
             if prompt:
-                if node_name == "reflectionNode":
+                if node_name in REFLECTION_NODES:
                     _write_reflection_prompt(f, prompt, original_result)
                 else:
                     _write_generic_prompt(f, prompt)
@@ -1,86 +1,292 @@
 # agent/utils/profiler.py
-import time
+import asyncio
+import contextvars
 import functools
-from typing import Dict, List
+import inspect
+import itertools
+import json
+import os
+import threading
+import time
 from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+
+# 実行中のラン（pipeline.run / arun 1回分）・スパン・ノード名。スレッドプールへは ContextThreadPoolExecutor で引き継ぐ
+current_run: contextvars.ContextVar[Optional["RunContext"]] = contextvars.ContextVar("current_run", default=None)
+current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+current_node: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_node", default=None)
+# capture_runs() の中で開始したランの RunContext を集めるリスト
+_run_sink: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar("run_sink", default=None)
+
+
+@dataclass
+class RunContext:
+    run_id: int
+    label: str
+    started_at: float = field(default_factory=time.time)
+
+
+@dataclass
+class Span:
+    """計測区間。category は "run" / "node" / "tool" / "llm" / "embedding" / "api" など"""
+    span_id: int
+    name: str
+    category: str
+    run_id: Optional[int]
+    parent_id: Optional[int]
+    track: int
+    start: float
+    end: Optional[float] = None
+    args: dict = field(default_factory=dict)
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.time()) - self.start
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    """線形補間によるパーセンタイル（q は 0-100）"""
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def _current_track() -> int:
+    """トレース上の表示行。非同期タスクはタスクごと、それ以外はスレッドごとに分ける"""
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    return id(task) if task is not None else threading.get_ident()
+
 
 class NodeProfiler:
-    """ノードの実行時間を計測するプロファイラー"""
-    
+    """
+    ノード・ツール・外部呼び出しの実行時間をスパンとして記録するプロファイラー（スレッドセーフ）。
+    pipeline.run / arun ごとに run_scope() でランを区切り、スパンの親子関係は contextvars で追跡する。
+    """
+
     def __init__(self):
-        self.timings: Dict[str, List[float]] = defaultdict(list)
-        self.start_times: Dict[str, float] = {}
-    
-    def start(self, node_name: str):
-        """ノードの実行開始"""
-        self.start_times[node_name] = time.time()
-    
-    def end(self, node_name: str):
-        """ノードの実行終了"""
-        if node_name in self.start_times:
-            elapsed = time.time() - self.start_times[node_name]
-            self.timings[node_name].append(elapsed)
-            del self.start_times[node_name]
-            return elapsed
-        return None
-    
-    def get_summary(self) -> str:
+        self.spans: List[Span] = []
+        self.runs: Dict[int, RunContext] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def run_scope(self, label: str):
+        """1回の診断実行をランとして区切る。中で記録したスパンはこのランに属する"""
+        run = RunContext(run_id=next(self._ids), label=label)
+        with self._lock:
+            self.runs[run.run_id] = run
+        sink = _run_sink.get()
+        if sink is not None:
+            sink.append(run)
+        run_token = current_run.set(run)
+        try:
+            with self.span(label, "run"):
+                yield run
+        finally:
+            current_run.reset(run_token)
+
+    @contextmanager
+    def capture_runs(self):
+        """この中で開始したラン（RunContext）のリストを返す。呼び出し側が後で discard_runs で破棄するため"""
+        runs = []
+        token = _run_sink.set(runs)
+        try:
+            yield runs
+        finally:
+            _run_sink.reset(token)
+
+    def discard_runs(self, run_ids) -> List[Span]:
+        """指定したランとそのスパンを破棄し、破棄したスパンを返す（常駐プロセスで記録が増え続けないように）"""
+        run_ids = set(run_ids)
+        with self._lock:
+            removed = [s for s in self.spans if s.run_id in run_ids]
+            self.spans = [s for s in self.spans if s.run_id not in run_ids]
+            for run_id in run_ids:
+                self.runs.pop(run_id, None)
+        return removed
+
+    @contextmanager
+    def span(self, name: str, category: str = "tool", **args):
+        parent = current_span.get()
+        run = current_run.get()
+        span = Span(
+            span_id=next(self._ids),
+            name=name,
+            category=category,
+            run_id=run.run_id if run else None,
+            parent_id=parent.span_id if parent else None,
+            track=_current_track(),
+            start=time.time(),
+            args=args,
+        )
+        token = current_span.set(span)
+        try:
+            yield span
+        finally:
+            span.end = time.time()
+            try:
+                current_span.reset(token)
+            except ValueError:
+                # 別のコンテキストで閉じられたジェネレータ（ストリーミング応答）の場合
+                pass
+            with self._lock:
+                self.spans.append(span)
+
+    def _snapshot(self, category: Optional[str] = None) -> List[Span]:
+        with self._lock:
+            spans = list(self.spans)
+        if category is not None:
+            spans = [s for s in spans if s.category == category]
+        return spans
+
+    def stats(self, category: Optional[str] = "node") -> Dict[str, dict]:
+        """スパン名ごとの回数・合計・平均・p50/p90/p99・最小/最大（秒）"""
+        durations: Dict[str, List[float]] = defaultdict(list)
+        for span in self._snapshot(category):
+            durations[span.name].append(span.duration)
+        result = {}
+        for name, values in durations.items():
+            values.sort()
+            result[name] = {
+                "count": len(values),
+                "total": sum(values),
+                "avg": sum(values) / len(values),
+                "p50": _percentile(values, 50),
+                "p90": _percentile(values, 90),
+                "p99": _percentile(values, 99),
+                "min": values[0],
+                "max": values[-1],
+            }
+        return result
+
+    def get_summary(self, category: Optional[str] = "node") -> str:
         """実行時間のサマリーを取得"""
-        if not self.timings:
+        stats = self.stats(category)
+        if not stats:
             return "No profiling data available."
-        
+
         lines = ["\n" + "="*60]
-        lines.append("ノード実行時間プロファイル")
+        lines.append("ノード実行時間プロファイル" if category == "node" else f"実行時間プロファイル ({category or 'all'})")
         lines.append("="*60)
-        
+
+        total_time = sum(s["total"] for s in stats.values())
+
         # 合計時間でソート
-        sorted_nodes = sorted(
-            self.timings.items(),
-            key=lambda x: sum(x[1]),
-            reverse=True
-        )
-        
-        total_time = sum(sum(times) for times in self.timings.values())
-        
-        for node_name, times in sorted_nodes:
-            count = len(times)
-            total = sum(times)
-            avg = total / count
-            percentage = (total / total_time) * 100
-            
-            lines.append(f"\n{node_name}:")
-            lines.append(f"  実行回数: {count}")
-            lines.append(f"  合計時間: {total:.2f}秒 ({percentage:.1f}%)")
-            lines.append(f"  平均時間: {avg:.2f}秒")
-            if count > 1:
-                lines.append(f"  最小/最大: {min(times):.2f}秒 / {max(times):.2f}秒")
-        
+        for name, s in sorted(stats.items(), key=lambda item: item[1]["total"], reverse=True):
+            percentage = (s["total"] / total_time) * 100 if total_time else 0.0
+            lines.append(f"\n{name}:")
+            lines.append(f"  実行回数: {s['count']}")
+            lines.append(f"  合計時間: {s['total']:.2f}秒 ({percentage:.1f}%)")
+            lines.append(f"  平均時間: {s['avg']:.2f}秒")
+            if s["count"] > 1:
+                lines.append(f"  p50/p90/p99: {s['p50']:.2f}秒 / {s['p90']:.2f}秒 / {s['p99']:.2f}秒")
+                lines.append(f"  最小/最大: {s['min']:.2f}秒 / {s['max']:.2f}秒")
+
         lines.append(f"\n{'='*60}")
         lines.append(f"総実行時間: {total_time:.2f}秒")
         lines.append(f"{'='*60}\n")
-        
+
         return "\n".join(lines)
-    
+
+    def export_chrome_trace(self, path: str, run_id: Optional[int] = None):
+        """
+        Chrome trace 形式（chrome://tracing, Perfetto で表示可能）の JSON を書き出す。
+        ランごとに1プロセス、スレッド・非同期タスクごとに1行として表示する。
+        """
+        spans = self._snapshot(None)
+        if run_id is not None:
+            spans = [s for s in spans if s.run_id == run_id]
+        if not spans:
+            return
+        origin = min(s.start for s in spans)
+
+        events = []
+        tracks: Dict[tuple, int] = {}
+        with self._lock:
+            runs = dict(self.runs)
+        for run in runs.values():
+            if run_id is None or run.run_id == run_id:
+                events.append({"name": "process_name", "ph": "M", "pid": run.run_id, "args": {"name": run.label}})
+        for span in sorted(spans, key=lambda s: s.start):
+            pid = span.run_id or 0
+            tid = tracks.setdefault((pid, span.track), len(tracks) + 1)
+            events.append({
+                "name": span.name,
+                "cat": span.category,
+                "ph": "X",
+                "ts": (span.start - origin) * 1_000_000,
+                "dur": span.duration * 1_000_000,
+                "pid": pid,
+                "tid": tid,
+                "args": {**span.args, "span_id": span.span_id, "parent_id": span.parent_id},
+            })
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+
     def reset(self):
         """プロファイルデータをリセット"""
-        self.timings.clear()
-        self.start_times.clear()
+        with self._lock:
+            self.spans.clear()
+            self.runs.clear()
 
 # グローバルインスタンス
 profiler = NodeProfiler()
 
+
+@contextmanager
+def _node_span(node_name: str):
+    token = current_node.set(node_name)
+    try:
+        with profiler.span(node_name, "node") as span:
+            yield span
+    finally:
+        current_node.reset(token)
+
+
 def profile_node(func):
-    """ノード実行時間を計測するデコレーター"""
+    """ノード実行時間を計測するデコレーター（async関数にも対応）"""
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            node_name = func.__name__
+            with _node_span(node_name) as span:
+                result = await func(*args, **kwargs)
+            print(f"[Profile] {node_name}: {span.duration:.2f}秒")
+            return result
+        return async_wrapper
+
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
         node_name = func.__name__
-        profiler.start(node_name)
-        try:
+        with _node_span(node_name) as span:
             result = func(*args, **kwargs)
-            elapsed = profiler.end(node_name)
-            print(f"[Profile] {node_name}: {elapsed:.2f}秒")
-            return result
-        except Exception as e:
-            profiler.end(node_name)
-            raise e
-    return wrapper
\ No newline at end of file
+        print(f"[Profile] {node_name}: {span.duration:.2f}秒")
+        return result
+    return wrapper
+
+
+def profile_tool(func):
+    """ツール関数をノードの子スパンとして計測するデコレーター（async関数にも対応、標準出力には表示しない）"""
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            with profiler.span(func.__name__, "tool"):
+                return await func(*args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with profiler.span(func.__name__, "tool"):
+            return func(*args, **kwargs)
+    return wrapper
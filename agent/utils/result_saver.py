@@ -1,3 +1,5 @@
+import asyncio
+import inspect
 import os
 import json
 import fcntl  # 追加: 排他制御用
@@ -19,8 +21,68 @@ def _convert_pydantic_objects(obj):
     else:
         return obj
 
+def _save_result_to_file(node_name, state, result_data):
+    """ノード結果を res/{patient_id}.json に排他制御付きでマージ保存する"""
+    # 副作用が state に影響しないようにする
+    try:
+        patient_id = state.get("patient_id", "unknown")
+        res_dir = "res"
+        os.makedirs(res_dir, exist_ok=True)
+        out_path = os.path.join(res_dir, f"{patient_id}.json")
+
+        # ファイルが存在しない場合は空のJSONを作成しておく
+        if not os.path.exists(out_path):
+            with open(out_path, 'w', encoding='utf-8') as f:
+                json.dump({}, f)
+
+        # 排他制御付きで読み書きを行う
+        with open(out_path, 'r+', encoding='utf-8') as f:
+            # 排他ロックを取得 (ブロッキング)
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                content = f.read()
+                if content.strip():
+                    try:
+                        data_for_saving = json.loads(content)
+                    except json.JSONDecodeError:
+                        # JSONが壊れている場合は空からやり直す（またはログ出力）
+                        print(f"[WARNING] JSON decode error in {out_path}. Overwriting.")
+                        data_for_saving = {}
+                else:
+                    data_for_saving = {}
+
+                # 今回の結果をマージ
+                data_for_saving.update(result_data)
+
+                # ファイル保存用に、Pydanticオブジェクトを再帰的に辞書へ変換
+                serializable_data = _convert_pydantic_objects(data_for_saving)
+
+                # ファイルの先頭に戻って書き込む
+                f.seek(0)
+                f.truncate()
+                json.dump(serializable_data, f, ensure_ascii=False, indent=2)
+                
+            finally:
+                # ロック解放
+                fcntl.flock(f, fcntl.LOCK_UN)
+    
+    except Exception as e:
+        print(f"[ERROR in result_saver for node '{node_name}']: {e}")
+        # ファイル保存に失敗しても、エージェントの実行は継続させる
+
 def save_result(node_name):
     def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(state):
+                result_data = await func(state)
+                if not result_data or not isinstance(result_data, dict):
+                    return result_data
+                # ファイルロック待ちでイベントループを止めないようスレッドで保存する
+                await asyncio.to_thread(_save_result_to_file, node_name, state, result_data)
+                return result_data
+            return async_wrapper
+
         @wraps(func)
         def wrapper(state):
             # 1. 元のノード関数を実行し、Pydanticオブジェクトを含む結果を取得
@@ -31,55 +93,10 @@ def save_result(node_name):
                 return result_data
 
             # --- ファイル保存ロジック ---
-            # 副作用が state に影響しないようにする
-            try:
-                patient_id = state.get("patient_id", "unknown")
-                res_dir = "res"
-                os.makedirs(res_dir, exist_ok=True)
-                out_path = os.path.join(res_dir, f"{patient_id}.json")
-
-                # ファイルが存在しない場合は空のJSONを作成しておく
-                if not os.path.exists(out_path):
-                    with open(out_path, 'w', encoding='utf-8') as f:
-                        json.dump({}, f)
-
-                # 排他制御付きで読み書きを行う
-                with open(out_path, 'r+', encoding='utf-8') as f:
-                    # 排他ロックを取得 (ブロッキング)
-                    fcntl.flock(f, fcntl.LOCK_EX)
-                    try:
-                        content = f.read()
-                        if content.strip():
-                            try:
-                                data_for_saving = json.loads(content)
-                            except json.JSONDecodeError:
-                                # JSONが壊れている場合は空からやり直す（またはログ出力）
-                                print(f"[WARNING] JSON decode error in {out_path}. Overwriting.")
-                                data_for_saving = {}
-                        else:
-                            data_for_saving = {}
-
-                        # 今回の結果をマージ
-                        data_for_saving.update(result_data)
-
-                        # ファイル保存用に、Pydanticオブジェクトを再帰的に辞書へ変換
-                        serializable_data = _convert_pydantic_objects(data_for_saving)
-
-                        # ファイルの先頭に戻って書き込む
-                        f.seek(0)
-                        f.truncate()
-                        json.dump(serializable_data, f, ensure_ascii=False, indent=2)
-                        
-                    finally:
-                        # ロック解放
-                        fcntl.flock(f, fcntl.LOCK_UN)
-            
-            except Exception as e:
-                print(f"[ERROR in result_saver for node '{node_name}']: {e}")
-                # ファイル保存に失敗しても、エージェントの実行は継続させる
+            _save_result_to_file(node_name, state, result_data)
 
             # 2. LangGraphには、元の変更されていない結果を返す
             # これにより、state内のオブジェクトはPydanticオブジェクトのまま維持される
             return result_data
         return wrapper
-    return decorator
\ No newline at end of file
+    return decorator
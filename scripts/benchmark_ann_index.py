@@ -0,0 +1,197 @@
+import sys
+import os
+import argparse
+import time
+
+import faiss
+import numpy as np
+
+# プロジェクトのルートディレクトリをシステムパスに追加
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from agent.utils.faiss_index import (
+    DEFAULT_HNSW_EF_CONSTRUCTION,
+    QUANTIZED_TYPES,
+    RerankingIndex,
+    build_index,
+    coarse_base,
+    configure_search,
+    default_ivf_nlist,
+    index_path,
+    reconstruct_vectors,
+    save_vectors,
+    truncate_vectors,
+    vectors_path,
+    write_index,
+)
+from agent.utils.profiler import _percentile
+
+
+INDEX_BASES = {
+    "phenotype": "agent/data/DataForDiseaseSearchFromHPO/phenotype_index",
+    "omim": "agent/data/DataForOmimMapping/DataForOmimMapping",
+}
+
+
+def make_queries(vectors: np.ndarray, n: int, seed: int) -> np.ndarray:
+    """
+    実際のクエリに近いベンチマーク用クエリを作る。
+    登録済みベクトルそのものでは自明に 1 位が当たるため、2〜5 件の平均にノイズを加えて正規化する。
+    """
+    rng = np.random.default_rng(seed)
+    queries = np.empty((n, vectors.shape[1]), dtype="float32")
+    for i in range(n):
+        rows = rng.choice(len(vectors), size=rng.integers(2, 6), replace=False)
+        queries[i] = vectors[rows].mean(axis=0) + rng.normal(0, 0.01, vectors.shape[1])
+    faiss.normalize_L2(queries)
+    return queries
+
+
+def measure(index: faiss.Index, queries: np.ndarray, k: int):
+    """実行時と同じく1件ずつ検索し、結果とクエリごとのレイテンシ（ミリ秒）を返す"""
+    results = np.empty((len(queries), k), dtype="int64")
+    latencies = []
+    for i in range(len(queries)):
+        start = time.perf_counter()
+        _, indices = index.search(queries[i:i + 1], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results[i] = indices[0]
+    return results, sorted(latencies)
+
+
+def index_megabytes(index: faiss.Index) -> float:
+    return len(faiss.serialize_index(index)) / 1024 / 1024
+
+
+def recall_at(results: np.ndarray, truth: np.ndarray, k: int) -> float:
+    hits = sum(len(set(r[:k]) & set(t[:k])) for r, t in zip(results, truth))
+    return hits / (len(truth) * k)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark HNSW / IVF FAISS indexes against the flat index (recall@k, latency, build time)")
+    parser.add_argument('--target', choices=sorted(INDEX_BASES), default='phenotype', help='Which index to benchmark')
+    parser.add_argument('--base', help='Index path without extension (overrides --target)')
+    parser.add_argument('--queries', help='Query vectors (.npy). Defaults to synthetic queries built from the index vectors')
+    parser.add_argument('-n', '--num-queries', type=int, default=500, help='Number of synthetic queries')
+    parser.add_argument('-k', type=int, default=10, help='k for recall@k')
+    parser.add_argument('--min-recall', type=float, default=0.99, help='Recall@k required when recommending an index')
+    parser.add_argument('--hnsw-m', type=int, nargs='+', default=[16, 32], help='HNSW M values to try')
+    parser.add_argument('--ef-search', type=int, nargs='+', default=[32, 64, 128, 256], help='HNSW efSearch values to try')
+    parser.add_argument('--nlist', type=int, nargs='+', help='IVF nlist values to try (default: about 4*sqrt(n))')
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[8, 16, 32, 64], help='IVF / PQ nprobe values to try')
+    parser.add_argument('--pq-m', type=int, nargs='+', help='PQ sub-vector counts to try (default: dim/32)')
+    parser.add_argument('--rerank-factor', type=int, default=10, help='Candidates per result re-ranked in float32 for fp16/pq (0 disables)')
+    parser.add_argument('--coarse-dims', type=int, nargs='*', default=[256, 512], help='Truncated dimensions to try for two-stage search')
+    parser.add_argument('--coarse-candidates', type=int, nargs='+', default=[100, 300], help='Coarse candidates re-ranked on full vectors')
+    parser.add_argument('--save', action='store_true', help='Write the recommended index to <base>.<type>.bin')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    base = args.base or INDEX_BASES[args.target]
+    flat = faiss.read_index(index_path(base, "flat"))
+    vectors = reconstruct_vectors(flat)
+    print(f"Loaded {index_path(base, 'flat')}: {flat.ntotal} vectors, dim {flat.d}")
+
+    if args.queries:
+        queries = np.ascontiguousarray(np.load(args.queries), dtype="float32")
+        faiss.normalize_L2(queries)
+    else:
+        queries = make_queries(vectors, args.num_queries, args.seed)
+    k = min(args.k, flat.ntotal)
+
+    truth, flat_latencies = measure(flat, queries, k)
+    rows = [{
+        "name": "flat", "type": "flat", "params": {}, "build": 0.0, "recall": 1.0, "size": index_megabytes(flat),
+        "p50": _percentile(flat_latencies, 50), "p99": _percentile(flat_latencies, 99), "index": flat,
+    }]
+
+    # 構築パラメータごとに1回構築し、検索時パラメータだけを変えて測定する
+    nlists = args.nlist or [default_ivf_nlist(flat.ntotal)]
+    candidates = [("hnsw", {"hnsw_m": m}, "ef_search", args.ef_search) for m in args.hnsw_m]
+    candidates += [("ivf", {"nlist": nlist}, "nprobe", args.nprobe) for nlist in nlists]
+    candidates += [("fp16", {}, None, [None])]
+    candidates += [
+        ("pq", {"nlist": nlist, **({"pq_m": m} if m else {})}, "nprobe", args.nprobe)
+        for nlist in nlists for m in (args.pq_m or [None])
+    ]
+    for index_type, build_params, search_param, search_values in candidates:
+        start = time.perf_counter()
+        index = build_index(vectors, index_type, ef_construction=DEFAULT_HNSW_EF_CONSTRUCTION, **build_params)
+        build_seconds = time.perf_counter() - start
+        size = index_megabytes(index)
+        if index_type in QUANTIZED_TYPES and args.rerank_factor > 0:
+            index = RerankingIndex(index, vectors, args.rerank_factor)
+        for value in search_values:
+            params = dict(build_params)
+            if search_param:
+                configure_search(index, **{search_param: value})
+                params[search_param] = value
+            results, latencies = measure(index, queries, k)
+            rows.append({
+                "name": " ".join([index_type] + [f"{key}={val}" for key, val in params.items()]),
+                "type": index_type, "params": params, "build": build_seconds, "size": size,
+                "recall": recall_at(results, truth, k),
+                "p50": _percentile(latencies, 50), "p99": _percentile(latencies, 99), "index": index,
+            })
+
+    # 2段階検索: 切り詰めたベクトルの flat で粗検索し、全次元で再ランキングする
+    for dim in args.coarse_dims:
+        if dim >= flat.d:
+            continue
+        start = time.perf_counter()
+        coarse = build_index(truncate_vectors(vectors, dim), "flat")
+        build_seconds = time.perf_counter() - start
+        for n_candidates in args.coarse_candidates:
+            index = RerankingIndex(coarse, vectors, rerank_factor=0, coarse_dim=dim, min_candidates=n_candidates)
+            results, latencies = measure(index, queries, k)
+            rows.append({
+                "name": f"coarse{dim} candidates={n_candidates}", "type": "coarse",
+                "params": {"coarse_dim": dim, "coarse_candidates": n_candidates},
+                "build": build_seconds, "size": index_megabytes(coarse),
+                "recall": recall_at(results, truth, k),
+                "p50": _percentile(latencies, 50), "p99": _percentile(latencies, 99), "index": index,
+            })
+
+    print(f"\n{len(queries)} queries, recall@{k} against flat (fp16/pq re-rank factor {args.rerank_factor})")
+    print(f"{'index':<32} {'recall':>8} {'p50 ms':>9} {'p99 ms':>9} {'build s':>9} {'size MB':>9}")
+    for row in rows:
+        print(
+            f"{row['name']:<32} {row['recall']:>8.4f} {row['p50']:>9.3f} {row['p99']:>9.3f} "
+            f"{row['build']:>9.1f} {row['size']:>9.1f}"
+        )
+
+    eligible = [row for row in rows if row["recall"] >= args.min_recall]
+    best = min(eligible, key=lambda row: row["p50"])
+    print(f"\nFastest index with recall@{k} >= {args.min_recall}: {best['name']}")
+    if best["type"] == "flat":
+        return
+    prefix = "PHENOTYPE" if args.target == "phenotype" else "OMIM"
+    if best["type"] == "coarse":
+        dim = best["params"]["coarse_dim"]
+        print(f"  {prefix}_COARSE_DIM={dim}")
+        print(f"  {prefix}_COARSE_CANDIDATES={best['params']['coarse_candidates']}")
+        if args.save:
+            write_index(best["index"].index, index_path(coarse_base(base, dim), "flat"))
+            save_vectors(base, vectors)
+            print(f"Saved {index_path(coarse_base(base, dim), 'flat')} and {vectors_path(base)}")
+        return
+    print(f"  {prefix}_INDEX_TYPE={best['type']}")
+    if "ef_search" in best["params"]:
+        print(f"  {prefix}_HNSW_EF_SEARCH={best['params']['ef_search']}")
+    if "nprobe" in best["params"]:
+        print(f"  {prefix}_IVF_NPROBE={best['params']['nprobe']}")
+    if best["type"] in QUANTIZED_TYPES:
+        print(f"  {prefix}_RERANK_FACTOR={args.rerank_factor}")
+    if args.save:
+        search_params = {key: val for key, val in best["params"].items() if key in ("ef_search", "nprobe")}
+        index = configure_search(best["index"], **search_params)
+        write_index(index.index if isinstance(index, RerankingIndex) else index, index_path(base, best["type"]))
+        print(f"Saved {index_path(base, best['type'])}")
+        if best["type"] in QUANTIZED_TYPES:
+            save_vectors(base, vectors)
+            print(f"Saved {vectors_path(base)}")
+
+
+if __name__ == "__main__":
+    main()
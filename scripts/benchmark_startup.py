@@ -0,0 +1,264 @@
+import sys
+import os
+import json
+import time
+import argparse
+import platform
+import subprocess
+
+# プロジェクトのルートディレクトリをシステムパスに追加
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(PROJECT_ROOT)
+
+from scripts.check_import_budget import DEFAULT_MODULES
+from agent.utils.profiler import _percentile
+
+
+REPORT_SCHEMA_VERSION = 1
+BENCHMARK_HPO_LIST = ["HP:0001263", "HP:0001250", "HP:0000252"]
+
+# ベンチマーク中は実在しない値を使う（.env より優先される。load_dotenv は既存の環境変数を上書きしない）
+STUB_ENV = {
+    "AZURE_DBCLS_JAPANEAST": "benchmark-stub-key",
+    "PIPELINE_CHECKPOINT_PATH": "",
+}
+STUB_MODEL_ENV = {
+    "ENDPOINT": "https://benchmark-stub.invalid/",
+    "API_KEY": "benchmark-stub-key",
+    "DEPLOYMENT_NAME": "benchmark-stub",
+    "API_VERSION": "2024-05-01-preview",
+}
+
+
+def _stub_environment(model_name: str) -> dict:
+    from agent.llm.azure_llm_instance import MODEL_ENV_PREFIX
+    env = dict(STUB_ENV)
+    prefix = MODEL_ENV_PREFIX[model_name]
+    env.update({f"{prefix}_{key}": value for key, value in STUB_MODEL_ENV.items()})
+    return env
+
+
+# ---- 子プロセス側（新しいインタプリタで1項目だけ測る） ----
+
+_network_attempts = []
+
+
+def _block_network():
+    """名前解決と接続をすべて失敗させ、試みた接続先を記録する（起動処理が通信していないことの確認）"""
+    import socket
+
+    def refuse(kind):
+        def _refuse(*args, **kwargs):
+            _network_attempts.append(f"{kind} {args[1] if kind == 'connect' else args[0]!r}"[:200])
+            raise OSError(f"network access is stubbed out during the startup benchmark ({kind})")
+        return _refuse
+
+    socket.getaddrinfo = refuse("getaddrinfo")
+    original_connect = socket.socket.connect
+    refuse_connect = refuse("connect")
+
+    def connect(self, address):
+        if self.family == getattr(socket, "AF_UNIX", None):
+            return original_connect(self, address)
+        return refuse_connect(self, address)
+
+    socket.socket.connect = connect
+
+
+def _rss_mb() -> dict:
+    import resource
+    # Linux の ru_maxrss は KB（macOS はバイト）
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_mb = peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+    current_mb = None
+    try:
+        with open("/proc/self/statm") as f:
+            current_mb = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError):
+        pass
+    return {"peak_rss_mb": peak_mb, "rss_mb": current_mb}
+
+
+def _child_import(module: str) -> dict:
+    import importlib
+    start = time.perf_counter()
+    importlib.import_module(module)
+    return {"import_s": time.perf_counter() - start, **_rss_mb()}
+
+
+def _child_pipeline(model_name: str) -> dict:
+    result = {}
+    start = time.perf_counter()
+    from agent.agent_pipeline import RareDiseaseDiagnosisPipeline
+    result["import_s"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    pipeline = RareDiseaseDiagnosisPipeline(model_name=model_name)
+    result["construct_s"] = time.perf_counter() - start
+
+    # 最初のノード（BeginningOfFlowNode）の更新が返るまで。以降のノード（API を呼ぶもの）は実行しない
+    start = time.perf_counter()
+    initial_state = pipeline._build_initial_state(hpo_list=BENCHMARK_HPO_LIST, patient_id="startup-benchmark")
+    updates = pipeline.graph.stream(initial_state, stream_mode="updates")
+    try:
+        first_update = next(updates)
+    finally:
+        updates.close()
+    result["first_node_s"] = time.perf_counter() - start
+    result["first_node"] = next(iter(first_update), None)
+    result.update(_rss_mb())
+    return result
+
+
+def run_child(task: str, argument: str):
+    _block_network()
+    sys.path.insert(0, PROJECT_ROOT)
+    # ノードやツールの標準出力がレポートの JSON と混ざらないよう、計測中は標準エラーへ流す
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+    try:
+        result = _child_import(argument) if task == "import" else _child_pipeline(argument)
+    finally:
+        sys.stdout = stdout
+    result["network_attempts"] = _network_attempts
+    print(json.dumps(result))
+
+
+# ---- 親プロセス側 ----
+
+def spawn(task: str, argument: str, env: dict) -> dict:
+    start = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", task, argument],
+        cwd=PROJECT_ROOT, env=env, capture_output=True, text=True,
+    )
+    wall = time.perf_counter() - start
+    if completed.returncode != 0:
+        error = completed.stderr.strip().splitlines()
+        return {"error": error[-1] if error else f"exit {completed.returncode}"}
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result["process_wall_s"] = wall
+    return result
+
+
+def summarize(runs: list) -> dict:
+    """各指標の中央値・最小値・最大値（エラーのある実行は除く）"""
+    ok = [run for run in runs if "error" not in run]
+    summary = {"runs": len(runs), "errors": sorted({run["error"] for run in runs if "error" in run})}
+    for key in sorted({key for run in ok for key, value in run.items() if isinstance(value, (int, float))}):
+        values = sorted(run[key] for run in ok if isinstance(run.get(key), (int, float)))
+        summary[key] = {"median": _percentile(values, 50), "min": values[0], "max": values[-1]}
+    attempts = sorted({attempt for run in ok for attempt in run.get("network_attempts", [])})
+    summary["network_attempts"] = attempts
+    if ok and "first_node" in ok[0]:
+        summary["first_node"] = ok[0]["first_node"]
+    return summary
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def compare(report: dict, baseline: dict, max_regression: float) -> list:
+    """中央値がベースラインより max_regression（比率）を超えて悪化した指標の一覧"""
+    regressions = []
+    sections = [("pipeline", report["pipeline"], baseline.get("pipeline", {}))]
+    sections += [(f"imports.{module}", summary, baseline.get("imports", {}).get(module, {}))
+                 for module, summary in report["imports"].items()]
+    for name, current, previous in sections:
+        for key, stats in current.items():
+            if not isinstance(stats, dict) or not isinstance(previous.get(key), dict):
+                continue
+            before, after = previous[key]["median"], stats["median"]
+            if before > 0 and after > before * (1 + max_regression):
+                regressions.append(f"{name}.{key}: {before:.3f} -> {after:.3f} (+{(after / before - 1) * 100:.0f}%)")
+    return regressions
+
+
+def print_summary(report: dict):
+    def line(label, summary):
+        if summary.get("errors") and "import_s" not in summary:
+            print(f"  {label:<40} error: {summary['errors'][0]}", file=sys.stderr)
+            return
+        fields = [f"{key} {summary[key]['median']:.3f}" for key in ("import_s", "construct_s", "first_node_s", "process_wall_s") if key in summary]
+        if "peak_rss_mb" in summary:
+            fields.append(f"peak RSS {summary['peak_rss_mb']['median']:.0f} MB")
+        print(f"  {label:<40} " + ", ".join(fields), file=sys.stderr)
+        if summary.get("network_attempts"):
+            print(f"    network attempts: {', '.join(summary['network_attempts'][:5])}", file=sys.stderr)
+
+    print(f"[StartupBenchmark] {report['repeat']} cold runs each (median seconds)", file=sys.stderr)
+    for module, summary in report["imports"].items():
+        line(module, summary)
+    if report["pipeline"]:
+        line("RareDiseaseDiagnosisPipeline", report["pipeline"])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure cold import time, pipeline construction, time-to-first-node and peak RSS with network access stubbed out"
+    )
+    parser.add_argument('--child', nargs=2, metavar=('TASK', 'ARG'), help=argparse.SUPPRESS)
+    parser.add_argument('--modules', nargs='*', default=DEFAULT_MODULES, help='Modules to cold-import (each in a fresh interpreter)')
+    parser.add_argument('--model', default='gpt-4o', help='Model name passed to RareDiseaseDiagnosisPipeline')
+    parser.add_argument('-n', '--repeat', type=int, default=3, help='Fresh-interpreter runs per measurement')
+    parser.add_argument('--skip-pipeline', action='store_true', help='Only measure module imports')
+    parser.add_argument('-o', '--output', default=None, help='Write the JSON report here (default: stdout)')
+    parser.add_argument('--history', default=None, help='Also append the report as one line to this JSONL file')
+    parser.add_argument('--baseline', default=None, help='Previous JSON report to compare medians against')
+    parser.add_argument(
+        '--max-regression', type=float, default=0.2,
+        help='Fail when a median is more than this fraction slower than --baseline (default 0.2)'
+    )
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(*args.child)
+        return
+
+    env = {**os.environ, **_stub_environment(args.model)}
+    imports = {}
+    for module in args.modules:
+        imports[module] = summarize([spawn("import", module, env) for _ in range(args.repeat)])
+    pipeline = {} if args.skip_pipeline else summarize([spawn("pipeline", args.model, env) for _ in range(args.repeat)])
+
+    report = {
+        "schema_version": REPORT_SCHEMA_VERSION,
+        "created_at": time.time(),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "model": args.model,
+        "imports": imports,
+        "pipeline": pipeline,
+    }
+    print_summary(report)
+
+    encoded = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(encoded + "\n")
+        print(f"Report saved to {args.output}", file=sys.stderr)
+    else:
+        print(encoded)
+    if args.history:
+        with open(args.history, "a", encoding="utf-8") as f:
+            f.write(json.dumps(report, ensure_ascii=False) + "\n")
+
+    failed = any(summary["errors"] for summary in [*imports.values(), pipeline] if summary)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.max_regression)
+        for regression in regressions:
+            print(f"[StartupBenchmark] regression {regression}", file=sys.stderr)
+        failed = failed or bool(regressions)
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import sys
+import os
+import json
+import argparse
+import subprocess
+
+# プロジェクトのルートディレクトリをシステムパスに追加
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(PROJECT_ROOT)
+
+
+# import 時間を確認するモジュール（CLI・ワーカーが最初に読み込むもの）
+DEFAULT_MODULES = [
+    "agent.agent_pipeline",
+    "agent.nodes",
+    "agent.tools.diseaseNormalize",
+    "agent.tools.embeddingSearchWithHPO",
+    "agent.llm.azure_llm_instance",
+]
+# import しただけで読み込まれてはいけないモジュール（最初の利用時に読み込む）
+DEFAULT_FORBIDDEN = ["langchain_community", "ddgs"]
+DEFAULT_BUDGET_SECONDS = float(os.getenv("IMPORT_TIME_BUDGET", "1.0"))
+
+# 新しいインタプリタで1モジュールだけを import し、所要時間と読み込まれたモジュールを JSON で返す
+PROBE = """
+import importlib, json, sys, time
+start = time.perf_counter()
+importlib.import_module(sys.argv[1])
+print(json.dumps({"seconds": time.perf_counter() - start, "modules": sorted(sys.modules)}))
+"""
+
+
+def parse_importtime(stderr: str) -> list:
+    """-X importtime の出力から (自身の時間 [s], 累積 [s], モジュール名) の一覧を作る"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append((int(self_us) / 1e6, int(cumulative_us) / 1e6, name.strip()))
+    return rows
+
+
+def measure_import(module: str) -> dict:
+    """新しいプロセスで module を import し、時間・上位の重いモジュール・読み込まれたモジュールを返す"""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE, module],
+        cwd=PROJECT_ROOT, capture_output=True, text=True,
+    )
+    if completed.returncode != 0:
+        error = completed.stderr.strip().splitlines()
+        return {"module": module, "error": error[-1] if error else f"exit {completed.returncode}"}
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    rows = parse_importtime(completed.stderr)
+    # 自身の時間が大きいものと、パッケージ単位の累積時間が大きいもの（トップレベルのみ）
+    top_level = [row for row in rows if "." not in row[2]]
+    return {
+        "module": module,
+        "seconds": result["seconds"],
+        "modules": result["modules"],
+        "slowest_self": sorted(rows, reverse=True)[:10],
+        "slowest_packages": sorted(top_level, key=lambda row: row[1], reverse=True)[:10],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that importing the pipeline modules stays within a time budget")
+    parser.add_argument('modules', nargs='*', default=DEFAULT_MODULES, help='Modules to import (each in a fresh interpreter)')
+    parser.add_argument(
+        '--budget', type=float, default=DEFAULT_BUDGET_SECONDS,
+        help='Maximum import time per module in seconds (default: IMPORT_TIME_BUDGET or 1.0)'
+    )
+    parser.add_argument(
+        '--forbid', nargs='*', default=DEFAULT_FORBIDDEN,
+        help='Top-level packages that must not be loaded by the import alone'
+    )
+    parser.add_argument('-v', '--verbose', action='store_true', help='Show the slowest imports for every module')
+    args = parser.parse_args()
+
+    failures = 0
+    for module in args.modules:
+        report = measure_import(module)
+        if "error" in report:
+            print(f"[ImportBudget] {module}: import failed ({report['error']})")
+            failures += 1
+            continue
+
+        loaded = {name.split(".", 1)[0] for name in report["modules"]}
+        forbidden = sorted(set(args.forbid) & loaded)
+        over_budget = report["seconds"] > args.budget
+        status = "OK" if not (over_budget or forbidden) else "FAIL"
+        print(f"[ImportBudget] {status} {module}: {report['seconds']:.3f}s (budget {args.budget:.3f}s)")
+        if forbidden:
+            print(f"  loaded at import: {', '.join(forbidden)}")
+        if over_budget or forbidden or args.verbose:
+            print("  slowest packages (cumulative):")
+            for _, cumulative, name in report["slowest_packages"]:
+                print(f"    {cumulative:7.3f}s  {name}")
+            print("  slowest modules (self):")
+            for self_time, _, name in report["slowest_self"]:
+                print(f"    {self_time:7.3f}s  {name}")
+        failures += status == "FAIL"
+
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
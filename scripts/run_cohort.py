@@ -0,0 +1,282 @@
+import sys
+import os
+import asyncio
+import glob
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import TYPE_CHECKING
+
+# プロジェクトのルートディレクトリをシステムパスに追加
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from agent.utils.profiler import profiler
+from agent.utils.accounting import accounting
+from scripts.run_from_phenopacket import (
+    parse_phenopacket,
+    format_final_diagnosis,
+    get_result_file_path,
+    save_final_diagnosis,
+)
+
+# パイプラインと正規化ツールは import が重いため、run_cohort() の中で読み込む（--help を速く返すため）
+if TYPE_CHECKING:
+    from agent.agent_pipeline import RareDiseaseDiagnosisPipeline
+
+
+COHORT_DEFAULT_CONCURRENCY = int(os.getenv("COHORT_CONCURRENCY", "4"))
+
+
+def collect_cohort_entries(source: str) -> list[dict]:
+    """
+    ディレクトリまたはマニフェストファイルから、処理対象のPhenopacket一覧を作成する。
+
+    - ディレクトリ: 直下の *.json をすべて対象とする。
+    - マニフェスト: 1行1件。`<phenopacket_path>[<TAB><image_path>]` 形式。
+      空行と '#' で始まる行は無視し、相対パスはマニフェストの場所を基準に解決する。
+    """
+    if os.path.isdir(source):
+        return [
+            {"phenopacket": path, "image": None}
+            for path in sorted(glob.glob(os.path.join(source, "*.json")))
+        ]
+
+    base_dir = os.path.dirname(os.path.abspath(source))
+    entries = []
+    with open(source, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            columns = line.split("\t")
+            phenopacket_path = columns[0].strip()
+            image_path = columns[1].strip() if len(columns) > 1 and columns[1].strip() else None
+            if not os.path.isabs(phenopacket_path):
+                phenopacket_path = os.path.join(base_dir, phenopacket_path)
+            if image_path and not os.path.isabs(image_path):
+                image_path = os.path.join(base_dir, image_path)
+            entries.append({"phenopacket": phenopacket_path, "image": image_path})
+    return entries
+
+
+class CohortProgress:
+    """コホート実行の進捗とスループット（patients/min）を集計する"""
+
+    def __init__(self, total: int):
+        self.total = total
+        self.succeeded = 0
+        self.failed = 0
+        self.skipped = 0
+        self.start_time = time.time()
+        self._lock = threading.Lock()
+
+    def update(self, status: str, patient_id: str, elapsed: float):
+        with self._lock:
+            if status == "ok":
+                self.succeeded += 1
+            elif status == "skipped":
+                self.skipped += 1
+            else:
+                self.failed += 1
+            done = self.succeeded + self.failed + self.skipped
+            processed = self.succeeded + self.failed
+            wall = time.time() - self.start_time
+            throughput = processed / (wall / 60) if wall > 0 else 0.0
+            remaining = self.total - done
+            eta_text = f"{remaining / throughput:.1f}分" if throughput > 0 else "N/A"
+            print(
+                f"[Cohort] {done}/{self.total} ({patient_id}: {status}, {elapsed:.1f}秒) | "
+                f"成功 {self.succeeded}, 失敗 {self.failed}, スキップ {self.skipped} | "
+                f"{throughput:.2f} patients/min | 残り約 {eta_text}"
+            )
+
+    def summary(self) -> str:
+        wall = time.time() - self.start_time
+        processed = self.succeeded + self.failed
+        throughput = processed / (wall / 60) if wall > 0 else 0.0
+        return (
+            f"コホート処理完了: 合計 {self.total} 件 "
+            f"(成功 {self.succeeded}, 失敗 {self.failed}, スキップ {self.skipped}), "
+            f"経過時間 {wall:.1f}秒, スループット {throughput:.2f} patients/min"
+        )
+
+
+def _prepare_patient(entry: dict, model_name: str, enable_log: bool):
+    """
+    Phenopacketを解析し、pipeline.run / arun に渡す引数を作成する。
+    戻り値: (status, patient_id, run_kwargs, result_file_path)。実行不要の場合 run_kwargs は None。
+    """
+    try:
+        patient_data = parse_phenopacket(entry["phenopacket"])
+    except Exception as e:
+        print(f"エラー: Phenopacketファイルの解析に失敗しました ({entry['phenopacket']}): {e}")
+        return "failed", os.path.basename(entry["phenopacket"]), None, None
+
+    patient_id = patient_data["patient_id"]
+    result_file_path = get_result_file_path(model_name, patient_id)
+    if os.path.exists(result_file_path):
+        return "skipped", patient_id, None, None
+
+    image_path = entry.get("image")
+    if image_path and not os.path.exists(image_path):
+        print(f"警告: 指定された画像ファイルが見つかりません: {image_path}")
+        image_path = None
+
+    run_kwargs = {
+        "hpo_list": patient_data["present_hpo_list"],
+        "absent_hpo_list": patient_data["absent_hpo_list"],
+        "image_path": image_path,
+        "onset": patient_data["onset"],
+        "sex": patient_data["sex"],
+        "patient_id": patient_id,
+        "verbose": False,
+        "log_filename": f"{patient_id}_{model_name.replace('gpt-', '')}.log" if enable_log else None,
+    }
+    return "pending", patient_id, run_kwargs, result_file_path
+
+
+def _save_patient_result(final_state, patient_id: str, result_file_path: str):
+    final_diagnosis_data = format_final_diagnosis(final_state.get("finalDiagnosis"))
+    if not save_final_diagnosis(result_file_path, final_diagnosis_data):
+        return "failed", patient_id
+    return "ok", patient_id
+
+
+def run_single_patient(pipeline: "RareDiseaseDiagnosisPipeline", entry: dict, model_name: str, enable_log: bool):
+    """
+    共有パイプラインで1患者分の診断を実行し、結果ファイルを保存する。
+    戻り値: (status, patient_id)。status は "ok" / "skipped" / "failed"。
+    """
+    status, patient_id, run_kwargs, result_file_path = _prepare_patient(entry, model_name, enable_log)
+    if run_kwargs is None:
+        return status, patient_id
+
+    try:
+        final_state = pipeline.run(**run_kwargs)
+    except Exception as e:
+        print(f"エラー: 患者 {patient_id} の診断に失敗しました: {type(e).__name__}: {e}")
+        return "failed", patient_id
+
+    return _save_patient_result(final_state, patient_id, result_file_path)
+
+
+async def arun_single_patient(pipeline: "RareDiseaseDiagnosisPipeline", entry: dict, model_name: str, enable_log: bool):
+    """run_single_patient の非同期版。pipeline.arun を使う。"""
+    status, patient_id, run_kwargs, result_file_path = _prepare_patient(entry, model_name, enable_log)
+    if run_kwargs is None:
+        return status, patient_id
+
+    try:
+        final_state = await pipeline.arun(**run_kwargs)
+    except Exception as e:
+        print(f"エラー: 患者 {patient_id} の診断に失敗しました: {type(e).__name__}: {e}")
+        return "failed", patient_id
+
+    return _save_patient_result(final_state, patient_id, result_file_path)
+
+
+def _run_entries(pipeline, entries, model_name, concurrency, enable_log, progress):
+    def _task(entry):
+        start = time.time()
+        status, patient_id = run_single_patient(pipeline, entry, model_name, enable_log)
+        progress.update(status, patient_id, time.time() - start)
+        return status
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        futures = [executor.submit(_task, entry) for entry in entries]
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                print(f"[Cohort] 予期しないエラー: {e}")
+
+
+async def _arun_entries(pipeline, entries, model_name, concurrency, enable_log, progress):
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def _task(entry):
+        async with semaphore:
+            start = time.time()
+            try:
+                status, patient_id = await arun_single_patient(pipeline, entry, model_name, enable_log)
+            except Exception as e:
+                print(f"[Cohort] 予期しないエラー: {e}")
+                status, patient_id = "failed", os.path.basename(entry["phenopacket"])
+            progress.update(status, patient_id, time.time() - start)
+
+    await asyncio.gather(*[_task(entry) for entry in entries])
+
+
+def run_cohort(source: str, model_name: str, concurrency: int, enable_log: bool = True, use_async: bool = False, checkpoint_path: str = None, accounting_path: str = None, trace_path: str = None) -> int:
+    """
+    1つのパイプライン（コンパイル済みグラフ・ロード済みインデックス・LLMラッパー）を共有し、
+    複数患者を最大 concurrency 件まで並行して診断する。
+    use_async=True の場合はスレッドではなく1つのイベントループ上で pipeline.arun を並行実行する。
+    accounting_path を指定すると、呼び出しごとのトークン数・待ち時間・コストを JSON（拡張子 .csv なら CSV）で保存する。
+    trace_path を指定すると、全患者のノード・ツール・外部呼び出しのスパンを Chrome trace 形式で保存する。
+    """
+    entries = collect_cohort_entries(source)
+    if not entries:
+        print(f"処理対象のPhenopacketが見つかりません: {source}")
+        return 1
+
+    # 同一Phenopacketの重複指定は1回だけ処理する
+    seen = set()
+    unique_entries = []
+    for entry in entries:
+        key = os.path.abspath(entry["phenopacket"])
+        if key in seen:
+            continue
+        seen.add(key)
+        unique_entries.append(entry)
+
+    print(f"{len(unique_entries)} 件のPhenopacketを処理します (モデル: {model_name}, 並行数: {concurrency})")
+
+    from agent.agent_pipeline import RareDiseaseDiagnosisPipeline
+    from agent.tools.diseaseNormalize import get_lexical_index, get_normalize_embedding_cache
+
+    pipeline = RareDiseaseDiagnosisPipeline(model_name=model_name, enable_log=enable_log, checkpoint_path=checkpoint_path)
+    progress = CohortProgress(len(unique_entries))
+
+    if use_async:
+        asyncio.run(_arun_entries(pipeline, unique_entries, model_name, concurrency, enable_log, progress))
+    else:
+        _run_entries(pipeline, unique_entries, model_name, concurrency, enable_log, progress)
+
+    print(profiler.get_summary())
+    print(pipeline.llm.dispatcher.get_summary())
+    print(accounting.get_summary())
+    print(get_normalize_embedding_cache().get_summary())
+    lexical_index = get_lexical_index()
+    if lexical_index is not None:
+        print(lexical_index.get_summary())
+    if accounting_path:
+        if accounting_path.endswith(".csv"):
+            accounting.export_csv(accounting_path)
+        else:
+            accounting.export_json(accounting_path)
+        print(f"呼び出し集計を保存しました: {accounting_path}")
+    if trace_path:
+        profiler.export_chrome_trace(trace_path)
+        print(f"トレースを保存しました: {trace_path} (chrome://tracing または https://ui.perfetto.dev で表示)")
+    if pipeline.llm.response_cache is not None:
+        print(pipeline.llm.response_cache.get_summary())
+    print(progress.summary())
+    return 0 if progress.failed == 0 else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the rare disease diagnosis pipeline over a cohort of Phenopacket JSON files.")
+    parser.add_argument("--cohort", type=str, required=True, help="Directory of Phenopacket JSON files, or a manifest file (one '<phenopacket>[<TAB><image>]' per line).")
+    parser.add_argument("--model", type=str, default="gpt-4o", choices=["gpt-4o", "gpt-5-1", "gpt-5-2"], help="The name of the model to use.")
+    parser.add_argument("--concurrency", type=int, default=COHORT_DEFAULT_CONCURRENCY, help="Maximum number of patients diagnosed at the same time.")
+    parser.add_argument("--no-log", action="store_true", help="Disable per-patient log files under log/.")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="Run patients on one asyncio event loop via pipeline.arun() instead of threads.")
+    parser.add_argument("--accounting", type=str, default=None, help="Optional output file for per-call token/latency/cost records (JSON, or CSV if it ends with .csv).")
+    parser.add_argument("--trace", type=str, default=None, help="Optional Chrome-trace/Perfetto JSON output with node, tool and outbound-call spans for every patient.")
+    parser.add_argument("--checkpoint", type=str, default=None, help="Optional SQLite file for graph checkpoints, keyed by patient_id, model and inputs, so a killed run resumes mid-graph.")
+
+    args = parser.parse_args()
+
+    sys.exit(run_cohort(args.cohort, args.model, args.concurrency, enable_log=not args.no_log, use_async=args.use_async, checkpoint_path=args.checkpoint, accounting_path=args.accounting, trace_path=args.trace))
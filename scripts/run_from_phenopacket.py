@@ -7,7 +7,7 @@ import time
 # プロジェクトのルートディレクトリをシステムパスに追加
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from agent.agent_pipeline import RareDiseaseDiagnosisPipeline
+# パイプライン（LangGraph・LLM クライアント等）は import が重いため、実行時に読み込む（--help を速く返すため）
 
 def parse_phenopacket(file_path: str) -> dict:
     """
@@ -15,7 +15,12 @@ def parse_phenopacket(file_path: str) -> dict:
     """
     with open(file_path, 'r', encoding='utf-8') as f:
         phenopacket = json.load(f)
+    return extract_patient_data(phenopacket)
 
+def extract_patient_data(phenopacket: dict) -> dict:
+    """
+    読み込み済みの Phenopacket（dict）から、パイプラインの入力に必要な情報を抽出する。
+    """
     subject = phenopacket.get('subject', {})
     patient_id = subject.get('id', 'unknown_patient')
     sex = subject.get('sex', 'Unknown')
@@ -63,15 +68,39 @@ def format_final_diagnosis(final_diagnosis_obj) -> dict:
     
     return {"ans": ans_list, "reference": top_level_reference}
 
-def run_pipeline_from_phenopacket(phenopacket_path: str, model_name: str, image_path_arg: str = None, output_mode: str = 'file'):
+def get_result_dir(model_name: str) -> str:
+    """
+    モデルごとの結果保存ディレクトリ (ans_<model>) の絶対パスを返す。
+    """
+    project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+    return os.path.join(project_root, f'ans_{model_name.replace("gpt-", "")}')
+
+def get_result_file_path(model_name: str, patient_id: str) -> str:
+    """
+    患者IDに対応する最終診断結果ファイルのパスを返す。
+    """
+    return os.path.join(get_result_dir(model_name), f"{patient_id}.json")
+
+def save_final_diagnosis(result_file_path: str, final_diagnosis_data: dict) -> bool:
+    """
+    整形済みの最終診断結果をJSONとして保存する。
+    """
+    try:
+        os.makedirs(os.path.dirname(result_file_path), exist_ok=True)
+        with open(result_file_path, 'w', encoding='utf-8') as f:
+            json.dump(final_diagnosis_data, f, indent=4, ensure_ascii=False)
+        return True
+    except Exception as e:
+        print(f"結果ファイルの保存に失敗しました: {e}")
+        return False
+
+def run_pipeline_from_phenopacket(phenopacket_path: str, model_name: str, image_path_arg: str = None, output_mode: str = 'file', checkpoint_path: str = None):
     """
     指定されたPhenopacketファイルから情報を読み込み、診断パイプラインを実行する。
     output_modeに応じて、ファイル保存またはデータ返却を行う。
     """
     start_time = time.time()
 
-    project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
-    
     try:
         patient_data = parse_phenopacket(phenopacket_path)
         patient_id = patient_data["patient_id"]
@@ -83,10 +112,7 @@ def run_pipeline_from_phenopacket(phenopacket_path: str, model_name: str, image_
 
     result_file_path = None
     if output_mode == 'file':
-        res_dir_name = f'ans_{model_name.replace("gpt-", "")}'
-        res_dir = os.path.join(project_root, res_dir_name)
-        os.makedirs(res_dir, exist_ok=True)
-        result_file_path = os.path.join(res_dir, f"{patient_id}.json")
+        result_file_path = get_result_file_path(model_name, patient_id)
         if os.path.exists(result_file_path):
             print(f"結果ファイルが既に存在するため、処理をスキップします。")
             return 0
@@ -107,10 +133,12 @@ def run_pipeline_from_phenopacket(phenopacket_path: str, model_name: str, image_
     
     log_filename = f"{patient_id}_{model_name.replace('gpt-', '')}.log"
 
+    from agent.agent_pipeline import RareDiseaseDiagnosisPipeline
     pipeline = RareDiseaseDiagnosisPipeline(
         model_name=model_name,
         enable_log=(output_mode == 'file'), # ログファイル生成はfileモードの時のみとする
-        log_filename=log_filename
+        log_filename=log_filename,
+        checkpoint_path=checkpoint_path,
     )
     
     # verbose=Falseでパイプライン側のpretty_printを抑制
@@ -129,12 +157,8 @@ def run_pipeline_from_phenopacket(phenopacket_path: str, model_name: str, image_
 
     if output_mode == 'file' and result_file_path:
         # 結果をファイルに保存
-        try:
-            with open(result_file_path, 'w', encoding='utf-8') as f:
-                json.dump(final_diagnosis_data, f, indent=4, ensure_ascii=False)
+        if save_final_diagnosis(result_file_path, final_diagnosis_data):
             print(f"診断結果を保存しました: {result_file_path}")
-        except Exception as e:
-            print(f"結果ファイルの保存に失敗しました: {e}")
 
     if output_mode == 'return':
         # モジュールとして呼び出された場合は、整形したデータを返す
@@ -166,7 +190,8 @@ if __name__ == "__main__":
     parser.add_argument("--model", type=str, default="gpt-4o", choices=["gpt-4o", "gpt-5-1", "gpt-5-2"], help="The name of the model to use.")
     parser.add_argument("--image", type=str, default=None, help="Optional path to the patient's image file.")
     parser.add_argument("--output_mode", type=str, default="file", choices=["file", "print", "return"], help="Output mode: 'file' to save JSON, 'print' to print to stdout.")
+    parser.add_argument("--checkpoint", type=str, default=None, help="Optional SQLite file for graph checkpoints. Re-running the same patient resumes from the last completed node.")
     
     args = parser.parse_args()
     
-    run_pipeline_from_phenopacket(args.phenopacket, args.model, args.image, output_mode=args.output_mode)
\ No newline at end of file
+    run_pipeline_from_phenopacket(args.phenopacket, args.model, args.image, output_mode=args.output_mode, checkpoint_path=args.checkpoint)
\ No newline at end of file
@@ -0,0 +1,450 @@
+import sys
+import os
+import json
+import time
+import uuid
+import asyncio
+import argparse
+import threading
+import socketserver
+from collections import OrderedDict
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+
+# プロジェクトのルートディレクトリをシステムパスに追加
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from agent.utils.accounting import accounting
+from agent.utils.profiler import profiler
+from scripts.run_from_phenopacket import (
+    extract_patient_data,
+    format_final_diagnosis,
+    get_result_file_path,
+    save_final_diagnosis,
+)
+
+
+SERVE_DEFAULT_CONCURRENCY = int(os.getenv("SERVE_CONCURRENCY", "4"))
+MAX_REQUEST_BYTES = 10 * 1024 * 1024
+MAX_FINISHED_JOBS = 1000
+HEARTBEAT_SECONDS = 15.0
+TRUE_VALUES = ("1", "true", "yes", "on")
+
+
+class DiagnosisJob:
+    """1患者分の診断。進捗イベントを順に溜め、ストリーミング中のリクエストに配る"""
+
+    def __init__(self, patient_data: dict, image_path: Optional[str], options: dict):
+        self.job_id = uuid.uuid4().hex
+        self.patient_data = patient_data
+        self.patient_id = patient_data["patient_id"]
+        self.image_path = image_path
+        self.options = options
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.usage = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.events = []
+        self._condition = threading.Condition()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("completed", "failed")
+
+    def emit(self, event: str, status: Optional[str] = None, **fields):
+        # 状態の変更とイベントの追加を同じロックの中で行い、完了を見た読み手が最後のイベントを取りこぼさないようにする
+        with self._condition:
+            if status is not None:
+                self.status = status
+                if status in ("completed", "failed"):
+                    self.finished_at = time.time()
+            self.events.append({
+                "event": event, "job_id": self.job_id, "patient_id": self.patient_id,
+                "time": time.time(), **fields,
+            })
+            self._condition.notify_all()
+
+    def iter_events(self, heartbeat: float = HEARTBEAT_SECONDS):
+        """最初から順にイベントを返す。新しいイベントが heartbeat 秒来なければ None を返す（接続維持用）"""
+        position = 0
+        while True:
+            with self._condition:
+                if position >= len(self.events) and not self.finished:
+                    self._condition.wait(heartbeat)
+                pending = self.events[position:]
+                position = len(self.events)
+                done = self.finished
+            if not pending and not done:
+                yield None
+            yield from pending
+            if done:
+                return
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        with self._condition:
+            return self._condition.wait_for(lambda: self.finished, timeout)
+
+    def summary(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "patient_id": self.patient_id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "result": self.result,
+            "error": self.error,
+            "usage": self.usage,
+            "events": len(self.events),
+        }
+
+
+class DiagnosisService:
+    """
+    RareDiseaseDiagnosisPipeline を1つだけ作り、プロセスが終わるまで使い続ける。
+    患者はバックグラウンドのイベントループで pipeline.arun により並行実行し（同時実行数は concurrency）、
+    FAISS インデックス・HPO 表・API クライアントは起動時に読み込んで温めておく。
+    """
+
+    def __init__(self, model_name: str, concurrency: int, enable_log: bool = False,
+                 checkpoint_path: Optional[str] = None, save_results: bool = False):
+        self.model_name = model_name
+        self.concurrency = max(1, concurrency)
+        self.enable_log = enable_log
+        self.checkpoint_path = checkpoint_path
+        self.save_results = save_results
+        self.started_at = time.time()
+        self.warm_up_status = {}
+        self.pipeline = None
+        self.loop = asyncio.new_event_loop()
+        self._semaphore = None
+        self._jobs: "OrderedDict[str, DiagnosisJob]" = OrderedDict()
+        self._jobs_lock = threading.Lock()
+
+    def start(self, warm_up: bool = True):
+        from agent.agent_pipeline import RareDiseaseDiagnosisPipeline
+
+        start = time.time()
+        self.pipeline = RareDiseaseDiagnosisPipeline(
+            model_name=self.model_name, enable_log=self.enable_log, checkpoint_path=self.checkpoint_path,
+        )
+        print(f"[Serve] パイプラインを作成しました ({time.time() - start:.1f}秒)")
+        if warm_up:
+            self.warm_up()
+
+        threading.Thread(target=self.loop.run_forever, name="diagnosis-loop", daemon=True).start()
+        self._semaphore = self._call_in_loop(self._create_semaphore())
+
+    async def _create_semaphore(self):
+        return asyncio.Semaphore(self.concurrency)
+
+    def _call_in_loop(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def warm_up(self):
+        """遅延初期化しているリソースを先に読み込む。失敗しても起動は続ける（該当ツールは従来どおりスキップされる）"""
+        from agent.tools import diseaseNormalize, embeddingSearchWithHPO
+        from agent.utils.hpo_store import get_hpo_store
+
+        steps = [
+            ("hpo_store", lambda: len(get_hpo_store())),
+            ("disease_normalize", diseaseNormalize.warm_up),
+            ("phenotype_search", embeddingSearchWithHPO.warm_up),
+        ]
+        if self.checkpoint_path:
+            steps.append(("async_graph", lambda: self._call_once(self.pipeline._get_async_graph())))
+        for name, step in steps:
+            start = time.time()
+            try:
+                step()
+                self.warm_up_status[name] = {"ok": True, "seconds": round(time.time() - start, 3)}
+                print(f"[Serve] warm-up {name}: {time.time() - start:.2f}秒")
+            except Exception as e:
+                self.warm_up_status[name] = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+                print(f"[Serve] warm-up {name} に失敗しました: {type(e).__name__}: {e}")
+
+    def _call_once(self, coroutine):
+        # イベントループ起動前に非同期の初期化を済ませる（同じループで後から使うため self.loop で実行する）
+        return self.loop.run_until_complete(coroutine)
+
+    def submit(self, patient_data: dict, image_path: Optional[str] = None, options: Optional[dict] = None) -> DiagnosisJob:
+        job = DiagnosisJob(patient_data, image_path, options or {})
+        with self._jobs_lock:
+            self._jobs[job.job_id] = job
+            self._prune_jobs()
+        job.emit("queued")
+        asyncio.run_coroutine_threadsafe(self._run(job), self.loop)
+        return job
+
+    def _prune_jobs(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job_id]
+
+    def get_job(self, job_id: str) -> Optional[DiagnosisJob]:
+        with self._jobs_lock:
+            return self._jobs.get(job_id)
+
+    def stats(self) -> dict:
+        with self._jobs_lock:
+            statuses = [job.status for job in self._jobs.values()]
+        return {status: statuses.count(status) for status in ("queued", "running", "completed", "failed")}
+
+    @staticmethod
+    def _release_run_records(runs) -> dict:
+        """
+        ジョブのラン分のプロファイラーのスパンと呼び出し記録を破棄し、呼び出しの集計だけを返す。
+        常駐プロセスではグローバルな profiler / accounting に患者ごとの記録が溜まり続けるため。
+        """
+        run_ids = [run.run_id for run in runs]
+        profiler.discard_runs(run_ids)
+        records = accounting.discard_runs(run_ids)
+        return {
+            "calls": len(records),
+            "prompt_tokens": sum(r.prompt_tokens for r in records),
+            "completion_tokens": sum(r.completion_tokens for r in records),
+            "cost_usd": round(sum(r.cost_usd for r in records), 6),
+        }
+
+    async def _run(self, job: DiagnosisJob):
+        from agent.agent_pipeline import CHECKPOINT_PROGRESS_NODE
+
+        async with self._semaphore:
+            job.started_at = time.time()
+            job.emit("started", status="running")
+
+            def on_node(node_name, update):
+                if node_name == CHECKPOINT_PROGRESS_NODE:
+                    # 完了済みの場合はノードが実行されないため、チェックポイントを使ったことを明示する
+                    job.emit("resumed", checkpoint=update["checkpoint"], next=update["next"],
+                             elapsed_s=round(time.time() - job.started_at, 3))
+                    return
+                fields = {"node": node_name, "elapsed_s": round(time.time() - job.started_at, 3)}
+                if isinstance(update, dict):
+                    fields["updated"] = sorted(update)
+                    if "depth" in update:
+                        fields["depth"] = update["depth"]
+                job.emit("node", **fields)
+
+            patient = job.patient_data
+            log_filename = f"{job.patient_id}_{self.model_name.replace('gpt-', '')}.log" if self.enable_log else None
+            runs = []
+            try:
+                with profiler.capture_runs() as runs:
+                    final_state = await self.pipeline.arun(
+                        hpo_list=patient["present_hpo_list"],
+                        absent_hpo_list=patient["absent_hpo_list"],
+                        image_path=job.image_path,
+                        onset=patient["onset"],
+                        sex=patient["sex"],
+                        patient_id=job.patient_id,
+                        use_absentHPO=bool(job.options.get("use_absentHPO", False)),
+                        filter_impotance=bool(job.options.get("filter_impotance", False)),
+                        log_filename=log_filename,
+                        progress_callback=on_node,
+                    )
+                job.result = format_final_diagnosis(final_state.get("finalDiagnosis"))
+                if self.save_results:
+                    save_final_diagnosis(get_result_file_path(self.model_name, job.patient_id), job.result)
+            except Exception as e:
+                print(f"[Serve] 患者 {job.patient_id} の診断に失敗しました: {type(e).__name__}: {e}")
+                job.error = f"{type(e).__name__}: {e}"
+                job.usage = self._release_run_records(runs)
+                job.emit("failed", status="failed", error=job.error, elapsed_s=round(time.time() - job.started_at, 3))
+                return
+            job.usage = self._release_run_records(runs)
+            job.emit("completed", status="completed", result=job.result, elapsed_s=round(time.time() - job.started_at, 3))
+            print(f"[Serve] {job.patient_id}: 完了 ({job.finished_at - job.started_at:.1f}秒)")
+
+
+def parse_request_body(body: dict):
+    """
+    Phenopacket そのもの、または {"phenopacket": {...}, "image_path": ..., "options": {...}} を受け付ける。
+    戻り値: (patient_data, image_path, options)
+    """
+    if not isinstance(body, dict):
+        raise ValueError("request body must be a JSON object")
+    phenopacket = body.get("phenopacket", body)
+    if not isinstance(phenopacket, dict) or "phenotypicFeatures" not in phenopacket:
+        raise ValueError("phenopacket with phenotypicFeatures is required")
+    patient_data = extract_patient_data(phenopacket)
+    if not patient_data["present_hpo_list"]:
+        raise ValueError("phenopacket has no observed phenotypicFeatures")
+
+    image_path = body.get("image_path") if "phenopacket" in body else None
+    if image_path and not os.path.exists(image_path):
+        raise ValueError(f"image_path not found: {image_path}")
+    options = body.get("options", {}) if "phenopacket" in body else {}
+    return patient_data, image_path, options
+
+
+class DiagnosisRequestHandler(BaseHTTPRequestHandler):
+    """
+    POST /diagnose            Phenopacket を受け付ける（?stream=1 で進捗を返し続ける、?wait=1 で完了まで待つ）
+    GET  /jobs/<id>           状態と結果
+    GET  /jobs/<id>/events    進捗イベント（NDJSON。Accept: text/event-stream または ?format=sse なら SSE）
+    GET  /health              稼働状況と warm-up の結果
+    """
+
+    server_version = "RareDiseaseDiagnosis/1.0"
+    service: DiagnosisService = None
+
+    def log_message(self, format, *args):
+        print(f"[Serve] {self.command} {self.path} - {format % args}")
+
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _query(self) -> dict:
+        return {key: values[-1] for key, values in parse_qs(urlparse(self.path).query).items()}
+
+    def _flag(self, name: str) -> bool:
+        return self._query().get(name, "").lower() in TRUE_VALUES
+
+    def _stream_events(self, job: DiagnosisJob):
+        use_sse = "text/event-stream" in self.headers.get("Accept", "") or self._query().get("format") == "sse"
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8" if use_sse else "application/x-ndjson; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        try:
+            for event in job.iter_events():
+                if event is None:
+                    chunk = ": keep-alive\n\n" if use_sse else json.dumps({"event": "heartbeat", "job_id": job.job_id}) + "\n"
+                elif use_sse:
+                    chunk = f"event: {event['event']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+                else:
+                    chunk = json.dumps(event, ensure_ascii=False) + "\n"
+                self.wfile.write(chunk.encode("utf-8"))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # クライアントが切断しても診断は続ける（/jobs/<id> で結果を取得できる）
+            pass
+        self.close_connection = True
+
+    def do_GET(self):
+        path = urlparse(self.path).path.rstrip("/")
+        if path == "/health":
+            service = self.service
+            self._send_json(HTTPStatus.OK, {
+                "status": "ok",
+                "model": service.model_name,
+                "concurrency": service.concurrency,
+                "uptime_s": round(time.time() - service.started_at, 1),
+                "jobs": service.stats(),
+                "warm_up": service.warm_up_status,
+            })
+            return
+        parts = path.strip("/").split("/")
+        if len(parts) in (2, 3) and parts[0] == "jobs":
+            job = self.service.get_job(parts[1])
+            if job is None:
+                self._send_json(HTTPStatus.NOT_FOUND, {"error": f"unknown job {parts[1]}"})
+            elif len(parts) == 3 and parts[2] == "events":
+                self._stream_events(job)
+            elif len(parts) == 2:
+                self._send_json(HTTPStatus.OK, job.summary())
+            else:
+                self._send_json(HTTPStatus.NOT_FOUND, {"error": f"unknown path {path}"})
+            return
+        self._send_json(HTTPStatus.NOT_FOUND, {"error": f"unknown path {path}"})
+
+    def do_POST(self):
+        path = urlparse(self.path).path.rstrip("/")
+        if path != "/diagnose":
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": f"unknown path {path}"})
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0 or length > MAX_REQUEST_BYTES:
+            self._send_json(HTTPStatus.BAD_REQUEST, {"error": f"Content-Length must be between 1 and {MAX_REQUEST_BYTES}"})
+            return
+        try:
+            patient_data, image_path, options = parse_request_body(json.loads(self.rfile.read(length)))
+        except (ValueError, json.JSONDecodeError) as e:
+            self._send_json(HTTPStatus.BAD_REQUEST, {"error": str(e)})
+            return
+
+        job = self.service.submit(patient_data, image_path, options)
+        if self._flag("stream"):
+            self._stream_events(job)
+        elif self._flag("wait"):
+            job.wait()
+            self._send_json(HTTPStatus.OK, job.summary())
+        else:
+            self._send_json(HTTPStatus.ACCEPTED, {
+                "job_id": job.job_id,
+                "patient_id": job.patient_id,
+                "status": job.status,
+                "status_url": f"/jobs/{job.job_id}",
+                "events_url": f"/jobs/{job.job_id}/events",
+            })
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler は (host, port) 形式のアドレスを前提にしている
+        return request, ("unix", 0)
+
+
+def create_server(service: DiagnosisService, host: str, port: int, unix_socket: Optional[str]):
+    handler = type("BoundDiagnosisRequestHandler", (DiagnosisRequestHandler,), {"service": service})
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        return ThreadingUnixHTTPServer(unix_socket, handler)
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve the diagnosis pipeline over local HTTP or a Unix socket, keeping indexes and clients loaded"
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="Host to bind (ignored with --unix-socket)")
+    parser.add_argument("--port", type=int, default=8765, help="Port to bind (ignored with --unix-socket)")
+    parser.add_argument("--unix-socket", default=None, help="Serve on this Unix socket path instead of TCP")
+    parser.add_argument("--model", type=str, default="gpt-4o", choices=["gpt-4o", "gpt-5-1", "gpt-5-2"], help="The name of the model to use.")
+    parser.add_argument(
+        "--concurrency", type=int, default=SERVE_DEFAULT_CONCURRENCY,
+        help="Patients diagnosed at the same time (default: SERVE_CONCURRENCY or 4)"
+    )
+    parser.add_argument("--log", action="store_true", help="Write per-patient log files under log/")
+    parser.add_argument("--save-results", action="store_true", help="Also save final diagnoses to ans_<model>/<patient_id>.json")
+    parser.add_argument("--checkpoint", type=str, default=None, help="Optional SQLite file for graph checkpoints.")
+    parser.add_argument("--no-warm-up", action="store_true", help="Load indexes and clients on first use instead of at startup")
+    args = parser.parse_args()
+
+    service = DiagnosisService(
+        args.model, args.concurrency, enable_log=args.log, checkpoint_path=args.checkpoint, save_results=args.save_results,
+    )
+    service.start(warm_up=not args.no_warm_up)
+    server = create_server(service, args.host, args.port, args.unix_socket)
+    address = args.unix_socket or f"http://{args.host}:{args.port}"
+    print(f"[Serve] {address} で待ち受けています (モデル: {args.model}, 同時実行数: {service.concurrency})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("[Serve] 停止します")
+    finally:
+        server.server_close()
+        service.loop.call_soon_threadsafe(service.loop.stop)
+        if args.unix_socket and os.path.exists(args.unix_socket):
+            os.remove(args.unix_socket)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from agent.utils.embedding_cache import EmbeddingCache
+
+
+class EmbeddingCacheTornWriteTest(unittest.TestCase):
+    """書き込み途中で止まったプロセスがベクトルファイルに端数を残した場合"""
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.directory = self._tmp.name
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_rows_after_torn_write_keep_their_vectors(self):
+        cache = EmbeddingCache("test-model", directory=self.directory)
+        cache.put_many(["a", "b"], [np.full(4, 1.0), np.full(4, 2.0)])
+        with open(cache.vectors_path, "ab") as f:
+            f.write(b"\x00\x01")
+
+        cache.put("c", np.full(4, 7.0))
+        self.assertEqual(os.path.getsize(cache.vectors_path) % (4 * 4), 0)
+
+        # 別プロセス相当（LRU なし）でディスクから読み直す
+        reader = EmbeddingCache("test-model", directory=self.directory, lru_size=0)
+        np.testing.assert_array_equal(reader.get("a"), np.full(4, 1.0, dtype="float32"))
+        np.testing.assert_array_equal(reader.get("b"), np.full(4, 2.0, dtype="float32"))
+        np.testing.assert_array_equal(reader.get("c"), np.full(4, 7.0, dtype="float32"))
+
+    def test_row_past_end_of_file_is_a_miss(self):
+        cache = EmbeddingCache("test-model", directory=self.directory)
+        cache.put("a", np.full(4, 1.0))
+        # キーだけ書かれてベクトルが欠けた行（ファイル末尾が1行に満たない）
+        with open(cache.vectors_path, "ab") as f:
+            f.write(b"\x00" * 8)
+        with open(cache.keys_path, "a", encoding="ascii") as f:
+            f.write(f"{cache._key('partial')} 1\n")
+
+        reader = EmbeddingCache("test-model", directory=self.directory, lru_size=0)
+        self.assertIsNone(reader.get("partial"))
+        np.testing.assert_array_equal(reader.get("a"), np.full(4, 1.0, dtype="float32"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import os
+import re
+import sys
+import json
+import argparse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from agent.utils.data_bundle import DATA_DIR, DEFAULT_BUNDLE_PATH, BundleWriter, source_fingerprint
+from agent.utils.hpo_store import HPO_OBO_PATH, derive_replacements, parse_obo_replacements
+
+# バンドルに入れる参照データ（パスは agent/data からの相対パス）
+PHENOTYPE_MAPPING = 'phenotype_mapping.json'
+OMIM_MAPPING = 'DataForOmimMapping/omim_mapping.json'
+OMIM_INDEX_MAPPING = 'DataForOmimMapping/DataForOmimMapping.json'
+PHENOTYPE_INDEX_MAPPING = 'DataForDiseaseSearchFromHPO/phenotype_index.json'
+
+
+def omim_number(omim_id: str):
+    """diseaseNormalize.extract_omim_number と同じ規則（最初の数字列）"""
+    match = re.search(r'\d+', str(omim_id))
+    return match.group(0) if match else None
+
+
+def load_source(relative_path: str):
+    path = os.path.join(DATA_DIR, relative_path)
+    if not os.path.exists(path):
+        print(f"Skipping {relative_path} (not found)")
+        return None, None
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    return data, {"path": relative_path, **source_fingerprint(path)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile the reference JSON files into one memory-mappable binary bundle")
+    parser.add_argument('-o', '--output', default=DEFAULT_BUNDLE_PATH, help='Output bundle path')
+    parser.add_argument(
+        '--hpo-obo', default=HPO_OBO_PATH,
+        help='hp.obo used to resolve alt_id / obsolete HPO IDs (optional; skipped if missing)'
+    )
+    args = parser.parse_args()
+
+    writer = BundleWriter()
+
+    hpo_labels, source = load_source(PHENOTYPE_MAPPING)
+    if hpo_labels is not None:
+        writer.add_map("hpo_labels", hpo_labels, source)
+        print(f"hpo_labels: {len(hpo_labels)} entries")
+        # alt_id / obsolete の HPO ID → 現行 ID（hp.obo がなければ obsolete タームのラベルから引けるものだけ）
+        obo_replacements = None
+        if os.path.exists(args.hpo_obo):
+            obo_replacements = parse_obo_replacements(args.hpo_obo)
+            print(f"Loaded {len(obo_replacements)} replacements from {args.hpo_obo}")
+        replacements = derive_replacements(hpo_labels, obo_replacements)
+        writer.add_map("hpo_replacements", replacements, source)
+        print(f"hpo_replacements: {len(replacements)} entries")
+
+    omim_labels, source = load_source(OMIM_MAPPING)
+    if omim_labels is not None:
+        writer.add_map("omim_labels", omim_labels, source)
+        # diseaseNormalize が起動時に作っていた「OMIM 番号 → 病名」の辞書も事前に作っておく（後勝ち）
+        by_number = {}
+        for omim_id, label in omim_labels.items():
+            number = omim_number(omim_id)
+            if number:
+                by_number[number] = label
+        writer.add_map("omim_labels_by_number", by_number, source)
+        print(f"omim_labels: {len(omim_labels)} entries ({len(by_number)} by number)")
+
+    omim_index, source = load_source(OMIM_INDEX_MAPPING)
+    if omim_index is not None:
+        writer.add_strings("omim_index_ids", omim_index["omim_ids"], source)
+        writer.add_strings("omim_index_labels", omim_index["labels"], source)
+        print(f"omim_index: {len(omim_index['omim_ids'])} rows")
+
+    phenotype_index, source = load_source(PHENOTYPE_INDEX_MAPPING)
+    if phenotype_index is not None:
+        writer.add_json_records("phenotype_index_entries", phenotype_index, source)
+        print(f"phenotype_index_entries: {len(phenotype_index)} rows")
+
+    writer.write(args.output)
+    print(f"Bundle saved to {args.output} ({os.path.getsize(args.output) / 1024 / 1024:.1f} MB)")
+
+if __name__ == "__main__":
+    main()
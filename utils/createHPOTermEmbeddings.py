@@ -0,0 +1,99 @@
+import os
+import sys
+import json
+import math
+import argparse
+import numpy as np
+from openai import AzureOpenAI
+from dotenv import load_dotenv
+
+load_dotenv()
+
+def main():
+    parser = argparse.ArgumentParser(description="Embed every HPO term label once so phenotype queries can be composed locally")
+    parser.add_argument(
+        '-j', '--json',
+        default='agent/data/phenotype_mapping.json',
+        help='Path to phenotype_mapping.json ({HPO_ID: label})'
+    )
+    parser.add_argument(
+        '-o', '--output',
+        default='agent/data/DataForDiseaseSearchFromHPO/hpo_term_embeddings',
+        help='Output file path (without extension)'
+    )
+    parser.add_argument(
+        '--importance',
+        default='HPO_importance/HPO_importance.json',
+        help='Path to HPO_importance.json (related_disease_num per HPO term, used for IC weights)'
+    )
+    parser.add_argument('--tenant', default='dbcls', help='Azure tenant name')
+    parser.add_argument('--region', default='japaneast', help='Azure region')
+    parser.add_argument('--model', default='text-embedding-3-large', help='Azure OpenAI embedding model')
+    args = parser.parse_args()
+
+    # Azure OpenAIの設定
+    deployment_name = f"{args.region}-{args.model}"
+    endpoint = f"https://{args.tenant}-{args.region}.openai.azure.com/"
+    api_key = os.getenv(f"AZURE_{args.tenant.upper()}_{args.region.upper()}")
+    if not api_key:
+        print(f"AZURE_{args.tenant.upper()}_{args.region.upper()} is not set in .env")
+        sys.exit(1)
+
+    client = AzureOpenAI(
+        azure_endpoint=endpoint,
+        api_key=api_key,
+        api_version="2024-05-01-preview"
+    )
+
+    # HPOタームの読み込み（ラベルが空のタームは埋め込まない）
+    with open(args.json, encoding="utf-8") as f:
+        phenotype_mapping = json.load(f)
+    hpo_ids = [hpo_id for hpo_id, label in phenotype_mapping.items() if label]
+    labels = [phenotype_mapping[hpo_id] for hpo_id in hpo_ids]
+    print(f"Loaded {len(labels)} HPO term labels.")
+
+    # 情報量 (IC) の計算: IC = log(全疾患数 / そのタームを持つ疾患数)
+    # 全疾患数にはルートターム（全疾患に付与される）の疾患数、つまり related_disease_num の最大値を使う。
+    # 疾患数が不明なタームは最も情報量の高いタームと同じ扱いにする
+    ic = [1.0] * len(hpo_ids)
+    if os.path.exists(args.importance):
+        with open(args.importance, encoding="utf-8") as f:
+            related = {
+                item["HPO_id"]: int(item["related_disease_num"])
+                for item in json.load(f)
+                if "HPO_id" in item and "related_disease_num" in item
+            }
+        total = max(related.values(), default=1)
+        ic = [math.log(total / max(related.get(hpo_id, 1), 1)) for hpo_id in hpo_ids]
+        print(f"Computed IC weights from {args.importance} ({total} diseases).")
+    else:
+        print(f"Warning: {args.importance} not found. All terms get weight 1.0.")
+
+    # ベクトル化
+    print("Embedding HPO term labels with Azure OpenAI...")
+    batch_size = 100
+    embeddings = []
+    for i in range(0, len(labels), batch_size):
+        batch = labels[i:i+batch_size]
+        response = client.embeddings.create(
+            model=deployment_name,
+            input=batch,
+        )
+        batch_vectors = [item.embedding for item in response.data]
+        embeddings.extend(batch_vectors)
+        print(f"Embedded {i+len(batch)}/{len(labels)}")
+
+    embeddings = np.array(embeddings, dtype='float32')
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    print(f"Embedding shape: {embeddings.shape}")
+
+    # 保存（ベクトルは .npy、タームの並びと IC は .json）
+    output_base = args.output
+    os.makedirs(os.path.dirname(os.path.abspath(output_base)), exist_ok=True)
+    np.save(f"{output_base}.npy", embeddings)
+    with open(f"{output_base}.json", "w", encoding="utf-8") as f:
+        json.dump({"model": args.model, "hpo_ids": hpo_ids, "ic": ic}, f, ensure_ascii=False)
+    print(f"Term embeddings saved to {output_base}.npy and {output_base}.json")
+
+if __name__ == "__main__":
+    main()
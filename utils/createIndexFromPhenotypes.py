@@ -7,6 +7,13 @@ import faiss
 from openai import AzureOpenAI
 from dotenv import load_dotenv
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from agent.utils.embedding_builder import DEFAULT_CONCURRENCY, DEFAULT_REQUESTS_PER_MINUTE, embed_texts
+from agent.utils.faiss_index import (
+    INDEX_TYPES, QUANTIZED_TYPES, build_index, coarse_base, index_path, save_vectors, truncate_vectors, vectors_path,
+    write_index, write_json,
+)
+
 load_dotenv()
 
 def main():
@@ -24,6 +31,21 @@ def main():
     parser.add_argument('--tenant', default='dbcls', help='Azure tenant name')
     parser.add_argument('--region', default='japaneast', help='Azure region')
     parser.add_argument('--model', default='text-embedding-3-large', help='Azure OpenAI embedding model')
+    parser.add_argument(
+        '--index-types', nargs='+', default=['flat'], choices=INDEX_TYPES,
+        help='Index types to build (flat is written to <output>.bin, others to <output>.<type>.bin; fp16/pq also write <output>.vectors.npy)'
+    )
+    parser.add_argument(
+        '--coarse-dims', nargs='*', type=int, default=[],
+        help='Also build coarse indexes on vectors truncated to these dimensions (e.g. 256 512) for two-stage search'
+    )
+    parser.add_argument(
+        '--store-dir', default=None,
+        help='Per-text embedding store reused across runs (default: embedding_store next to the output)'
+    )
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY, help='Concurrent embedding requests')
+    parser.add_argument('--requests-per-minute', type=float, default=DEFAULT_REQUESTS_PER_MINUTE, help='Embedding request budget')
+    parser.add_argument('--tokens-per-minute', type=float, default=0, help='Embedding token budget (0 = unlimited)')
     args = parser.parse_args()
 
     # Azure OpenAIの設定
@@ -68,35 +90,41 @@ def main():
 
     # ベクトル化
     print("Embedding phenotype lists with Azure OpenAI...")
-    batch_size = 100  # Azure OpenAIのバッチサイズ制限を考慮
-    embeddings = []
-    for i in range(0, len(phenotype_texts), batch_size):
-        batch = phenotype_texts[i:i+batch_size]
-        response = client.embeddings.create(
-            model=deployment_name,
-            input=batch,
-        )
-        batch_vectors = [item.embedding for item in response.data]
-        embeddings.extend(batch_vectors)
-        print(f"Embedded {i+len(batch)}/{len(phenotype_texts)}")
-
-    embeddings = np.array(embeddings, dtype='float32')
+    # 前回までに embedding 済みのテキスト（内容のハッシュで照合）は再利用し、新規・変更分だけを並列に送る
+    store_dir = args.store_dir or os.path.join(os.path.dirname(os.path.abspath(args.output)), 'embedding_store')
+    embeddings = embed_texts(
+        client, deployment_name, args.model, phenotype_texts, store_dir,
+        concurrency=args.concurrency,
+        requests_per_minute=args.requests_per_minute,
+        tokens_per_minute=args.tokens_per_minute or None,
+    )
     print(f"Embedding shape: {embeddings.shape}")
 
     # FAISSインデックス作成（コサイン類似度）
-    index = faiss.IndexFlatIP(embeddings.shape[1])
     faiss.normalize_L2(embeddings)  # ベクトルを正規化
-    index.add(embeddings)
 
-    # 保存
+    # 保存（各ファイルは一時ファイルから置き換える。稼働中のワーカーはマッピングの置き換えを合図に読み込み直すので、マッピングは最後に書く）
     output_base = args.output
-    faiss.write_index(index, f"{output_base}.bin")
+    for index_type in args.index_types:
+        index = build_index(embeddings, index_type)
+        write_index(index, index_path(output_base, index_type))
+        print(f"Saved {index_type} index to {index_path(output_base, index_type)}")
+    # 2段階検索用: 先頭 N 次元に切り詰めたベクトルの粗検索インデックス（embedding は共通）
+    for dim in args.coarse_dims:
+        truncated = truncate_vectors(embeddings, dim)
+        for index_type in args.index_types:
+            path = index_path(coarse_base(output_base, dim), index_type)
+            write_index(build_index(truncated, index_type), path)
+            print(f"Saved {dim}-d coarse {index_type} index to {path}")
+    # fp16 / pq と2段階検索は上位候補を float32 ベクトルで再ランキングするため、ベクトルも保存する
+    if args.coarse_dims or any(index_type in QUANTIZED_TYPES for index_type in args.index_types):
+        save_vectors(output_base, embeddings)
+        print(f"Saved full-precision vectors to {vectors_path(output_base)}")
     
     # マッピングファイルとして、phenotypeを持つエントリのリスト全体を保存
-    with open(f"{output_base}.json", "w", encoding="utf-8") as f:
-        json.dump(valid_entries, f, ensure_ascii=False, indent=2)
-        
-    print(f"Index and mapping data saved to {output_base}.bin and {output_base}.json")
+    write_json(valid_entries, f"{output_base}.json", ensure_ascii=False, indent=2)
+
+    print(f"Mapping data saved to {output_base}.json")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -8,6 +8,12 @@ import faiss
 from openai import AzureOpenAI
 from dotenv import load_dotenv
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from agent.utils.embedding_builder import DEFAULT_CONCURRENCY, DEFAULT_REQUESTS_PER_MINUTE, embed_texts
+from agent.utils.faiss_index import (
+    INDEX_TYPES, QUANTIZED_TYPES, build_index, index_path, save_vectors, vectors_path, write_index, write_json,
+)
+
 load_dotenv()
 
 def main():
@@ -17,6 +23,17 @@ def main():
     parser.add_argument('--tenant', default='dbcls', help='Azure tenant name')
     parser.add_argument('--region', default='japaneast', help='Azure region')
     parser.add_argument('--model', default='text-embedding-3-large', help='Azure OpenAI embedding model')
+    parser.add_argument(
+        '--index-types', nargs='+', default=['flat'], choices=INDEX_TYPES,
+        help='Index types to build (flat is written to <output>.bin, others to <output>.<type>.bin; fp16/pq also write <output>.vectors.npy)'
+    )
+    parser.add_argument(
+        '--store-dir', default=None,
+        help='Per-text embedding store reused across runs (default: embedding_store next to the output)'
+    )
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY, help='Concurrent embedding requests')
+    parser.add_argument('--requests-per-minute', type=float, default=DEFAULT_REQUESTS_PER_MINUTE, help='Embedding request budget')
+    parser.add_argument('--tokens-per-minute', type=float, default=0, help='Embedding token budget (0 = unlimited)')
     args = parser.parse_args()
 
     # Azure OpenAIの設定
@@ -47,32 +64,31 @@ def main():
 
     # ベクトル化
     print("Embedding disease labels with Azure OpenAI...")
-    batch_size = 100
-    embeddings = []
-    for i in range(0, len(disease_labels), batch_size):
-        batch = disease_labels[i:i+batch_size]
-        response = client.embeddings.create(
-            model=deployment_name,
-            input=batch,
-        )
-        batch_vectors = [item.embedding for item in response.data]
-        embeddings.extend(batch_vectors)
-        print(f"Embedded {i+len(batch)}/{len(disease_labels)}")
-
-    embeddings = np.array(embeddings, dtype='float32')
+    # 前回までに embedding 済みのテキスト（内容のハッシュで照合）は再利用し、新規・変更分だけを並列に送る
+    store_dir = args.store_dir or os.path.join(os.path.dirname(os.path.abspath(args.output)), 'embedding_store')
+    embeddings = embed_texts(
+        client, deployment_name, args.model, disease_labels, store_dir,
+        concurrency=args.concurrency,
+        requests_per_minute=args.requests_per_minute,
+        tokens_per_minute=args.tokens_per_minute or None,
+    )
     print(f"Embedding shape: {embeddings.shape}")
 
     # FAISSインデックス作成（コサイン類似度）
-    index = faiss.IndexFlatIP(embeddings.shape[1])
     faiss.normalize_L2(embeddings)
-    index.add(embeddings)
 
-    # 保存
+    # 保存（各ファイルは一時ファイルから置き換える。稼働中のワーカーはマッピングの置き換えを合図に読み込み直すので、マッピングは最後に書く）
     output_base = args.output
-    faiss.write_index(index, f"{output_base}.bin")
-    with open(f"{output_base}.json", "w", encoding="utf-8") as f:
-        json.dump({"omim_ids": omim_ids, "labels": disease_labels}, f, ensure_ascii=False, indent=2)
-    print(f"Index and mapping saved to {output_base}.bin and {output_base}.json")
+    for index_type in args.index_types:
+        index = build_index(embeddings, index_type)
+        write_index(index, index_path(output_base, index_type))
+        print(f"Saved {index_type} index to {index_path(output_base, index_type)}")
+    # fp16 / pq は上位候補を float32 ベクトルで再ランキングするため、ベクトルも保存する
+    if any(index_type in QUANTIZED_TYPES for index_type in args.index_types):
+        save_vectors(output_base, embeddings)
+        print(f"Saved full-precision vectors to {vectors_path(output_base)}")
+    write_json({"omim_ids": omim_ids, "labels": disease_labels}, f"{output_base}.json", ensure_ascii=False, indent=2)
+    print(f"Mapping saved to {output_base}.json")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file